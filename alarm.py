@@ -0,0 +1,447 @@
+"""
+Alarm node: turns detection results into notifications.
+
+Subscribes to every `detection` service and checks each detected object
+against ALARM_RULES (class, confidence, camera, zone, time window). Rules
+are indexed by class, so a message only checks the rules that can match
+its objects. A rule fires at most once per ALARM_COOLDOWN seconds for the
+same camera and class; repeats within the window are counted and reported
+with the next alarm instead of sent.
+
+Alarms go to pluggable sinks (ALARM_SINKS: log, JSON-lines file, webhook).
+Each sink has its own bounded queue and thread, which delivers alarms in
+batches and retries with backoff, so a slow sink never stalls the
+subscription or the other sinks. Any object with a send(alarms) method can
+be passed as a sink.
+"""
+import asyncio
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from datetime import datetime
+
+import requests
+import zmq
+
+# Add parent directory to path to import config
+sys.path.append('.')
+
+from config import (
+    ALARM_BATCH_INTERVAL,
+    ALARM_BATCH_SIZE,
+    ALARM_COOLDOWN,
+    ALARM_MAX_BACKOFF,
+    ALARM_QUEUE,
+    ALARM_RULES,
+    ALARM_SINKS,
+    ALARM_STATS_INTERVAL,
+    ALARM_TIMEOUT,
+)
+from runtime import AsyncZMQNode
+from tsdb import TimeSeriesStore
+from utils import TOPIC_DETECTION, subscribe
+
+ANY_CLASS = "*"
+
+
+def parse_clock(value):
+    """Minutes since midnight of an "HH:MM" clock time."""
+    hours, minutes = value.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+class Rule:
+    """One alarm condition on a detected object."""
+
+    def __init__(self, name, classes=(ANY_CLASS,), min_confidence=0.0, cameras=None, nodes=None,
+                 zone=None, hours=None, days=None, cooldown=ALARM_COOLDOWN, sinks=None):
+        self.name = name
+        self.classes = tuple(classes)
+        self.min_confidence = min_confidence
+        self.cameras = set(cameras) if cameras else None
+        self.nodes = set(nodes) if nodes else None  # motion node IDs
+        self.zone = zone  # [x1, y1, x2, y2]; the object's box center must be inside
+        # ("22:00", "06:00") wraps past midnight
+        self.hours = (parse_clock(hours[0]), parse_clock(hours[1])) if hours else None
+        self.days = set(days) if days is not None else None  # 0 = Monday
+        self.cooldown = cooldown
+        self.sinks = sinks  # sink names; None for every sink
+
+    def in_window(self, when):
+        if self.days is not None and when.weekday() not in self.days:
+            return False
+        if self.hours is None:
+            return True
+        minute = when.hour * 60 + when.minute
+        start, end = self.hours
+        if start <= end:
+            return start <= minute < end
+        return minute >= start or minute < end
+
+    def in_zone(self, box):
+        if self.zone is None:
+            return True
+        if not box:
+            return False
+        cx, cy = (box[0] + box[2]) / 2, (box[1] + box[3]) / 2
+        return self.zone[0] <= cx <= self.zone[2] and self.zone[1] <= cy <= self.zone[3]
+
+    def matches(self, detection, sender, camera_id, when):
+        # Cheapest checks first; the class was already matched by the index
+        return (
+            detection.get("confidence", 0.0) >= self.min_confidence
+            and (self.cameras is None or camera_id in self.cameras)
+            and (self.nodes is None or sender in self.nodes)
+            and self.in_zone(detection.get("box"))
+            and self.in_window(when)
+        )
+
+
+class RuleIndex:
+    """Rules by object class; a class maps to its own rules plus the wildcard ones."""
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self.wildcard = tuple(rule for rule in self.rules if ANY_CLASS in rule.classes)
+        by_class = {}
+        for rule in self.rules:
+            for object_class in rule.classes:
+                if object_class != ANY_CLASS:
+                    by_class.setdefault(object_class, []).append(rule)
+        self.by_class = {
+            object_class: tuple(rules) + tuple(r for r in self.wildcard if r not in rules)
+            for object_class, rules in by_class.items()
+        }
+
+    def candidates(self, object_class):
+        return self.by_class.get(object_class, self.wildcard)
+
+
+class AlarmEngine:
+    """Evaluate detection_results messages against the rules, with per-key cool-down."""
+
+    def __init__(self, rules):
+        self.index = RuleIndex(rules)
+        self.last_fired = {}  # (rule, sender, camera_id, class) -> monotonic time
+        self.suppressed = {}  # same key -> matches dropped since it last fired
+        self.messages = 0
+        self.fired = 0
+        self.suppressed_total = 0
+
+    def evaluate(self, message, now=None):
+        """Return the alarms one detection_results message raises."""
+        self.messages += 1
+        detections = message.get("detections")
+        if not detections:
+            return []
+        now = time.monotonic() if now is None else now
+        sender = message.get("sender")
+        camera_id = message.get("camera_id")
+        try:
+            when = datetime.fromisoformat(message.get("ts"))
+        except (TypeError, ValueError):
+            when = datetime.now()
+
+        # Several objects of one class in a message raise a single alarm
+        matched = {}  # key -> (rule, best detection, count)
+        for detection in detections:
+            object_class = detection.get("class")
+            for rule in self.index.candidates(object_class):
+                if not rule.matches(detection, sender, camera_id, when):
+                    continue
+                key = (rule.name, sender, camera_id, object_class)
+                previous = matched.get(key)
+                if previous is None:
+                    matched[key] = (rule, detection, 1)
+                else:
+                    best = max(previous[1], detection, key=lambda d: d.get("confidence", 0.0))
+                    matched[key] = (rule, best, previous[2] + 1)
+
+        alarms = []
+        for key, (rule, detection, count) in matched.items():
+            last = self.last_fired.get(key)
+            if last is not None and now - last < rule.cooldown:
+                self.suppressed[key] = self.suppressed.get(key, 0) + 1
+                self.suppressed_total += 1
+                continue
+            self.last_fired[key] = now
+            alarms.append((rule, {
+                "type": "alarm",
+                "rule": rule.name,
+                "sender": sender,
+                "camera_id": camera_id,
+                "class": key[3],
+                "confidence": detection.get("confidence"),
+                "box": detection.get("box"),
+                "count": count,
+                "suppressed": self.suppressed.pop(key, 0),  # repeats since the last alarm
+                "detector": message.get("node_id"),
+                "ts": message.get("ts"),
+            }))
+        self.fired += len(alarms)
+        return alarms
+
+    def prune(self, now=None):
+        """Forget expired cool-downs, except those with suppressed matches still to report."""
+        now = time.monotonic() if now is None else now
+        longest = max((rule.cooldown for rule in self.index.rules), default=0)
+        for key in [k for k, last in self.last_fired.items()
+                    if now - last >= longest and k not in self.suppressed]:
+            del self.last_fired[key]
+
+    def take_stats(self):
+        """Return and reset (messages, alarms fired, matches suppressed)."""
+        stats = (self.messages, self.fired, self.suppressed_total)
+        self.messages = self.fired = self.suppressed_total = 0
+        return stats
+
+
+class LogSink:
+    """Write alarms to the node's log."""
+
+    def send(self, alarms):
+        for alarm in alarms:
+            logging.warning(f"[ALARM] {alarm['rule']}: {alarm['count']} x {alarm['class']} "
+                            f"on {alarm['sender']}/{alarm['camera_id']} at {alarm['ts']}")
+        return True
+
+
+class FileSink:
+    """Append alarms to a JSON-lines file."""
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def send(self, alarms):
+        try:
+            with open(self.path, "a") as f:
+                f.write("".join(json.dumps(alarm) + "\n" for alarm in alarms))
+        except OSError as e:
+            logging.error(f"[ALARM] Cannot write {self.path}: {e}")
+            return False
+        return True
+
+
+class WebhookSink:
+    """POST each batch as a JSON list (push, SMS or mail gateways)."""
+
+    def __init__(self, url, timeout=ALARM_TIMEOUT, headers=None):
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update(headers or {})
+
+    def send(self, alarms):
+        try:
+            response = self.session.post(self.url, json=alarms, timeout=self.timeout)
+        except requests.RequestException as e:
+            logging.warning(f"[ALARM] Webhook unreachable: {e}")
+            return False
+        if response.status_code < 300:
+            return True
+        if response.status_code == 429 or response.status_code >= 500:
+            logging.warning(f"[ALARM] Webhook busy: {response.status_code}")
+            return False
+        logging.error(f"[ALARM] Webhook rejected {len(alarms)} alarms: {response.status_code}")
+        return None
+
+
+SINK_TYPES = {"log": LogSink, "file": FileSink, "webhook": WebhookSink}
+
+
+def make_sinks(config=ALARM_SINKS):
+    """Build sinks from {name: {"type": ..., **options}}."""
+    return {
+        name: SINK_TYPES[options["type"]](**{k: v for k, v in options.items() if k != "type"})
+        for name, options in config.items()
+    }
+
+
+class SinkWorker:
+    """Deliver alarms to one sink in batches from a bounded queue, on its own thread.
+
+    sink.send(alarms) returns True when delivered, False to retry the batch
+    later and None to drop it.
+    """
+
+    def __init__(self, name, sink, batch_size=ALARM_BATCH_SIZE, batch_interval=ALARM_BATCH_INTERVAL,
+                 queue_size=ALARM_QUEUE, max_backoff=ALARM_MAX_BACKOFF):
+        self.name = name
+        self.sink = sink
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.max_backoff = max_backoff
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.lock = threading.Lock()
+        self.delivered = 0
+        self.dropped = 0
+        self.retries = 0
+        self.batches = 0
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name=f"alarm-{self.name}", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Deliver what is queued (one attempt per batch), then stop."""
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def submit(self, alarm):
+        try:
+            self.queue.put_nowait(alarm)
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+
+    def _next_batch(self):
+        """Block for the first alarm, then collect more for up to batch_interval."""
+        try:
+            batch = [self.queue.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.batch_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if self.stop_event.is_set():
+                remaining = 0
+            try:
+                batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _deliver(self, batch):
+        backoff = 0.5
+        while True:
+            try:
+                result = self.sink.send(batch)
+            except Exception as e:
+                logging.error(f"[ALARM] Sink {self.name} failed: {e}")
+                result = False
+            if result is not False:
+                break
+            if self.stop_event.is_set():
+                result = None
+                break
+            with self.lock:
+                self.retries += 1
+            self.stop_event.wait(backoff * random.uniform(0.5, 1.0))
+            backoff = min(backoff * 2, self.max_backoff)
+        with self.lock:
+            self.batches += 1
+            if result:
+                self.delivered += len(batch)
+            else:
+                self.dropped += len(batch)
+                logging.error(f"[ALARM] Dropped {len(batch)} alarms for sink {self.name}")
+
+    def _run(self):
+        while not (self.stop_event.is_set() and self.queue.empty()):
+            batch = self._next_batch()
+            if batch:
+                self._deliver(batch)
+
+    def take_stats(self):
+        """Return and reset the counters."""
+        with self.lock:
+            stats = {
+                "delivered": self.delivered,
+                "dropped": self.dropped,
+                "retries": self.retries,
+                "batches": self.batches,
+                "queued": self.queue.qsize(),
+            }
+            self.delivered = self.dropped = self.retries = self.batches = 0
+        return stats
+
+
+class AlarmDispatcher:
+    """Route alarms to the sink workers named by their rule."""
+
+    def __init__(self, sinks, **worker_options):
+        self.workers = {name: SinkWorker(name, sink, **worker_options) for name, sink in sinks.items()}
+
+    def start(self):
+        for worker in self.workers.values():
+            worker.start()
+        return self
+
+    def stop(self):
+        for worker in self.workers.values():
+            worker.stop()
+
+    def dispatch(self, rule, alarm):
+        names = self.workers if rule.sinks is None else rule.sinks
+        for name in names:
+            worker = self.workers.get(name)
+            if worker is None:
+                logging.error(f"[ALARM] Rule {rule.name} names unknown sink {name}")
+                continue
+            worker.submit(alarm)
+
+    def take_stats(self):
+        return {name: worker.take_stats() for name, worker in self.workers.items()}
+
+
+class AlarmNode(AsyncZMQNode):
+    def __init__(self, rules=None, sinks=None):
+        super().__init__('alarm')
+        self.engine = AlarmEngine(rules if rules is not None else [Rule(**rule) for rule in ALARM_RULES])
+        self.dispatcher = AlarmDispatcher(sinks if sinks is not None else make_sinks()).start()
+        self.sub = self.async_socket(zmq.SUB, "reliable")
+        subscribe(self.sub, TOPIC_DETECTION)
+        self.detection_sources = self.subscribe_service(self.sub, "detection")
+        self.store = TimeSeriesStore().start()
+
+    async def handle_detection(self, topic, msg):
+        for rule, alarm in self.engine.evaluate(msg):
+            alarm["node_id"] = self.node_id
+            self.dispatcher.dispatch(rule, alarm)
+
+    async def report_stats(self):
+        last = time.monotonic()
+        while True:
+            await asyncio.sleep(ALARM_STATS_INTERVAL)
+            now = time.monotonic()
+            messages, fired, suppressed = self.engine.take_stats()
+            self.engine.prune(now)
+            stats = {"messages_per_s": messages / (now - last), "alarms": fired, "suppressed": suppressed}
+            for name, sink_stats in self.dispatcher.take_stats().items():
+                self.store.write_points(sink_stats, f"{self.node_id}/{name}")
+                stats[f"{name}_dropped"] = sink_stats["dropped"]
+            self.store.write_points(stats, self.node_id)
+            logging.info(f"[ALARM] {messages} messages, {fired} alarms, {suppressed} suppressed")
+            last = now
+
+    async def start(self):
+        self.spawn(self.subscription_loop(self.detection_sources, self.handle_detection))
+        self.spawn(self.report_stats())
+
+        logging.info(f"[ALARM:{self.node_id}] {len(self.engine.index.rules)} rules, "
+                     f"sinks: {', '.join(self.dispatcher.workers)}")
+        logging.info(f"[ALARM:{self.node_id}] Local IP: {self.get_local_ip()}")
+
+        print(f"[ALARM:{self.node_id}] Alarm node started")
+        print(f"[ALARM:{self.node_id}] Local IP: {self.get_local_ip()}\n")
+
+    def close(self):
+        self.sub.close()
+        self.dispatcher.stop()
+        self.store.close()
+
+if __name__ == "__main__":
+    node = AlarmNode()
+    node.run()
@@ -0,0 +1,204 @@
+"""
+Alarm engine throughput under high detection rates.
+
+Generates detection_results messages (random classes out of --classes,
+--objects per message, random boxes and confidences) and a rule set of
+--rules rules over those classes, with camera, zone, confidence and time
+window conditions; one rule in 50 matches any class. Messages are encoded
+once up front; the timed loop decodes each frame as the node's
+subscription loop would and evaluates it:
+
+  1. with the class index (alarm.RuleIndex), as deployed,
+  2. with a linear scan over every rule, for comparison,
+  3. end to end: indexed evaluation plus batched delivery through
+     AlarmDispatcher to stub sinks that take --sink-ms per batch, at
+     --rate messages/s (0 = as fast as possible).
+
+Reports messages/s, alarms raised, suppressed matches and, for the end to
+end run, delivered/dropped alarms and p50/p99 delivery latency as JSON.
+
+Run with: python benchmarks/alarm.py --messages 50000 --rules 200 --cooldown 5 --rate 2000 --sink-ms 20
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime
+
+# Add repository root to path to import alarm/utils/config
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from alarm import ANY_CLASS, AlarmDispatcher, AlarmEngine, Rule, RuleIndex
+from utils import TOPIC_DETECTION, decode_frame, encode_frame, make_topic
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class LinearIndex(RuleIndex):
+    """Baseline: every message checks every rule's class list."""
+
+    def candidates(self, object_class):
+        return [rule for rule in self.rules if object_class in rule.classes or ANY_CLASS in rule.classes]
+
+
+class StubSink:
+    """Records delivery latency; each batch takes delay seconds."""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.latencies = []
+
+    def send(self, alarms):
+        time.sleep(self.delay)
+        now = time.perf_counter()
+        with self.lock:
+            self.latencies.extend((now - alarm["sent"]) * 1000 for alarm in alarms)
+        return True
+
+
+def make_rules(count, classes, cameras, cooldown, rng):
+    rules = []
+    for i in range(count):
+        options = {"min_confidence": rng.choice([0.3, 0.5, 0.7])}
+        if i % 50 == 0:
+            options["classes"] = [ANY_CLASS]
+        else:
+            options["classes"] = rng.sample(classes, rng.randint(1, 3))
+        if rng.random() < 0.5:
+            options["cameras"] = rng.sample(cameras, 1)
+        if rng.random() < 0.3:
+            options["zone"] = [0, 0, 320, 480]
+        if rng.random() < 0.3:
+            options["hours"] = rng.choice([("22:00", "06:00"), ("08:00", "18:00")])
+        rules.append(Rule(f"rule-{i}", cooldown=cooldown, **options))
+    return rules
+
+
+def make_frames(count, classes, cameras, objects, rng):
+    frames = []
+    for i in range(count):
+        detections = []
+        for _ in range(rng.randint(1, objects)):
+            x, y = rng.randint(0, 560), rng.randint(0, 400)
+            detections.append({
+                "class": rng.choice(classes),
+                "confidence": round(rng.uniform(0.25, 0.95), 4),
+                "box": [x, y, x + 80, y + 80],
+            })
+        message = {
+            "type": "detection_results",
+            "node_id": "bench-detection",
+            "sender": "bench-motion",
+            "camera_id": rng.choice(cameras),
+            "detections": detections,
+            "ts": datetime.now().isoformat(),
+        }
+        frames.append(encode_frame(make_topic(TOPIC_DETECTION, "bench-detection"), message))
+    return frames
+
+
+def run_engine(engine, frames):
+    alarms = 0
+    began = time.perf_counter()
+    for frame in frames:
+        _, message = decode_frame(frame)
+        alarms += len(engine.evaluate(message))
+    elapsed = time.perf_counter() - began
+    _, _, suppressed = engine.take_stats()
+    return {
+        "messages_per_s": len(frames) / elapsed,
+        "us_per_message": elapsed / len(frames) * 1e6,
+        "alarms": alarms,
+        "suppressed": suppressed,
+    }
+
+
+def run_end_to_end(rules, frames, args):
+    engine = AlarmEngine(rules)
+    sinks = {f"stub-{i}": StubSink(args.sink_ms / 1000) for i in range(args.sinks)}
+    dispatcher = AlarmDispatcher(sinks, batch_size=args.batch_size, batch_interval=args.batch_interval,
+                                 queue_size=args.queue).start()
+    raised = 0
+    began = time.perf_counter()
+    for i, frame in enumerate(frames):
+        if args.rate:
+            delay = began + i / args.rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        _, message = decode_frame(frame)
+        sent = time.perf_counter()
+        for rule, alarm in engine.evaluate(message):
+            alarm["sent"] = sent
+            dispatcher.dispatch(rule, alarm)
+            raised += 1
+    elapsed = time.perf_counter() - began
+    dispatcher.stop()
+    stats = dispatcher.take_stats()
+    latencies = [v for sink in sinks.values() for v in sink.latencies]
+    return {
+        "messages_per_s": len(frames) / elapsed,
+        "alarms": raised,
+        "deliveries": raised * args.sinks,
+        "delivered": sum(s["delivered"] for s in stats.values()),
+        "dropped": sum(s["dropped"] for s in stats.values()),
+        "batches": sum(s["batches"] for s in stats.values()),
+        "latency_ms_p50": percentile(latencies, 50),
+        "latency_ms_p99": percentile(latencies, 99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=50000)
+    parser.add_argument("--rules", type=int, default=200)
+    parser.add_argument("--classes", type=int, default=80, help="distinct object classes (COCO has 80)")
+    parser.add_argument("--cameras", type=int, default=8)
+    parser.add_argument("--objects", type=int, default=4, help="objects per message at most")
+    parser.add_argument("--cooldown", type=float, default=0.0, help="rule cool-down in seconds; 0 = every match alarms")
+    parser.add_argument("--rate", type=float, default=2000.0, help="messages/s for the end-to-end run; 0 = unpaced")
+    parser.add_argument("--sinks", type=int, default=2)
+    parser.add_argument("--sink-ms", type=float, default=20.0, help="time a stub sink takes per batch")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--batch-interval", type=float, default=0.2)
+    parser.add_argument("--queue", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write JSON results to this file")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    classes = [f"class-{i}" for i in range(args.classes)]
+    cameras = [f"cam{i}" for i in range(args.cameras)]
+    rules = make_rules(args.rules, classes, cameras, args.cooldown, rng)
+    frames = make_frames(args.messages, classes, cameras, args.objects, rng)
+
+    indexed = run_engine(AlarmEngine(rules), frames)
+    linear_engine = AlarmEngine(rules)
+    linear_engine.index = LinearIndex(rules)
+    linear = run_engine(linear_engine, frames)
+    report = json.dumps({
+        "messages": args.messages,
+        "rules": args.rules,
+        "classes": args.classes,
+        "indexed": indexed,
+        "linear": linear,
+        "speedup": indexed["messages_per_s"] / linear["messages_per_s"],
+        "end_to_end": run_end_to_end(rules, frames, args),
+    }, indent=2)
+    print(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+
+
+if __name__ == "__main__":
+    main()
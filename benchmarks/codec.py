@@ -0,0 +1,115 @@
+"""
+Encode/decode throughput and bytes per message for each message codec.
+
+Compares plain JSON (send_json/recv_json equivalent) with the schema-tagged
+msgpack codec in utils.MessageCodec for every known message type.
+
+Run with: python benchmarks/codec.py --count 20000
+"""
+import argparse
+import base64
+import json
+import os
+import sys
+import time
+
+# Add repository root to path to import utils/config
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import MessageCodec
+
+SAMPLE_MESSAGES = {
+    "motion_flag": {
+        "type": "motion_flag",
+        "node_id": "raspberrypi-motion",
+        "camera_id": "cam0",
+        "flag": 1,
+        "ts": "15:11:11.186105",
+    },
+    "system_status": {
+        "type": "system_status",
+        "node_id": "raspberrypi-system_monitor",
+        "timestamp": "15:11:11.186105",
+        "cpu": 25.5,
+        "memory_used_gb": 2.1534,
+        "memory_total_gb": 3.9812,
+        "memory_percent": 53.7,
+        "disk_read_kbs": 123.45,
+        "disk_write_kbs": 67.89,
+        "network_send_kbs": 45.67,
+        "network_recv_kbs": 89.12,
+        "temperature": "55.0°C",
+        "gpu": "12.5%",
+        "disk_free_gb": 12.34,
+        "storage_used_gb": 3.21,
+        "storage_added_kbs": 52.0,
+        "storage_deleted_kbs": 0.0,
+    },
+    "detection_results": {
+        "type": "detection_results",
+        "node_id": "raspberrypi-detection",
+        "sender": "raspberrypi-motion",
+        "camera_id": "cam0",
+        "detections": [
+            {"class": "person", "confidence": 0.8712},
+            {"class": "car", "confidence": 0.6403},
+        ],
+        "ts": "2026-02-13T15:11:11.386105",
+    },
+    "image": {
+        "type": "image",
+        "node_id": "raspberrypi-motion",
+        "camera_id": "cam0",
+        "size": "80.00 KB",
+        "image_data": base64.b64encode(os.urandom(80 * 1024)).decode("ascii"),
+        "ts": "15:11:11.186105",
+    },
+}
+
+
+def bench(encode, decode, message, count):
+    payload = encode(message)
+    start = time.perf_counter()
+    for _ in range(count):
+        encode(message)
+    encode_s = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(count):
+        decode(payload)
+    decode_s = time.perf_counter() - start
+    assert decode(payload) == message
+    return {
+        "bytes": len(payload),
+        "encode_per_s": count / encode_s,
+        "decode_per_s": count / decode_s,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=20000, help="iterations per message type (images use 1/100)")
+    parser.add_argument("--output", help="write JSON results to this file")
+    args = parser.parse_args()
+
+    codecs = {
+        "json": (lambda m: json.dumps(m).encode("utf-8"), json.loads),
+    }
+    msgpack_codec = MessageCodec("msgpack")
+    if msgpack_codec.name == "msgpack":
+        codecs["msgpack"] = (msgpack_codec.encode, msgpack_codec.decode)
+
+    results = []
+    for msg_type, message in SAMPLE_MESSAGES.items():
+        count = max(1, args.count // 100) if msg_type == "image" else args.count
+        for codec_name, (encode, decode) in codecs.items():
+            results.append({"type": msg_type, "codec": codec_name, **bench(encode, decode, message, count)})
+
+    report = json.dumps(results, indent=2)
+    print(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+"""
+Synthetic load: N motion nodes and M telemetry nodes against one subscriber.
+
+Each simulated node is a separate process with its own context and PUB
+socket (motion: "bulk" profile, telemetry: "latest", as deployed). Image
+payloads are random bytes of --image-kb, base64-encoded once up front; per
+message only the timestamp changes. Motion nodes send steady --image-rate
+images/s or, with --burst-size, bursts of images every --burst-interval
+seconds. The subscriber uses the detection node's socket profile and can
+spend --consumer-ms per image to model inference.
+
+Before the timed run every node sends warm-up messages (timestamp None)
+until the subscriber has received one from each of them, so no node's
+first measured message is lost to a connection or subscription that is
+still settling. Warm-up messages are not counted.
+
+For each camera count in --cameras the script reports offered and received
+rates, drop rate and p50/p99 latency per stream as JSON, plus the largest
+camera count served with under --max-drop drops.
+
+Run with: python benchmarks/load.py --cameras 1,2,4,8 --telemetry 4 --image-kb 80 --consumer-ms 50
+"""
+import argparse
+import base64
+import json
+import multiprocessing
+import os
+import sys
+import time
+from datetime import datetime, time as dtime
+
+import zmq
+
+# Add repository root to path to import utils/config
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import (
+    TOPIC_IMAGE,
+    TOPIC_SYSTEM_STATUS,
+    decode_frame,
+    encode_frame,
+    make_context,
+    make_socket,
+    make_topic,
+)
+
+STATUS_TEMPLATE = {
+    "type": "system_status",
+    "cpu": 25.5,
+    "memory_used_gb": 2.1534,
+    "memory_total_gb": 3.9812,
+    "memory_percent": 53.7,
+    "disk_read_kbs": 123.45,
+    "disk_write_kbs": 67.89,
+    "network_send_kbs": 45.67,
+    "network_recv_kbs": 89.12,
+    "temperature": "55.0°C",
+    "gpu": "12.5%",
+    "disk_free_gb": 12.34,
+    "storage_used_gb": 3.21,
+    "storage_added_kbs": 52.0,
+    "storage_deleted_kbs": 0.0,
+}
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def send_times(duration, rate, burst_size, burst_interval):
+    """Offsets (seconds from start) at which a motion node sends an image."""
+    if burst_size:
+        spacing = 1.0 / rate if rate else 0.0
+        return [
+            start + i * spacing
+            for start in frange(0, duration, burst_interval)
+            for i in range(burst_size)
+            if start + i * spacing < duration
+        ]
+    return list(frange(0, duration, 1.0 / rate))
+
+
+def frange(start, stop, step):
+    value = start
+    while value < stop:
+        yield value
+        value += step
+
+
+WARMUP_INTERVAL = 0.05
+WARMUP_TIMEOUT = 10.0
+
+
+def warm_up(pub, topic, message, go):
+    """Send message (with its timestamp left None) until the subscriber sets go."""
+    frame = encode_frame(topic, message)
+    while not go.is_set():
+        pub.send(frame)
+        go.wait(WARMUP_INTERVAL)
+
+
+def motion_node(index, port, duration, offsets, image_kb, ready, go, sent):
+    context = make_context()
+    pub = make_socket(context, zmq.PUB, "bulk")
+    pub.bind(f"tcp://127.0.0.1:{port}")
+    node_id = f"load-motion-{index}"
+    image_b64 = base64.b64encode(os.urandom(int(image_kb * 1024))).decode("ascii")
+    message = {
+        "type": "image",
+        "node_id": node_id,
+        "camera_id": "cam0",
+        "size": f"{image_kb:.2f} KB",
+        "image_data": image_b64,
+        "ts": None,
+    }
+    topic = make_topic(TOPIC_IMAGE, node_id, "cam0")
+    ready.wait()
+    warm_up(pub, topic, {**message, "image_data": ""}, go)
+    began = time.perf_counter()
+    count = 0
+    for offset in offsets:
+        delay = began + offset - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        message["ts"] = datetime.now().time().isoformat()
+        pub.send(encode_frame(topic, message))
+        count += 1
+    sent[index] = count
+    time.sleep(0.5)
+    pub.close()
+    context.term()
+
+
+def telemetry_node(index, port, duration, interval, ready, go, sent):
+    context = make_context()
+    pub = make_socket(context, zmq.PUB, "latest")
+    pub.bind(f"tcp://127.0.0.1:{port}")
+    node_id = f"load-monitor-{index}"
+    message = {**STATUS_TEMPLATE, "node_id": node_id, "timestamp": None}
+    topic = make_topic(TOPIC_SYSTEM_STATUS, node_id)
+    ready.wait()
+    warm_up(pub, topic, message, go)
+    began = time.perf_counter()
+    count = 0
+    for offset in frange(0, duration, interval):
+        delay = began + offset - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        message["timestamp"] = datetime.now().time().isoformat()
+        pub.send(encode_frame(topic, message))
+        count += 1
+    sent[index] = count
+    time.sleep(0.5)
+    pub.close()
+    context.term()
+
+
+def latency_ms(send_ts, now):
+    try:
+        sent = datetime.combine(now.date(), dtime.fromisoformat(send_ts))
+    except (TypeError, ValueError):
+        return None
+    return (now - sent).total_seconds() * 1000
+
+
+def run_load(cameras, args):
+    ctx = multiprocessing.get_context("spawn")
+    ready = ctx.Barrier(cameras + args.telemetry + 1)
+    go = ctx.Event()
+    image_sent = ctx.Array("i", cameras)
+    status_sent = ctx.Array("i", max(1, args.telemetry))
+    offsets = send_times(args.duration, args.image_rate, args.burst_size, args.burst_interval)
+
+    processes = []
+    for i in range(cameras):
+        processes.append(ctx.Process(target=motion_node, args=(
+            i, args.port + i, args.duration, offsets, args.image_kb, ready, go, image_sent)))
+    for i in range(args.telemetry):
+        processes.append(ctx.Process(target=telemetry_node, args=(
+            i, args.port + 1000 + i, args.duration, args.telemetry_interval, ready, go, status_sent)))
+    for process in processes:
+        process.start()
+
+    # Subscriber shaped like the detection node (images) and dashboard (telemetry)
+    context = make_context()
+    images = make_socket(context, zmq.SUB, "bulk")
+    images.setsockopt(zmq.SUBSCRIBE, TOPIC_IMAGE.encode("utf-8") + b".")
+    status = make_socket(context, zmq.SUB, "latest")
+    status.setsockopt(zmq.SUBSCRIBE, TOPIC_SYSTEM_STATUS.encode("utf-8") + b".")
+    # Connect only once every publisher is bound: with IMMEDIATE set, a SUB
+    # that connects before the bind loses the first message on that link
+    ready.wait()
+    for i in range(cameras):
+        images.connect(f"tcp://127.0.0.1:{args.port + i}")
+    for i in range(args.telemetry):
+        status.connect(f"tcp://127.0.0.1:{args.port + 1000 + i}")
+
+    poller = zmq.Poller()
+    poller.register(images, zmq.POLLIN)
+    poller.register(status, zmq.POLLIN)
+    # Readiness handshake: start the run once every publisher has reached us
+    expected = {f"load-motion-{i}" for i in range(cameras)} | {f"load-monitor-{i}" for i in range(args.telemetry)}
+    seen = set()
+    warmup_deadline = time.perf_counter() + WARMUP_TIMEOUT
+    while seen != expected:
+        if time.perf_counter() > warmup_deadline:
+            go.set()
+            for process in processes:
+                process.join()
+            raise RuntimeError(f"No warm-up message from {sorted(expected - seen)}")
+        for sock, _ in poller.poll(100):
+            _, message = decode_frame(sock.recv())
+            seen.add(message["node_id"])
+    go.set()
+
+    latencies = {"image": [], "system_status": []}
+    received_bytes = 0
+    began = time.perf_counter()
+    deadline = began + args.duration + 2.0
+    while time.perf_counter() < deadline:
+        for sock, _ in poller.poll(100):
+            data = sock.recv()
+            _, message = decode_frame(data)
+            if message.get("ts", message.get("timestamp")) is None:
+                continue  # warm-up message still in flight
+            received_bytes += len(data)
+            now = datetime.now()
+            if message["type"] == "image":
+                latencies["image"].append(latency_ms(message["ts"], now))
+                if args.consumer_ms:
+                    time.sleep(args.consumer_ms / 1000)
+            else:
+                latencies["system_status"].append(latency_ms(message["timestamp"], now))
+    elapsed = time.perf_counter() - began
+
+    for process in processes:
+        process.join()
+    images.close()
+    status.close()
+    context.term()
+
+    def stream(sent, values):
+        received = len(values)
+        return {
+            "sent": sent,
+            "received": received,
+            "offered_per_s": sent / args.duration,
+            "received_per_s": received / args.duration,
+            "drop_rate": 1 - received / sent if sent else 0.0,
+            "latency_ms_p50": percentile(values, 50),
+            "latency_ms_p99": percentile(values, 99),
+            "latency_ms_max": max(values) if values else None,
+        }
+
+    return {
+        "cameras": cameras,
+        "telemetry_nodes": args.telemetry,
+        "image": stream(sum(image_sent), [v for v in latencies["image"] if v is not None]),
+        "system_status": stream(sum(status_sent[:args.telemetry]),
+                                [v for v in latencies["system_status"] if v is not None]),
+        "received_mb_per_s": received_bytes / elapsed / 2**20,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cameras", default="1,2,4,8", help="comma-separated motion node counts to run")
+    parser.add_argument("--telemetry", type=int, default=4, help="telemetry nodes")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per run")
+    parser.add_argument("--image-kb", type=float, default=80.0)
+    parser.add_argument("--image-rate", type=float, default=2.0, help="images/s per motion node (in bursts: spacing)")
+    parser.add_argument("--burst-size", type=int, default=0, help="images per burst; 0 = steady rate")
+    parser.add_argument("--burst-interval", type=float, default=5.0, help="seconds between burst starts")
+    parser.add_argument("--telemetry-interval", type=float, default=1.0)
+    parser.add_argument("--consumer-ms", type=float, default=0.0, help="simulated processing per image")
+    parser.add_argument("--max-drop", type=float, default=0.01, help="drop rate still counted as served")
+    parser.add_argument("--port", type=int, default=16000)
+    parser.add_argument("--output", help="write JSON results to this file")
+    args = parser.parse_args()
+
+    runs = [run_load(int(n), args) for n in args.cameras.split(",")]
+    served = [run["cameras"] for run in runs if run["image"]["drop_rate"] <= args.max_drop]
+    report = json.dumps({
+        "image_kb": args.image_kb,
+        "image_rate": args.image_rate,
+        "burst_size": args.burst_size,
+        "consumer_ms": args.consumer_ms,
+        "runs": runs,
+        "max_cameras_served": max(served) if served else 0,
+    }, indent=2)
+    print(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Outbox forwarder against a local stub API.
+
+Starts a stub HTTP server that answers 503 during an initial outage and
+delays every request, submits events through draft/requests/outbox.py,
+stops the forwarder halfway through (as a restart would) and starts a new
+one on the same outbox. Reports submit latency (time the receive loop is
+blocked), delivery time, retries and whether every event arrived.
+
+Run with: python benchmarks/outbox.py --events 2000 --outage 2 --delay 0.05
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Add repository root and the draft forwarder to path
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "draft", "requests"))
+
+from outbox import Forwarder, Outbox
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class StubAPI:
+    """Records posted events; returns 503 until outage_until, then answers after delay."""
+
+    def __init__(self, port, outage, delay):
+        self.received = []
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.outage_until = time.monotonic() + outage
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                with stub.lock:
+                    stub.requests += 1
+                if time.monotonic() < stub.outage_until:
+                    status = 503
+                else:
+                    time.sleep(delay)
+                    events = json.loads(body)
+                    with stub.lock:
+                        stub.received.extend(event["id"] for event in events)
+                    status = 200
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=2000)
+    parser.add_argument("--outage", type=float, default=2.0, help="seconds the stub answers 503 at start")
+    parser.add_argument("--delay", type=float, default=0.05, help="seconds the stub takes per request")
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=2)
+    parser.add_argument("--port", type=int, default=18000)
+    parser.add_argument("--output", help="write JSON results to this file")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="outbox-")
+    api_url = f"http://127.0.0.1:{args.port}/api/data"
+    stub = StubAPI(args.port, args.outage, args.delay)
+    payload = "x" * 512
+
+    def forwarder():
+        return Forwarder(api_url, Outbox(directory), batch_size=args.batch_size,
+                         concurrency=args.concurrency, max_backoff=1.0).start()
+
+    start = time.perf_counter()
+    submit_ms = []
+    retries = 0
+    current = forwarder()
+    for i in range(args.events):
+        if i == args.events // 2:
+            # Restart halfway: undelivered events must be replayed from disk
+            current.stop()
+            retries += current.retries
+            current = forwarder()
+        t0 = time.perf_counter()
+        current.submit({"id": i, "payload": payload})
+        submit_ms.append((time.perf_counter() - t0) * 1000)
+
+    while len(set(stub.received)) < args.events and time.perf_counter() - start < args.outage + 60:
+        time.sleep(0.05)
+    elapsed = time.perf_counter() - start
+    current.stop()
+    retries += current.retries
+    stub.stop()
+    shutil.rmtree(directory)
+
+    unique = set(stub.received)
+    result = {
+        "events": args.events,
+        "delivered_unique": len(unique),
+        "duplicates": len(stub.received) - len(unique),
+        "missing": args.events - len(unique),
+        "http_requests": stub.requests,
+        "retries": retries,
+        "seconds_to_deliver": elapsed,
+        "submit_ms_p50": percentile(submit_ms, 50),
+        "submit_ms_p99": percentile(submit_ms, 99),
+    }
+    report = json.dumps(result, indent=2)
+    print(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+"""
+Offline motion-to-detection pipeline benchmark; no camera needed.
+
+Frames come from a video file (--video) or are generated (--synthetic:
+a static noisy background with periodic bursts of a large jumping block).
+Each frame goes through motion.MotionAnalyzer; frames that start a motion
+event (or every motion frame with --detect all) are JPEG-encoded as the
+motion node publishes them and handed over a bounded queue to
+detection.YoloDetector, which decodes and runs inference in its own thread.
+Frames are fed as fast as possible or at --fps.
+
+Reports per-stage fps, p50/p99 latency, end-to-end latency, CPU and RSS as
+JSON. --save-baseline stores the report; --baseline compares against a
+stored one and exits non-zero if a stage got slower than --tolerance.
+
+Run with: python benchmarks/pipeline.py --synthetic --frames 600 --no-detect
+"""
+import argparse
+import json
+import os
+import queue
+import resource
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+import psutil
+
+# Add repository root to path to import motion/detection/config
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import MODEL_PATH, ZMQ_IMAGE_HWM
+from motion import MotionAnalyzer, encode_jpeg_b64
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def synthetic_frames(count, width, height, burst_every=100, burst_length=20, seed=0):
+    """Yield BGR frames: idle noise, and every burst_every frames a half-frame block jumping side to side."""
+    rng = np.random.default_rng(seed)
+    background = rng.integers(0, 200, (height, width, 3), dtype=np.uint8)
+    # A few prebuilt noise layers so generation does not dominate the timing
+    noise = [rng.integers(0, 8, (height, width, 3), dtype=np.uint8) for _ in range(4)]
+    block = width // 2
+    for i in range(count):
+        frame = background + noise[i % len(noise)]
+        phase = i % burst_every
+        if phase < burst_length:
+            x = 0 if phase % 2 else width - block
+            frame[:, x:x + block] = 255 - frame[:, x:x + block]
+        yield frame
+
+
+def video_frames(path, count):
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise SystemExit(f"Cannot open video {path}")
+    try:
+        produced = 0
+        while count <= 0 or produced < count:
+            ok, frame = capture.read()
+            if not ok:
+                return
+            produced += 1
+            yield frame
+    finally:
+        capture.release()
+
+
+class Stage:
+    def __init__(self, name):
+        self.name = name
+        self.latencies_ms = []
+
+    def record(self, start):
+        self.latencies_ms.append((time.perf_counter() - start) * 1000)
+
+    def report(self, elapsed):
+        busy_s = sum(self.latencies_ms) / 1000
+        return {
+            "count": len(self.latencies_ms),
+            "fps": len(self.latencies_ms) / elapsed if elapsed else None,
+            # Rate the stage could sustain on its own
+            "capacity_fps": len(self.latencies_ms) / busy_s if busy_s else None,
+            "latency_ms_p50": percentile(self.latencies_ms, 50),
+            "latency_ms_p99": percentile(self.latencies_ms, 99),
+        }
+
+
+def run(args):
+    if args.video:
+        source = video_frames(args.video, args.frames)
+    else:
+        source = synthetic_frames(args.frames, args.width, args.height)
+
+    detector = None
+    if not args.no_detect:
+        from detection import YoloDetector
+        detector = YoloDetector(args.model)
+
+    stages = {name: Stage(name) for name in ("read", "motion", "encode", "detect")}
+    end_to_end_ms = []
+    # Same depth as the bulk image socket: when detection falls behind, images drop
+    handoff = queue.Queue(maxsize=ZMQ_IMAGE_HWM)
+    dropped = 0
+
+    def detect_worker():
+        while True:
+            item = handoff.get()
+            if item is None:
+                return
+            frame_start, image_b64 = item
+            start = time.perf_counter()
+            detector.process_image(image_b64)
+            stages["detect"].record(start)
+            end_to_end_ms.append((time.perf_counter() - frame_start) * 1000)
+
+    worker = None
+    if detector is not None:
+        worker = threading.Thread(target=detect_worker, daemon=True)
+        worker.start()
+
+    process = psutil.Process()
+    process.cpu_percent(None)
+    analyzer = MotionAnalyzer()
+    was_moving = False
+    motion_frames = 0
+    interval = 1.0 / args.fps if args.fps > 0 else 0.0
+    start_time = time.perf_counter()
+    next_frame = start_time
+
+    frames = iter(source)
+    while True:
+        if interval:
+            delay = next_frame - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            next_frame += interval
+
+        frame_start = time.perf_counter()
+        frame = next(frames, None)
+        if frame is None:
+            break
+        stages["read"].record(frame_start)
+
+        start = time.perf_counter()
+        _, motion_detected = analyzer.process(frame)
+        stages["motion"].record(start)
+        motion_frames += int(motion_detected)
+
+        send = motion_detected and (args.detect == "all" or not was_moving)
+        was_moving = motion_detected
+        if not send:
+            continue
+
+        start = time.perf_counter()
+        encoded = encode_jpeg_b64(frame)
+        stages["encode"].record(start)
+        if detector is None or encoded is None:
+            continue
+        try:
+            handoff.put_nowait((frame_start, encoded[0]))
+        except queue.Full:
+            dropped += 1
+
+    if worker is not None:
+        handoff.put(None)
+        worker.join()
+    elapsed = time.perf_counter() - start_time
+
+    return {
+        "source": args.video or f"synthetic {args.width}x{args.height}",
+        "frames": len(stages["read"].latencies_ms),
+        "motion_frames": motion_frames,
+        "target_fps": args.fps or None,
+        "detect": "off" if detector is None else args.detect,
+        "elapsed_s": elapsed,
+        "stages": {name: stage.report(elapsed) for name, stage in stages.items() if stage.latencies_ms},
+        "end_to_end_ms_p50": percentile(end_to_end_ms, 50),
+        "end_to_end_ms_p99": percentile(end_to_end_ms, 99),
+        "detect_dropped": dropped,
+        "cpu_percent": process.cpu_percent(None),
+        "rss_mb": process.memory_info().rss / 2**20,
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def compare(report, baseline, tolerance):
+    """Return a list of regressions: lower stage capacity or higher p99 than baseline."""
+    regressions = []
+    for name, stage in report["stages"].items():
+        base = baseline.get("stages", {}).get(name)
+        if not base:
+            continue
+        if base["capacity_fps"] and stage["capacity_fps"] < base["capacity_fps"] * (1 - tolerance):
+            regressions.append(f"{name}: capacity {stage['capacity_fps']:.1f} fps < baseline {base['capacity_fps']:.1f}")
+        if base["latency_ms_p99"] and stage["latency_ms_p99"] > base["latency_ms_p99"] * (1 + tolerance):
+            regressions.append(f"{name}: p99 {stage['latency_ms_p99']:.2f} ms > baseline {base['latency_ms_p99']:.2f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--video", help="recorded video file to replay")
+    source.add_argument("--synthetic", action="store_true", help="generate frames instead")
+    parser.add_argument("--frames", type=int, default=600, help="frames to process (video: 0 = whole file)")
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--fps", type=float, default=0, help="feed rate; 0 = as fast as possible")
+    parser.add_argument("--detect", choices=("onset", "all"), default="onset",
+                        help="detect on motion onset only (as deployed) or on every motion frame")
+    parser.add_argument("--no-detect", action="store_true", help="skip YOLO (motion and encode only)")
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--baseline", help="compare against this saved report")
+    parser.add_argument("--save-baseline", help="write this report as a baseline")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed relative slowdown")
+    parser.add_argument("--output", help="write JSON results to this file")
+    args = parser.parse_args()
+
+    report = run(args)
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        report["regressions"] = regressions
+        exit_code = 1 if regressions else 0
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                f.write(text)
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Latency under load for each ZeroMQ socket profile in utils.SOCKET_PROFILES.
+
+A publisher sends timestamped messages at a fixed rate over TCP loopback to a
+subscriber that is deliberately slower than the publisher. For each profile
+the script reports delivered/dropped counts and p50/p99 latency as JSON.
+
+Run with: python benchmarks/socket_profiles.py --duration 5 --rate 200
+"""
+import argparse
+import json
+import os
+import struct
+import sys
+import threading
+import time
+
+import zmq
+
+# Add repository root to path to import utils/config
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import SOCKET_PROFILES, make_context, make_socket
+
+# Representative payload size per stream class
+PAYLOAD_SIZES = {
+    "bulk": 80 * 1024,
+    "latest": 400,
+    "reliable": 120,
+}
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run_profile(profile, port, duration, rate, consumer_delay):
+    context = make_context()
+    pub = make_socket(context, zmq.PUB, profile)
+    pub.bind(f"tcp://127.0.0.1:{port}")
+    sub = make_socket(context, zmq.SUB, profile, single_source=True)
+    sub.setsockopt(zmq.SUBSCRIBE, b"")
+    sub.connect(f"tcp://127.0.0.1:{port}")
+    time.sleep(0.5)  # let the subscription propagate (slow joiner)
+
+    padding = b"\0" * max(0, PAYLOAD_SIZES[profile] - 8)
+    sent = 0
+    done = threading.Event()
+
+    def publisher():
+        nonlocal sent
+        interval = 1.0 / rate
+        next_send = time.perf_counter()
+        end = next_send + duration
+        while next_send < end:
+            pub.send(struct.pack("!d", time.perf_counter()) + padding)
+            sent += 1
+            next_send += interval
+            delay = next_send - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        done.set()
+
+    latencies = []
+    thread = threading.Thread(target=publisher, daemon=True)
+    thread.start()
+    while True:
+        if sub.poll(500):
+            message = sub.recv()
+            latencies.append((time.perf_counter() - struct.unpack("!d", message[:8])[0]) * 1000)
+            time.sleep(consumer_delay)
+        elif done.is_set():
+            break
+    thread.join()
+
+    pub.close()
+    sub.close()
+    context.term()
+    return {
+        "profile": profile,
+        "options": SOCKET_PROFILES[profile],
+        "payload_bytes": PAYLOAD_SIZES[profile],
+        "sent": sent,
+        "received": len(latencies),
+        "dropped": sent - len(latencies),
+        "latency_ms_p50": percentile(latencies, 50),
+        "latency_ms_p99": percentile(latencies, 99),
+        "latency_ms_max": max(latencies) if latencies else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds of publishing per profile")
+    parser.add_argument("--rate", type=float, default=200.0, help="messages per second published")
+    parser.add_argument("--consumer-delay", type=float, default=0.01, help="seconds the subscriber spends per message")
+    parser.add_argument("--port", type=int, default=15600)
+    parser.add_argument("--output", help="write JSON results to this file")
+    args = parser.parse_args()
+
+    results = [
+        run_profile(profile, args.port + i, args.duration, args.rate, args.consumer_delay)
+        for i, profile in enumerate(SOCKET_PROFILES)
+    ]
+    report = json.dumps(results, indent=2)
+    print(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+
+
+if __name__ == "__main__":
+    main()
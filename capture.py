@@ -0,0 +1,298 @@
+"""
+Capture ZeroMQ traffic to a file and replay it.
+
+    python capture.py record [--output captures/NAME.zcap]
+    python capture.py replay captures/NAME.zcap [--speed 1.0] [--start S] [--end S] [--loop]
+
+The capture node subscribes to every motion.flag, motion.image, detection
+and system_status service found by discovery (with the track frames of
+motion.image and the tracks of detection) and appends each raw frame
+(topic and encoded payload, exactly as received) with its receive time.
+
+File format: a magic header, then records of
+    receive time (float64) | frame length (uint32) | frame bytes
+A sidecar .idx file holds (receive time, byte offset) every
+CAPTURE_INDEX_EVERY records, so replay can start at any time without
+scanning the capture.
+
+The replay node advertises the same service types and re-emits the frames
+byte for byte, in order, at the original pace, scaled by --speed, or as fast
+as possible (--speed 0). With --loop, passes after the first renumber
+sequenced events (seq/epoch, see replay.py) as if each publisher had
+restarted, so subscribers that skip duplicates still handle them.
+"""
+import argparse
+import bisect
+import logging
+import os
+import struct
+import sys
+import time
+from datetime import datetime
+
+import zmq
+
+# Add parent directory to path to import config
+sys.path.append('.')
+
+from config import (
+    CAPTURE_DIR,
+    CAPTURE_INDEX_EVERY,
+    DETECTION_PORT,
+    MOTION_FLAG_PORT,
+    MOTION_IMAGE_PORT,
+    SYSTEM_MONITOR_PORT,
+)
+from utils import (
+    TOPIC_DETECTION,
+    TOPIC_IMAGE,
+    TOPIC_MOTION_FLAG,
+    TOPIC_SEPARATOR,
+    TOPIC_SYSTEM_STATUS,
+    TOPIC_TRACK_FRAME,
+    TOPIC_TRACKS,
+    ZMQNode,
+    decode_frame,
+    encode_frame,
+    subscribe,
+)
+
+MAGIC = b"ZCAP1\n"
+RECORD_HEADER = struct.Struct("!dI")
+INDEX_ENTRY = struct.Struct("!dQ")
+
+# Captured service type -> (topic kinds it publishes, port the replay node publishes them on)
+CAPTURED_SERVICES = {
+    "motion.flag": ((TOPIC_MOTION_FLAG,), MOTION_FLAG_PORT),
+    "motion.image": ((TOPIC_IMAGE, TOPIC_TRACK_FRAME), MOTION_IMAGE_PORT),
+    "detection": ((TOPIC_DETECTION, TOPIC_TRACKS), DETECTION_PORT),
+    "system_status": ((TOPIC_SYSTEM_STATUS,), SYSTEM_MONITOR_PORT),
+}
+
+
+def service_for_frame(frame):
+    """Return the captured service type a frame's topic belongs to, or None."""
+    topic = frame.partition(TOPIC_SEPARATOR)[0].decode("utf-8", "replace")
+    for service_type, (kinds, _) in CAPTURED_SERVICES.items():
+        if any(topic.startswith(kind + ".") for kind in kinds):
+            return service_type
+    return None
+
+
+class CaptureWriter:
+    def __init__(self, path, index_every=CAPTURE_INDEX_EVERY):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.index_every = index_every
+        self.data = open(path, "wb")
+        self.index = open(path + ".idx", "wb")
+        self.data.write(MAGIC)
+        self.count = 0
+        self.bytes = 0
+
+    def write(self, recv_time, frame):
+        if self.count % self.index_every == 0:
+            self.index.write(INDEX_ENTRY.pack(recv_time, self.data.tell()))
+        self.data.write(RECORD_HEADER.pack(recv_time, len(frame)))
+        self.data.write(frame)
+        self.count += 1
+        self.bytes += len(frame)
+
+    def flush(self):
+        self.data.flush()
+        self.index.flush()
+
+    def close(self):
+        self.data.close()
+        self.index.close()
+
+
+class CaptureReader:
+    def __init__(self, path):
+        self.path = path
+        self.times = []
+        self.offsets = []
+        if os.path.exists(path + ".idx"):
+            with open(path + ".idx", "rb") as f:
+                for recv_time, offset in INDEX_ENTRY.iter_unpack(f.read()):
+                    self.times.append(recv_time)
+                    self.offsets.append(offset)
+
+    def first_time(self):
+        for recv_time, _ in self.records():
+            return recv_time
+        return None
+
+    def records(self, start=None, end=None):
+        """Yield (receive time, frame) for records with start <= time < end."""
+        with open(self.path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{self.path} is not a capture file")
+            if start is not None and self.times:
+                # Jump to the last indexed record at or before start
+                position = bisect.bisect_right(self.times, start) - 1
+                if position >= 0:
+                    f.seek(self.offsets[position])
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    return  # end of file, or a record cut short by a crash
+                recv_time, length = RECORD_HEADER.unpack(header)
+                frame = f.read(length)
+                if len(frame) < length:
+                    return
+                if end is not None and recv_time >= end:
+                    return
+                if start is None or recv_time >= start:
+                    yield recv_time, frame
+
+
+class CaptureNode(ZMQNode):
+    """Subscribe to every captured service and write frames to a CaptureWriter."""
+
+    def __init__(self, path):
+        super().__init__('capture')
+        self.writer = CaptureWriter(path)
+        # Deep queue: a capture should keep every frame, not the latest one
+        self.sub = self.socket(zmq.SUB, "reliable")
+        self.sources = []
+        for service_type, (kinds, _) in CAPTURED_SERVICES.items():
+            for kind in kinds:
+                subscribe(self.sub, kind)
+            # TCP even on the same host, so images arrive as JPEG rather than shared-memory refs
+            self.sources.append(self.subscribe_service(self.sub, service_type, prefer_ipc=False))
+
+    def run(self):
+        self.start_discovery()
+        logging.info(f"[CAPTURE:{self.node_id}] Writing to {self.writer.path}")
+        last_flush = last_report = time.monotonic()
+        try:
+            while True:
+                for source in self.sources:
+                    source.apply()
+                if self.sub.poll(200):
+                    while True:
+                        try:
+                            frame = self.sub.recv(zmq.NOBLOCK)
+                        except zmq.Again:
+                            break
+                        self.writer.write(time.time(), frame)
+                now = time.monotonic()
+                if now - last_flush >= 1.0:
+                    self.writer.flush()
+                    last_flush = now
+                if now - last_report >= 10.0:
+                    print(f"[CAPTURE] {self.writer.count} messages, {self.writer.bytes / 2**20:.1f} MB")
+                    last_report = now
+        except KeyboardInterrupt:
+            logging.info("User stopped capture with Ctrl+C.")
+        finally:
+            self.writer.close()
+            self.sub.close()
+            self.cleanup()
+            logging.info(f"Captured {self.writer.count} messages to {self.writer.path}")
+
+
+class ReplayNode(ZMQNode):
+    """Advertise the captured services and publish a capture's frames again."""
+
+    def __init__(self, path, speed=1.0, port_offset=0):
+        super().__init__('replay')
+        self.reader = CaptureReader(path)
+        self.speed = speed
+        self.pubs = {}
+        for service_type, (_, port) in CAPTURED_SERVICES.items():
+            pub = self.socket(zmq.PUB, "reliable")
+            pub.bind(f"tcp://*:{port + port_offset}")
+            self.advertise(service_type, port + port_offset)
+            self.pubs[service_type] = pub
+
+    def restamp(self, frame, epoch, seqs):
+        """Renumber a sequenced event for a new pass: epoch for all, seq counted per publisher."""
+        topic, message = decode_frame(frame)
+        if message.get("seq") is None:
+            return frame
+        publisher = message.get("node_id")
+        seqs[publisher] = seqs.get(publisher, 0) + 1
+        message["seq"] = seqs[publisher]
+        message["epoch"] = epoch
+        return encode_frame(topic, message)
+
+    def replay(self, start=None, end=None, epoch=None):
+        """Publish one pass over the capture; returns the number of frames sent.
+
+        With an epoch, sequenced events are renumbered under it (see restamp);
+        otherwise every frame is sent exactly as captured.
+        """
+        seqs = {}
+        sent = 0
+        first = None
+        began = time.monotonic()
+        for recv_time, frame in self.reader.records(start, end):
+            if first is None:
+                first = recv_time
+            if self.speed > 0:
+                delay = (recv_time - first) / self.speed - (time.monotonic() - began)
+                if delay > 0:
+                    time.sleep(delay)
+            service_type = service_for_frame(frame)
+            if service_type is not None:
+                if epoch is not None and service_type == "motion.flag":
+                    frame = self.restamp(frame, epoch, seqs)
+                self.pubs[service_type].send(frame)
+                sent += 1
+        return sent
+
+    def run(self, start=None, end=None, loop=False, warmup=2.0):
+        self.start_discovery()
+        # Give subscribers time to find us and connect before the first frame
+        time.sleep(warmup)
+        epoch = None
+        try:
+            while True:
+                began = time.monotonic()
+                sent = self.replay(start, end, epoch)
+                elapsed = time.monotonic() - began
+                print(f"[REPLAY] Sent {sent} messages in {elapsed:.2f}s ({sent / elapsed if elapsed else 0:.0f} msg/s)")
+                if not loop:
+                    break
+                # Later passes look like restarted publishers: a newer epoch, seq from 1
+                epoch = int(time.time() * 1000)
+        except KeyboardInterrupt:
+            logging.info("User stopped replay with Ctrl+C.")
+        finally:
+            for pub in self.pubs.values():
+                pub.close()
+            self.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    record = commands.add_parser("record", help="capture live traffic")
+    record.add_argument("--output", help="capture file (default: captures/<timestamp>.zcap)")
+    replay = commands.add_parser("replay", help="publish a capture again")
+    replay.add_argument("path")
+    replay.add_argument("--speed", type=float, default=1.0, help="1 = original pace, 2 = twice as fast, 0 = max")
+    replay.add_argument("--start", type=float, default=0, help="seconds into the capture to start at")
+    replay.add_argument("--end", type=float, help="seconds into the capture to stop at")
+    replay.add_argument("--loop", action="store_true", help="repeat until interrupted")
+    replay.add_argument("--port-offset", type=int, default=0,
+                        help="publish on the usual ports plus this, to run next to live nodes")
+    args = parser.parse_args()
+
+    if args.command == "record":
+        path = args.output or os.path.join(CAPTURE_DIR, datetime.now().strftime("%Y%m%d-%H%M%S") + ".zcap")
+        CaptureNode(path).run()
+    else:
+        node = ReplayNode(args.path, args.speed, args.port_offset)
+        first = node.reader.first_time()
+        if first is None:
+            raise SystemExit(f"{args.path} is empty")
+        start = first + args.start if args.start else None
+        end = first + args.end if args.end is not None else None
+        node.run(start, end, args.loop)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,10 +3,34 @@
 # All nodes listen on this ZeroMQ port
 NODE_PORT = 5555
 
+# Message payload codec: "msgpack" (falls back to JSON if not installed) or "json"
+MESSAGE_CODEC = "msgpack"
+
+# asyncio node runtime
+EXECUTOR_WORKERS = 2  # threads for CPU-bound stages (decode, inference)
+LOOP_LAG_INTERVAL = 1.0  # seconds between event-loop lag samples
+
+# ZeroMQ tuning
+ZMQ_IO_THREADS = 1
+ZMQ_IMAGE_HWM = 4  # queued images per peer before dropping (bounds latency)
+ZMQ_EVENT_HWM = 10000
+ZMQ_EVENT_LINGER_MS = 1000  # time to flush pending events on close
+ZMQ_TCP_KEEPALIVE_IDLE = 30
+ZMQ_TCP_KEEPALIVE_INTVL = 5
+ZMQ_TCP_KEEPALIVE_CNT = 3
+
 # UDP discovery settings (same subnet)
 DISCOVERY_PORT = 50000
 DISCOVERY_BROADCAST = "255.255.255.255"
 DISCOVERY_INTERVAL = 2  # seconds between broadcast pings
+DISCOVERY_JITTER = 0.25  # +/- fraction applied to each announce interval
+DISCOVERY_TTL = 7  # seconds without an announce before a peer is dropped
+DISCOVERY_BURST = 3  # fast announces sent at startup and when a new peer joins
+DISCOVERY_BURST_INTERVAL = 0.2
+
+# Network identity: interface to advertise (e.g. "wlan0"), None picks the default route
+NETWORK_INTERFACE = None
+NETWORK_REFRESH_INTERVAL = 60  # seconds between re-resolving local addresses
 
 # System monitor update interval (seconds)
 SYSTEM_MONITOR_INTERVAL = 1
@@ -17,21 +41,135 @@ SYSTEM_MONITOR_PORT = 5559
 # Motion detection ports
 MOTION_FLAG_PORT = 5556
 MOTION_IMAGE_PORT = 5557
+MOTION_REPLAY_PORT = 5560  # ROUTER serving missed motion flags
+
+# Motion flags kept for replay to subscribers that detect a gap
+REPLAY_BUFFER_SIZE = 1024
+REPLAY_TIMEOUT = 1.0  # seconds to wait for a replay reply
 
 # Detection results port
 DETECTION_PORT = 5558
 
+# Relative capacity hint a detection node advertises; motion sources are
+# shared between detection nodes in proportion to it
+DETECTION_CAPACITY = 1
+
+# Shared-memory frame handoff to co-located consumers
+FRAME_RING_SLOTS = 8  # raw frames buffered in shared memory per motion node
+FRAME_LEASE_SECONDS = 5  # a slot is reused after this even if not released
+FRAME_IPC_DIR = '/tmp'  # directory for ipc:// socket files
+
 # Motion detection settings
 MOTION_URL = 'rtsp://127.0.0.1:8554/stream'
+# Cameras handled by one motion node: camera ID -> stream URL
+MOTION_CAMERAS = {
+    'cam0': MOTION_URL,
+}
+MOTION_WORKERS = 2  # threads analysing frames across all cameras
+CAMERA_STATS_INTERVAL = 10  # seconds between per-camera fps/CPU reports
 MOTION_THRESHOLD = 0.33
 PIXEL_DIFF_THRESHOLD = 50
 BLUR_SIGMA = 1.5
 KERNEL_SIZE = 5
 MOTION_FPS = 10
+# Adaptive analysis rate: ffmpeg always decodes MOTION_FPS, but while the
+# scene is quiet only MOTION_IDLE_FPS frames/s are analysed
+MOTION_IDLE_FPS = 2  # 0 analyses every frame
+MOTION_WAKE_RATIO = 0.1  # change ratio that switches to full rate (below MOTION_THRESHOLD)
+MOTION_IDLE_AFTER = 10  # quiet seconds before dropping back to MOTION_IDLE_FPS
 
 # YOLO model path
 MODEL_PATH = "yolo26n_ncnn_model"
 
+# Images saved by the detection node under detection_images/: None (off),
+# "raw" (the JPEG as received) or "annotated" (boxes drawn, re-encoded)
+DETECTION_SAVE_IMAGES = None
+
+# Background image writer (image_writer.py)
+IMAGE_WRITER_WORKERS = 2
+IMAGE_WRITER_QUEUE = 64  # images waiting to be written before new ones are dropped
+IMAGE_WRITER_FSYNC_BATCH = 16  # files committed together (one directory fsync per batch)
+IMAGE_WRITER_FSYNC_INTERVAL = 1.0  # seconds a written file may wait for its batch
+IMAGE_WRITER_STATS_INTERVAL = 60  # seconds between written/dropped reports
+
 # Recording settings
 RECORD_DURATION = 15
 RECORD_FPS = 10
+RECORD_MIN_FREE_BYTES = 256 * 1024**2  # skip a clip rather than fail it mid-way
+# Clip container: "fmp4" (fragmented MP4, playable while recording and after
+# a crash), "hls" (fMP4 segments + playlist in a directory per clip) or "mp4"
+RECORD_FORMAT = "fmp4"
+RECORD_FRAGMENT_SECONDS = 1  # keyframe interval; each keyframe starts a new fragment
+RECORD_SEGMENT_SECONDS = 2  # HLS segment length
+RECORD_VIDEO_CODEC = 'libx264'  # 'copy' stores the camera's H.264 as is, without re-encoding
+
+# Recording catalog (recording_index.py): kept outside recordings/ so
+# retention never deletes it
+RECORDING_INDEX_PATH = "recording_index.db"
+RECORDING_THUMBNAILS = 6  # frames in each clip's thumbnail strip
+RECORDING_THUMBNAIL_WIDTH = 160  # pixels per thumbnail
+
+# Storage retention (storage.py, run by system_monitor.py): directory -> limits
+STORAGE_QUOTAS = {
+    'recordings': {'max_bytes': 8 * 1024**3, 'max_age_days': 14},
+    'detection_images': {'max_bytes': 1 * 1024**3, 'max_age_days': 7},
+    'received_images': {'max_bytes': 1 * 1024**3, 'max_age_days': 3},
+}
+STORAGE_MIN_FREE_BYTES = 1024**3  # delete oldest files anywhere below this much free space
+STORAGE_SCAN_INTERVAL = 10  # seconds between index refreshes and metric reports
+STORAGE_DELETE_RATE = 20  # files deleted per second at most
+STORAGE_DELETE_BYTES_PER_S = 64 * 1024**2  # bytes deleted per second at most
+
+# Time-series store settings
+TSDB_DIR = "metrics"
+DASHBOARD_TSDB_DIR = "dashboard_metrics"  # samples the dashboard receives from every node
+TSDB_RETENTION_DAYS = 30
+TSDB_RAW_DAYS = 1  # keep full resolution for this many days
+TSDB_COMPACT_STEP = 60  # seconds per averaged point after compaction
+TSDB_FLUSH_INTERVAL = 1.0
+TSDB_BATCH_SIZE = 500
+
+# Live dashboard stream (Server-Sent Events) port
+DASHBOARD_STREAM_PORT = 8502
+
+# API forwarding outbox (draft/requests/api_subscriber.py)
+OUTBOX_DIR = "outbox"
+OUTBOX_BATCH_SIZE = 50  # events per POST
+OUTBOX_CONCURRENCY = 2  # POSTs in flight
+OUTBOX_TIMEOUT = 5  # seconds per request
+OUTBOX_MAX_BACKOFF = 30  # seconds between retries at most
+OUTBOX_COMPACT_BYTES = 1024 * 1024  # restart the log once fully delivered and this large
+
+# Traffic capture (capture.py)
+CAPTURE_DIR = "captures"
+CAPTURE_INDEX_EVERY = 256  # records between index entries
+
+# Object tracking between detections (tracking.py)
+TRACK_FPS = 5  # frames/s a motion node shares while motion lasts; 0 disables tracking
+TRACK_DETECT_INTERVAL_MIN = 0.5  # seconds between full detections while tracks change
+TRACK_DETECT_INTERVAL_MAX = 4.0  # seconds between full detections while every track is stable
+TRACK_IOU_THRESHOLD = 0.3  # least overlap between a detection and a predicted box to match
+TRACK_STABLE_IOU = 0.6  # matches at least this close count as stable
+TRACK_MAX_MISSES = 2  # detections a track may go unmatched before it is dropped
+TRACK_MIN_HITS = 2  # detections before a track is published
+TRACK_RESET_SECONDS = 3.0  # a gap this long between frames (motion ended) starts afresh
+
+# Alarms (alarm.py): rules on detected objects and where alarms are sent.
+# Rule keys: name, classes ("*" for any), min_confidence, cameras, nodes,
+# zone [x1, y1, x2, y2], hours ("HH:MM", "HH:MM"), days (0 = Monday),
+# cooldown, sinks (names in ALARM_SINKS; all if omitted)
+ALARM_RULES = [
+    {'name': 'person', 'classes': ['person'], 'min_confidence': 0.6},
+]
+ALARM_SINKS = {
+    'log': {'type': 'log'},
+    'file': {'type': 'file', 'path': 'alarms/alarms.jsonl'},
+    # 'push': {'type': 'webhook', 'url': 'https://ntfy.sh/my-cameras'},
+}
+ALARM_COOLDOWN = 60  # seconds a rule stays quiet per camera and class after firing
+ALARM_BATCH_SIZE = 20  # alarms per sink delivery
+ALARM_BATCH_INTERVAL = 2.0  # seconds to wait for a batch to fill
+ALARM_QUEUE = 1000  # alarms queued per sink before new ones are dropped
+ALARM_MAX_BACKOFF = 30  # seconds between delivery retries at most
+ALARM_TIMEOUT = 5  # seconds per webhook request
+ALARM_STATS_INTERVAL = 60  # seconds between metric reports
@@ -1,11 +1,11 @@
+import asyncio
 import base64
 import json
 import os
 import socket
-import threading
 import time
 import logging
-from datetime import datetime
+from datetime import datetime, time as dtime
 import cv2
 import numpy as np
 import zmq
@@ -16,24 +16,47 @@ from ultralytics import YOLO
 sys.path.append('.')
 
 from config import (
-    MOTION_IMAGE_PORT,
     DETECTION_PORT,
+    DETECTION_CAPACITY,
+    DETECTION_SAVE_IMAGES,
+    IMAGE_WRITER_STATS_INTERVAL,
     MODEL_PATH,
+    TRACK_FPS,
 )
-from utils import ZMQNode
+from frame_ring import SharedFrameReader
+from image_writer import ImageWriter
+from runtime import AsyncZMQNode
+from tracking import CameraTracker, time_of_day_seconds
+from tsdb import TimeSeriesStore
+from utils import (
+    TOPIC_DETECTION,
+    TOPIC_IMAGE,
+    TOPIC_TRACK_FRAME,
+    TOPIC_TRACKS,
+    make_topic,
+    subscribe,
+)
+
+def transfer_latency_ms(send_ts, recv_dt):
+    """Latency between a motion node's time-of-day stamp and local receive time."""
+    try:
+        sent = datetime.combine(recv_dt.date(), dtime.fromisoformat(send_ts))
+    except (TypeError, ValueError):
+        return None
+    latency = (recv_dt - sent).total_seconds() * 1000
+    return latency if latency >= 0 else None
+
+def encode_jpeg(image):
+    """Encode a BGR image to JPEG bytes, None on failure."""
+    ok, buffer = cv2.imencode('.jpg', image)
+    return buffer.tobytes() if ok else None
+
+class YoloDetector:
+    """YOLO inference on motion images, independent of any sockets."""
 
-class DetectionProcessor(ZMQNode):
     def __init__(self, model_path):
-        super().__init__('detection')
-        self.pub_port = DETECTION_PORT
         self.model_path = model_path
         self.model = self.load_model()
-        self.sub_socket = self.context.socket(zmq.SUB)
-        self.sub_socket.setsockopt_string(zmq.SUBSCRIBE, "")
-        self.det_pub = self.context.socket(zmq.PUB)
-        self.det_pub.bind(f"tcp://*:{DETECTION_PORT}")
-        self.image_count = 0
-        self.motion_source_endpoint = f"tcp://127.0.0.1:{MOTION_IMAGE_PORT}"
 
     def load_model(self):
         """Load the YOLO model from the given path."""
@@ -43,110 +66,252 @@ class DetectionProcessor(ZMQNode):
         """Run inference on the image using the model."""
         return self.model(image)
 
-    def save_image(self, results, sender, timestamp):
-        """Save YOLO-annotated result image to disk."""
-        output_dir = "detection_images"
-        os.makedirs(output_dir, exist_ok=True)
-        safe_ts = timestamp.replace(":", "-")
-        image_path = os.path.join(output_dir, f"{sender}_{safe_ts}.jpg")
+    def process_image(self, image_b64):
+        """Decode and run inference on one image. CPU-bound, runs in the executor."""
+        decode_start = time.perf_counter()
+        jpeg_bytes = base64.b64decode(image_b64)
+        frame = cv2.imdecode(np.frombuffer(jpeg_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if frame is None:
+            return None
+        return self.process_frame(frame, decode_start)
+
+    def process_frame(self, frame, decode_start=None):
+        """Run inference on a decoded BGR frame. CPU-bound, runs in the executor."""
+        inference_start = time.perf_counter()
+        if decode_start is None:
+            decode_start = inference_start
+        results = self.run_inference(frame)
+        inference_end = time.perf_counter()
+
+        # Prepare detection results
+        detections = []
+        for result in results:
+            for box in result.boxes:
+                class_id = int(box.cls)
+                confidence = float(box.conf)
+                class_name = self.model.names[class_id]
+                detections.append({
+                    "class": class_name,
+                    "confidence": confidence,
+                    "box": [int(v) for v in box.xyxy[0].tolist()],
+                })
+
+        timings = {
+            "decode_ms": (inference_start - decode_start) * 1000,
+            "inference_ms": (inference_end - inference_start) * 1000,
+        }
+        return results, detections, timings
+
+
+class DetectionProcessor(AsyncZMQNode):
+    def __init__(self, model_path):
+        super().__init__('detection')
+        self.pub_port = DETECTION_PORT
+        self.advertise("detection", DETECTION_PORT, capacity=DETECTION_CAPACITY)
+        self.detector = YoloDetector(model_path)
+        self.sub_socket = self.async_socket(zmq.SUB, "bulk")
+        subscribe(self.sub_socket, TOPIC_IMAGE)
+        if TRACK_FPS:
+            subscribe(self.sub_socket, TOPIC_TRACK_FRAME)
+        self.det_topic = make_topic(TOPIC_DETECTION, self.node_id)
+        self.tracks_topic = make_topic(TOPIC_TRACKS, self.node_id)
+        self.det_pub = self.async_socket(zmq.PUB, "reliable")
+        self.det_pub.bind(f"tcp://*:{DETECTION_PORT}")
+        self.image_count = 0
+        # Motion sources are split between all detection nodes by capacity
+        self.motion_sources = self.subscribe_service(self.sub_socket, "motion.image", share_with="detection")
+        self.store = TimeSeriesStore().start()
+        # Shared frame rings of co-located motion nodes, by shm name
+        self.frame_readers = {}
+        self.image_writer = ImageWriter("detection_images").start() if DETECTION_SAVE_IMAGES else None
+        # (sender, camera_id) -> CameraTracker
+        self.trackers = {}
+
+    def save_image(self, results, sender, camera_id, timestamp, image_b64=None):
+        """Queue the input image (or the YOLO-annotated one) for the background writer."""
         if not results:
             return
-        annotated_image = results[0].plot()
-        cv2.imwrite(image_path, annotated_image)
-        logging.info(f"Saved result image: {image_path}")
+        safe_ts = timestamp.replace(":", "-")
+        name = f"{sender}_{camera_id}_{safe_ts}.jpg" if camera_id else f"{sender}_{safe_ts}.jpg"
+        if DETECTION_SAVE_IMAGES == "annotated":
+            render = lambda: encode_jpeg(results[0].plot())
+        elif image_b64:
+            render = lambda: base64.b64decode(image_b64)  # the JPEG as received, no re-encode
+        else:
+            # Shared-memory frame, never encoded; process_frame_ref copied it out of the slot
+            render = lambda: encode_jpeg(results[0].orig_img)
+        # Plotting, encoding and disk I/O run on the writer's threads
+        path = self.image_writer.submit(name, render=render)
+        if path is None:
+            logging.warning(f"Image writer queue full, not saving {name}")
 
-    def publish_detection_results(self, detections, timestamp, sender):
+    async def publish_detection_results(self, detections, timestamp, sender, camera_id=None):
         """Publish detection results via ZeroMQ."""
         message = {
             "type": "detection_results",
             "node_id": self.node_id,
             "sender": sender,
+            "camera_id": camera_id,
             "detections": detections,
             "ts": timestamp,
         }
-        self.det_pub.send_json(message)
+        await self.send(self.det_pub, self.det_topic, message)
         logging.info(f"Detection results published: {detections}")
 
-    def subscriber_loop(self):
-        self.sub_socket.connect(self.motion_source_endpoint)
-        print(f"[SUB] Connected to {self.motion_source_endpoint}")
-
-        while not self.stop_event.is_set():
-            try:
-                if self.sub_socket.poll(1000):
-                    recv_ts = datetime.now().isoformat()
-                    message = self.sub_socket.recv_json()
-                    if message.get("type") != "image":
-                        continue
-
-                    image_b64 = message.get("image_data")
-                    sender = message.get("node_id", "unknown")
-                    if not image_b64:
-                        continue
-
-                    jpeg_bytes = base64.b64decode(image_b64)
-                    frame = cv2.imdecode(np.frombuffer(jpeg_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
-                    if frame is None:
-                        print("[SUB] Failed to decode image")
-                        continue
-
-                    self.image_count += 1
-                    results = self.run_inference(frame)
-                    detection_ts = datetime.now().isoformat()
-
-                    # Optional: uncomment to save each annotated result image
-                    # self.save_image(results, sender, detection_ts)
-
-                    print(f"[SUB] Inference #{self.image_count} from {sender}")
-
-                    # Prepare detection results
-                    detections = []
-                    for result in results:
-                        for box in result.boxes:
-                            class_id = int(box.cls)
-                            confidence = float(box.conf)
-                            class_name = self.model.names[class_id]
-                            detections.append({
-                                "class": class_name,
-                                "confidence": confidence
-                            })
-
-                    send_ts = message.get("ts", "unknown")
-                    logging.info(f"Image from {sender} - Send TS: {send_ts} - Recv TS: {recv_ts} - Detect TS: {detection_ts} - Results: {len(detections)} detections")
-
-                    # Publish detection results
-                    self.publish_detection_results(detections, detection_ts, sender)
-
-            except zmq.error.ContextTerminated:
-                break
-            except Exception as e:
-                if not self.stop_event.is_set():
-                    print(f"[SUB] Error: {e}")
+    async def publish_tracks(self, tracker, timestamp, sender, camera_id, detected):
+        """Publish a camera's confirmed tracks as of the frame at timestamp."""
+        message = {
+            "type": "tracks",
+            "node_id": self.node_id,
+            "sender": sender,
+            "camera_id": camera_id,
+            "tracks": tracker.tracks(),
+            "detected": detected,  # False: boxes are predictions carried from the last detection
+            "ts": timestamp,
+        }
+        await self.send(self.det_pub, self.tracks_topic, message)
+
+    def tracker(self, sender, camera_id):
+        tracker = self.trackers.get((sender, camera_id))
+        if tracker is None:
+            tracker = self.trackers[(sender, camera_id)] = CameraTracker()
+        return tracker
 
-        self.sub_socket.close()
+    def frame_reader(self, ref):
+        """Attach to a motion node's frame ring, re-attaching if it was recreated."""
+        reader = self.frame_readers.get(ref["shm"])
+        if reader is not None and not reader.same_ring(ref):
+            # The producer restarted; an overwritten slot alone is no reason to re-attach
+            reader.close()
+            reader = None
+        if reader is None:
+            reader = SharedFrameReader(self.context, ref["shm"], ref["release"], ref.get("ring"))
+            self.frame_readers[ref["shm"]] = reader
+        return reader
 
-    def run(self):
-        # Discovery disabled; using fixed local endpoint for motion images
+    def release_frame_ref(self, ref):
+        """Hand a shared-memory slot back without reading it."""
+        try:
+            self.frame_reader(ref).release(ref)
+        except FileNotFoundError:
+            pass
+
+    async def process_frame_ref(self, ref):
+        """Run inference directly on a shared-memory slot, then hand it back."""
+        try:
+            reader = self.frame_reader(ref)
+        except FileNotFoundError:
+            logging.warning(f"Shared frame ring {ref['shm']} is gone")
+            return None
+        if not reader.is_current(ref):
+            # Lease expired before we got to it; the slot belongs to a newer frame
+            logging.warning(f"Frame {ref['seq']} from {ref['node_id']} was overwritten before inference")
+            return None
+        try:
+            processed = await self.offload(self.detector.process_frame, reader.view(ref))
+            if processed is not None and self.image_writer is not None:
+                # The image is rendered later on a writer thread, after the slot
+                # is released below: give the results their own copy of the frame
+                for result in processed[0]:
+                    result.orig_img = result.orig_img.copy()
+            # Checked after the copy, so a copy of a half-overwritten slot is discarded too
+            if not reader.is_current(ref):
+                logging.warning(f"Frame {ref['seq']} from {ref['node_id']} was overwritten during inference")
+                return None
+            return processed
+        finally:
+            reader.release(ref)
+
+    async def handle_image(self, topic, message):
+        recv_dt = datetime.now()
+        recv_ts = recv_dt.isoformat()
+
+        sender = message.get("node_id", "unknown")
+        camera_id = message.get("camera_id")
+        send_ts = message.get("ts", "unknown")
+        tracker = self.tracker(sender, camera_id) if TRACK_FPS else None
+        if tracker is not None:
+            detection_due = tracker.advance(time_of_day_seconds(send_ts))
+            if topic.startswith(f"{TOPIC_TRACK_FRAME}.") and not detection_due:
+                # Between detections the tracks are predicted; the frame is not even decoded
+                if message.get("type") == "frame_ref":
+                    self.release_frame_ref(message)
+                await self.publish_tracks(tracker, send_ts, sender, camera_id, False)
+                return
+
+        if message.get("type") == "frame_ref":
+            processed = await self.process_frame_ref(message)
+        else:
+            image_b64 = message.get("image_data")
+            if not image_b64:
+                return
+            processed = await self.offload(self.detector.process_image, image_b64)
+        if processed is None:
+            print("[SUB] Failed to decode image")
+            return
+        results, detections, latencies = processed
+        self.image_count += 1
+        detection_ts = datetime.now().isoformat()
 
-        # Start subscriber thread
-        sub_thread = threading.Thread(target=self.subscriber_loop, daemon=True)
-        sub_thread.start()
+        if self.image_writer is not None:
+            self.save_image(results, sender, camera_id, detection_ts, message.get("image_data"))
+
+        print(f"[SUB] Inference #{self.image_count} from {sender}")
+
+        logging.info(f"Image from {sender} - Send TS: {send_ts} - Recv TS: {recv_ts} - Detect TS: {detection_ts} - Results: {len(detections)} detections")
+
+        # Publish detection results
+        await self.publish_detection_results(detections, detection_ts, sender, camera_id)
+
+        latencies["transfer_ms"] = transfer_latency_ms(send_ts, recv_dt)
+        self.store.write_points(latencies, self.node_id)
+        self.store.write_event("detection_results", self.node_id, {
+            "sender": sender,
+            "camera_id": camera_id,
+            "detections": detections,
+            "ts": detection_ts,
+        })
+
+        if tracker is not None:
+            # Motion onset images seed the tracks, tracking frames correct them
+            tracks = tracker.observe(time_of_day_seconds(send_ts), detections)
+            await self.publish_tracks(tracker, send_ts, sender, camera_id, True)
+            frames, detected = tracker.take_stats()
+            self.store.write_points({
+                "tracks": len(tracks),
+                "detect_interval": tracker.interval,
+                "track_frames": frames,
+                "track_detections": detected,
+            }, f"{self.node_id}/{sender}/{camera_id}")
+
+    async def report_image_writer_stats(self):
+        while True:
+            await asyncio.sleep(IMAGE_WRITER_STATS_INTERVAL)
+            stats = self.image_writer.take_stats()
+            self.store.write_points(stats, f"{self.node_id}/image_writer")
+            logging.info(f"[IMAGE_WRITER] {stats['written']} written, {stats['dropped']} dropped, "
+                         f"{stats['failed']} failed, {stats['fsync_batches']} batches, {stats['queued']} queued")
+
+    async def start(self):
+        self.spawn(self.subscription_loop(self.motion_sources, self.handle_image))
+        if self.image_writer is not None:
+            self.spawn(self.report_image_writer_stats())
 
         logging.info(f"[DET_PUB:{self.node_id}] Listening on tcp://*:{DETECTION_PORT}")
-        logging.info(f"[SUB:{self.node_id}] Subscribing to motion images on port {MOTION_IMAGE_PORT}")
+        logging.info(f"[SUB:{self.node_id}] Subscribing to discovered motion.image services")
         logging.info(f"[PUB:{self.node_id}] Local IP: {self.get_local_ip()}")
 
         print(f"[DET:{self.node_id}] Detection processor started")
         print(f"[DET:{self.node_id}] Local IP: {self.get_local_ip()}\n")
 
-        try:
-            while True:
-                time.sleep(1)
-        except KeyboardInterrupt:
-            logging.info("User stopped detection processor with Ctrl+C.")
-        finally:
-            self.det_pub.close()
-            self.cleanup()
+    def close(self):
+        for reader in self.frame_readers.values():
+            reader.close()
+        self.sub_socket.close()
+        self.det_pub.close()
+        self.store.close()
+        if self.image_writer is not None:
+            self.image_writer.stop()
 
 if __name__ == "__main__":
     # Model path - NCNN model in root dir
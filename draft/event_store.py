@@ -0,0 +1,199 @@
+"""
+Append-only store for events posted to the ingest API.
+
+Events go into a SQLite log (WAL mode) instead of a JSON file rewritten on
+every POST. Concurrent POSTs are group-committed: a writer thread inserts
+everything queued so far in one transaction, so one fsync covers a whole
+batch, and each POST returns once its batch is durable. Embedded base64
+images are stored once per content hash under blobs/ and replaced by an
+"image_blob" reference, so the log stays small. Reads are time-ranged and
+paginated by id, so neither ingest nor queries scale with total history.
+"""
+import base64
+import hashlib
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    node_id TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_ts ON events (ts);
+"""
+
+# Writer waits this long for more events before committing a batch (seconds)
+COMMIT_DELAY = 0.005
+MAX_BATCH = 1000
+
+
+def parse_time(value):
+    """Accept epoch seconds or an ISO 8601 timestamp; None stays None."""
+    if value is None or value == "":
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+class EventStore:
+    def __init__(self, path="event_store"):
+        self.path = path
+        self.blob_dir = os.path.join(path, "blobs")
+        os.makedirs(self.blob_dir, exist_ok=True)
+        self.db_path = os.path.join(path, "events.db")
+        conn = self._connect()
+        conn.executescript(SCHEMA)
+        conn.close()
+        self.pending = queue.Queue()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._writer_loop, daemon=True, name="event-store")
+        self.thread.start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # FULL: every committed batch is fsynced before writers are released
+        conn.execute("PRAGMA synchronous=FULL")
+        return conn
+
+    def _store_blob(self, image_b64):
+        # binascii.Error (a ValueError) on malformed input, before anything is written
+        data = base64.b64decode(image_b64, validate=True)
+        digest = hashlib.sha256(data).hexdigest()
+        blob_path = self.blob_path(digest)
+        if not os.path.exists(blob_path):
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            tmp_path = f"{blob_path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, blob_path)
+        return digest
+
+    def blob_path(self, digest):
+        return os.path.join(self.blob_dir, digest[:2], digest)
+
+    def _extract_blobs(self, value):
+        """Replace every "image_data" field with an "image_blob" content hash."""
+        if isinstance(value, dict):
+            out = {}
+            for key, item in value.items():
+                if key == "image_data" and isinstance(item, str):
+                    out["image_blob"] = self._store_blob(item)
+                else:
+                    out[key] = self._extract_blobs(item)
+            return out
+        if isinstance(value, list):
+            return [self._extract_blobs(item) for item in value]
+        return value
+
+    def _node_id(self, event):
+        metadata = event.get("event", {}).get("metadata", {}) if isinstance(event.get("event"), dict) else {}
+        return metadata.get("node_id") or event.get("node_id")
+
+    def _row(self, now, event):
+        if not isinstance(event, dict):
+            raise ValueError("event is not a JSON object")
+        return now, self._node_id(event), json.dumps(self._extract_blobs(event), separators=(",", ":"))
+
+    def append(self, events):
+        """Store events durably and return (ids, rejected). Blocks until the batch is committed.
+
+        Events that cannot be stored (not an object, or an "image_data" that
+        is not valid base64) are skipped and listed in rejected as
+        {"index": position in events, "error": reason}; the others are stored.
+        """
+        now = time.time()
+        rows, rejected = [], []
+        for position, event in enumerate(events):
+            try:
+                rows.append(self._row(now, event))
+            except ValueError as e:
+                rejected.append({"index": position, "error": str(e)})
+        if not rows:
+            return [], rejected
+        done = threading.Event()
+        request = {"rows": rows, "done": done, "ids": None, "error": None}
+        self.pending.put(request)
+        done.wait()
+        if request["error"] is not None:
+            raise request["error"]
+        return request["ids"], rejected
+
+    def _writer_loop(self):
+        conn = self._connect()
+        while not self.stop_event.is_set():
+            try:
+                batch = [self.pending.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+            # Gather whatever else arrives shortly so one commit covers it
+            deadline = time.monotonic() + COMMIT_DELAY
+            while len(batch) < MAX_BATCH:
+                try:
+                    batch.append(self.pending.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            try:
+                with conn:
+                    for request in batch:
+                        ids = []
+                        for row in request["rows"]:
+                            ids.append(conn.execute(
+                                "INSERT INTO events (ts, node_id, data) VALUES (?, ?, ?)", row).lastrowid)
+                        request["ids"] = ids
+            except sqlite3.Error as e:
+                logging.error(f"Event store write failed: {e}")
+                for request in batch:
+                    request["error"] = e
+            for request in batch:
+                request["done"].set()
+        conn.close()
+
+    def query(self, since=None, until=None, after_id=0, limit=100, node_id=None):
+        """Return (events, next_after_id) in id order; next_after_id is None on the last page."""
+        clauses, params = ["id > ?"], [after_id]
+        if since is not None:
+            clauses.append("ts >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("ts < ?")
+            params.append(until)
+        if node_id is not None:
+            clauses.append("node_id = ?")
+            params.append(node_id)
+        params.append(limit + 1)
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                f"SELECT id, ts, data FROM events WHERE {' AND '.join(clauses)} ORDER BY id LIMIT ?",
+                params,
+            ).fetchall()
+        finally:
+            conn.close()
+        events = [{"id": row_id, "received": ts, **json.loads(data)} for row_id, ts, data in rows[:limit]]
+        next_after_id = events[-1]["id"] if len(rows) > limit else None
+        return events, next_after_id
+
+    def import_json(self, events_file):
+        """One-off import of a legacy events.json list."""
+        with open(events_file) as f:
+            events = json.load(f)
+        rejected = self.append(events)[1] if events else []
+        os.replace(events_file, events_file + ".imported")
+        logging.info(f"Imported {len(events) - len(rejected)} events from {events_file}, {len(rejected)} rejected")
+
+    def close(self):
+        self.stop_event.set()
+        self.thread.join()
@@ -19,6 +19,7 @@ from config import (
     DISCOVERY_BROADCAST,
     DISCOVERY_PORT,
 )
+from image_writer import ImageWriter
 
 
 def get_local_ip():
@@ -34,19 +35,13 @@ NODE_ID = f"{socket.gethostname()}"
 MOTION_PORT = 5555
 
 
-def save_jpeg_bytes(jpeg_bytes, output_path):
-    """Save raw JPEG bytes to a file"""
-    with open(output_path, "wb") as img_file:
-        img_file.write(jpeg_bytes)
-
-
 def subscriber_loop(context, peers_info, stop_event, output_dir="received_images"):
     """Subscribe to and receive images from peers"""
     sub_socket = context.socket(zmq.SUB)
     sub_socket.setsockopt_string(zmq.SUBSCRIBE, "")
     
-    # Create output directory if it doesn't exist
-    os.makedirs(output_dir, exist_ok=True)
+    # Files are written off the receive loop, into output_dir/YYYY-MM-DD/HH/
+    writer = ImageWriter(output_dir).start()
     
     connected_peers = set()
     image_count = 0
@@ -72,8 +67,10 @@ def subscriber_loop(context, peers_info, stop_event, output_dir="received_images
                     if image_b64:
                         jpeg_bytes = base64.b64decode(image_b64)
                         filename = f"{sender}_motion_{receive_time.strftime('%Y%m%d_%H%M%S_%f')}.jpg"
-                        output_path = os.path.join(output_dir, filename)
-                        save_jpeg_bytes(jpeg_bytes, output_path)
+                        output_path = writer.submit(filename, jpeg_bytes, when=receive_time)
+                        if output_path is None:
+                            print(f"[SUB:{NODE_ID}] Writer queue full, dropped image from {sender}")
+                            continue
                         image_count += 1
 
                         # Calculate latency if publish timestamp is available
@@ -89,7 +86,7 @@ def subscriber_loop(context, peers_info, stop_event, output_dir="received_images
                         print(f"\n✓ Motion image #{image_count}")
                         print(f"  From:     {sender}")
                         print(f"  Received: {receive_time.isoformat()}")
-                        print(f"  Saved:    {output_path}")
+                        print(f"  Saving:   {output_path}")
                         if latency_info:
                             print(latency_info)
                         print()
@@ -107,6 +104,7 @@ def subscriber_loop(context, peers_info, stop_event, output_dir="received_images
                 print(f"[SUB:{NODE_ID}] Error: {e}")
             connected_peers.clear()  # Reconnect on error
     
+    writer.stop()
     sub_socket.close()
 
 
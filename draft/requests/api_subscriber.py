@@ -1,4 +1,3 @@
-import requests
 import json
 import socket
 import threading
@@ -14,6 +13,7 @@ from config import (
     DISCOVERY_PORT,
     NODE_PORT,
 )
+from outbox import Forwarder
 
 # Configure logging
 logging.basicConfig(
@@ -86,18 +86,7 @@ def discovery_loop(stop_event, peers_info, node_id, port):
 
     sock.close()
 
-def send_to_api(message, api_url):
-    """Send the message to the local REST API."""
-    try:
-        response = requests.post(api_url, json=message)
-        if response.status_code == 200:
-            logging.info(f"Successfully sent message to API: {message.get('type')}")
-        else:
-            logging.error(f"Failed to send message to API: {response.status_code} - {response.text}")
-    except Exception as e:
-        logging.error(f"Error sending to API: {e}")
-
-def subscriber_loop(context, peers_info, stop_event, api_url):
+def subscriber_loop(context, peers_info, stop_event, forwarder):
     sub_socket = context.socket(zmq.SUB)
     sub_socket.setsockopt_string(zmq.SUBSCRIBE, "")
 
@@ -141,7 +130,8 @@ def subscriber_loop(context, peers_info, stop_event, api_url):
                             }
                         }
                     }
-                    send_to_api(combined, api_url)
+                    # Persisted to the outbox; delivery happens off this loop
+                    forwarder.submit(combined)
                     current_event = None
 
         except zmq.error.ContextTerminated:
@@ -160,10 +150,11 @@ if __name__ == "__main__":
     context = zmq.Context()
     peers_info = {}
     stop_event = threading.Event()
+    forwarder = Forwarder(api_url).start()
 
     sub_thread = threading.Thread(
         target=subscriber_loop,
-        args=(context, peers_info, stop_event, api_url),
+        args=(context, peers_info, stop_event, forwarder),
         daemon=True,
     )
     sub_thread.start()
@@ -186,5 +177,6 @@ if __name__ == "__main__":
         print("\n[INFO] Shutting down...")
     finally:
         stop_event.set()
+        forwarder.stop()
         context.term()
 
@@ -0,0 +1,215 @@
+"""
+Durable forwarding of events to the REST API.
+
+Events are appended to an on-disk outbox (one JSON line each) before the
+receive loop moves on, so a slow or unreachable API never blocks it and
+nothing is lost while the API is down. A Forwarder drains the outbox in
+batches over one pooled keep-alive session, with a bounded number of
+requests in flight and exponential backoff on failure. The delivered
+position is stored next to the log, so after a restart everything not yet
+acknowledged is sent again (at-least-once).
+"""
+import json
+import logging
+import os
+import random
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Repository root, wherever the script is run from
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from config import (
+    OUTBOX_BATCH_SIZE,
+    OUTBOX_COMPACT_BYTES,
+    OUTBOX_CONCURRENCY,
+    OUTBOX_DIR,
+    OUTBOX_MAX_BACKOFF,
+    OUTBOX_TIMEOUT,
+)
+
+
+class Outbox:
+    """Append-only JSON-lines log with a committed byte offset."""
+
+    def __init__(self, directory=OUTBOX_DIR, compact_bytes=OUTBOX_COMPACT_BYTES):
+        os.makedirs(directory, exist_ok=True)
+        self.log_path = os.path.join(directory, "outbox.jsonl")
+        self.offset_path = os.path.join(directory, "outbox.offset")
+        self.compact_bytes = compact_bytes
+        self.lock = threading.Lock()
+        self.log = open(self.log_path, "ab")
+        self.committed = self._load_offset()
+        # Next byte to hand out; batches between committed and read_pos are in flight
+        self.read_pos = self.committed
+        # Acknowledged batches not yet contiguous with committed: start -> end
+        self.acked = {}
+
+    def _load_offset(self):
+        try:
+            with open(self.offset_path) as f:
+                offset = int(f.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+        return min(offset, os.path.getsize(self.log_path))
+
+    def _store_offset(self):
+        tmp_path = self.offset_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(str(self.committed))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.offset_path)
+
+    def append(self, event):
+        line = json.dumps(event, separators=(",", ":")).encode("utf-8") + b"\n"
+        with self.lock:
+            self.log.write(line)
+            self.log.flush()
+            os.fsync(self.log.fileno())
+
+    def pending(self):
+        """Bytes written but not yet acknowledged."""
+        with self.lock:
+            return self.log.tell() - self.committed
+
+    def next_batch(self, max_events):
+        """Return (start, end, events) for up to max_events not yet handed out, or None."""
+        with self.lock:
+            events = []
+            start = end = self.read_pos
+            with open(self.log_path, "rb") as f:
+                f.seek(start)
+                while len(events) < max_events:
+                    line = f.readline()
+                    if not line.endswith(b"\n"):
+                        break  # nothing more, or a torn write after a crash
+                    end += len(line)
+                    try:
+                        events.append(json.loads(line))
+                    except ValueError:
+                        logging.error(f"Skipping corrupt outbox record at byte {end - len(line)}")
+            if end == start:
+                return None
+            self.read_pos = end
+            return start, end, events
+
+    def ack(self, start, end):
+        """Mark a batch delivered; the committed offset only moves over contiguous batches."""
+        with self.lock:
+            self.acked[start] = end
+            moved = False
+            while self.committed in self.acked:
+                self.committed = self.acked.pop(self.committed)
+                moved = True
+            if not moved:
+                return
+            if self.committed == self.read_pos == self.log.tell() and self.committed >= self.compact_bytes:
+                # Everything delivered: start the log over instead of growing it forever
+                self.log.truncate(0)
+                self.log.seek(0)
+                self.committed = self.read_pos = 0
+            self._store_offset()
+
+    def close(self):
+        with self.lock:
+            self.log.close()
+
+
+class Forwarder:
+    """Deliver outbox events to api_url in batched POSTs of a JSON list."""
+
+    def __init__(self, api_url, outbox=None, batch_size=OUTBOX_BATCH_SIZE, concurrency=OUTBOX_CONCURRENCY,
+                 timeout=OUTBOX_TIMEOUT, max_backoff=OUTBOX_MAX_BACKOFF):
+        self.api_url = api_url
+        self.outbox = outbox or Outbox()
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.max_backoff = max_backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.slots = threading.Semaphore(concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="forward")
+        self.wake = threading.Event()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.delivered = 0
+        self.retries = 0
+
+    def submit(self, event):
+        """Persist an event for delivery; returns as soon as it is on disk."""
+        self.outbox.append(event)
+        self.wake.set()
+
+    def _post(self, events):
+        """True if the API accepted the batch, False to retry, None to drop it."""
+        try:
+            response = self.session.post(self.api_url, json=events, timeout=self.timeout)
+        except requests.RequestException as e:
+            logging.warning(f"API unreachable: {e}")
+            return False
+        if response.status_code < 300:
+            try:
+                rejected = response.json().get("rejected") or []
+            except (ValueError, AttributeError):
+                rejected = []
+            for item in rejected:
+                logging.error(f"API rejected event {item.get('index')} of {len(events)}: {item.get('error')}")
+            return True
+        if response.status_code == 429 or response.status_code >= 500:
+            logging.warning(f"API busy: {response.status_code}")
+            return False
+        logging.error(f"API rejected {len(events)} events: {response.status_code} - {response.text}")
+        return None
+
+    def _deliver(self, start, end, events):
+        backoff = 0.5
+        try:
+            while True:
+                result = self._post(events)
+                if result is not False:
+                    break
+                if self.stop_event.is_set():
+                    return  # not acknowledged; replayed on next start
+                self.retries += 1
+                self.stop_event.wait(backoff * random.uniform(0.5, 1.0))
+                backoff = min(backoff * 2, self.max_backoff)
+            self.outbox.ack(start, end)
+            if result:
+                self.delivered += len(events)
+                logging.info(f"Successfully sent {len(events)} events to API")
+        finally:
+            self.slots.release()
+
+    def _dispatch_loop(self):
+        while not self.stop_event.is_set():
+            self.slots.acquire()
+            batch = self.outbox.next_batch(self.batch_size)
+            if batch is None:
+                self.slots.release()
+                self.wake.wait(1.0)
+                self.wake.clear()
+                continue
+            self.executor.submit(self._deliver, *batch)
+
+    def start(self):
+        pending = self.outbox.pending()
+        if pending:
+            logging.info(f"Replaying {pending} bytes of undelivered events")
+        self.thread = threading.Thread(target=self._dispatch_loop, daemon=True, name="outbox")
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        self.wake.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.executor.shutdown(wait=True)
+        self.session.close()
+        self.outbox.close()
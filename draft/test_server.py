@@ -1,34 +1,57 @@
-from flask import Flask, request, jsonify
-import json
+from flask import Flask, request, jsonify, send_file, abort
 import os
+import re
+
+from event_store import EventStore, parse_time
 
 app = Flask(__name__)
 
 EVENTS_FILE = 'events.json'
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
 
-def load_events():
-    if os.path.exists(EVENTS_FILE):
-        with open(EVENTS_FILE, 'r') as f:
-            return json.load(f)
-    return []
-
-def save_events(events):
-    with open(EVENTS_FILE, 'w') as f:
-        json.dump(events, f, indent=2)
-
-events = load_events()
+store = EventStore()
+if os.path.exists(EVENTS_FILE):
+    store.import_json(EVENTS_FILE)
 
 @app.route('/api/data', methods=['GET', 'POST'])
 def receive_data():
-    global events
     if request.method == 'POST':
         data = request.get_json()
-        print(json.dumps(data))
-        events.append(data)
-        save_events(events)
-        return jsonify({"status": "success"}), 200
+        # The forwarder posts batches as a JSON list
+        events = data if isinstance(data, list) else [data]
+        # Malformed events are rejected one by one; the rest of the batch is
+        # stored and acknowledged, since the forwarder does not resend a 2xx
+        ids, rejected = store.append(events)
+        print(f"Stored {len(ids)} events (last id {ids[-1] if ids else None}), rejected {len(rejected)}")
+        status = "partial" if rejected else "success"
+        return jsonify({"status": status, "ids": ids, "rejected": rejected}), 200
     else:
-        return jsonify(events), 200
+        # ?since=&until= (epoch seconds or ISO 8601), ?node_id=, ?after_id= and ?limit= to page
+        try:
+            limit = max(1, min(int(request.args.get('limit', DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE))
+            since = parse_time(request.args.get('since'))
+            until = parse_time(request.args.get('until'))
+            after_id = int(request.args.get('after_id', 0))
+        except ValueError as e:
+            return jsonify({"status": "error", "error": f"Bad query parameter: {e}"}), 400
+        events, next_after_id = store.query(
+            since=since,
+            until=until,
+            after_id=after_id,
+            limit=limit,
+            node_id=request.args.get('node_id'),
+        )
+        return jsonify({"events": events, "next_after_id": next_after_id}), 200
+
+@app.route('/api/blobs/<digest>', methods=['GET'])
+def get_blob(digest):
+    if not re.fullmatch(r'[0-9a-f]{64}', digest):
+        abort(404)
+    path = store.blob_path(digest)
+    if not os.path.exists(path):
+        abort(404)
+    return send_file(os.path.abspath(path), mimetype='image/jpeg')
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=8000)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=8000, threaded=True)
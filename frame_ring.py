@@ -0,0 +1,184 @@
+"""
+Shared-memory frame handoff between nodes on the same host.
+
+The producer copies each raw frame into a slot of a multiprocessing
+shared_memory ring and publishes only a small "frame_ref" message (slot,
+sequence number, shape) over an ipc:// socket. Consumers map the slot as a
+NumPy array without copying and send a release back when done; a slot is
+reused once every registered consumer has released it or its lease expired.
+A consumer still holding a slot when its lease expires (crashed, moved to
+another producer, or no longer reading) is dropped from the registered set,
+so later frames do not wait for it; any message from it registers it again.
+"""
+import logging
+import os
+import socket
+import struct
+import sys
+import time
+import uuid
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+import zmq
+
+# Add parent directory to path to import config
+sys.path.append('.')
+
+from config import FRAME_IPC_DIR, FRAME_LEASE_SECONDS, FRAME_RING_SLOTS
+
+# Per-slot header: sequence number and payload size
+SLOT_HEADER = struct.Struct("!QQ")
+
+
+def ring_name(node_id):
+    return f"frames-{node_id}".replace("/", "_")
+
+
+def ipc_endpoint(name, suffix):
+    return f"ipc://{os.path.join(FRAME_IPC_DIR, name)}.{suffix}"
+
+
+class SharedFrameWriter:
+    """Producer side: owns the shared memory ring and the release channel."""
+
+    def __init__(self, context, name, slot_bytes, slots=FRAME_RING_SLOTS, lease=FRAME_LEASE_SECONDS):
+        self.name = name
+        self.slot_bytes = slot_bytes
+        self.slot_size = SLOT_HEADER.size + slot_bytes
+        self.slots = slots
+        self.lease = lease
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=self.slot_size * slots)
+        except FileExistsError:
+            # Left behind by a producer that crashed; nobody else owns the name
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=self.slot_size * slots)
+        # Changes whenever the ring is recreated, e.g. by a restarted producer
+        self.ring_id = uuid.uuid4().hex
+        # Consumers that have not released each slot yet
+        self.holders = [set() for _ in range(slots)]
+        self.deadlines = [0.0] * slots
+        self.consumers = set()
+        self.seq = 0
+        self.next_slot = 0
+        self.release_endpoint = ipc_endpoint(name, "release")
+        self.release_sock = context.socket(zmq.PULL)
+        self.release_sock.bind(self.release_endpoint)
+
+    def _drain_releases(self):
+        while True:
+            try:
+                msg = self.release_sock.recv_json(flags=zmq.NOBLOCK)
+            except zmq.Again:
+                return
+            op = msg.get("op")
+            consumer = msg.get("consumer")
+            if op == "bye":
+                self._drop_consumer(consumer)
+            elif op in ("hello", "release"):
+                self.consumers.add(consumer)
+            if op == "release":
+                slot = msg["slot"]
+                seq = msg.get("seq")
+                if seq is not None and seq != SLOT_HEADER.unpack_from(self.shm.buf, slot * self.slot_size)[0]:
+                    continue  # late release of an expired lease; the slot holds a newer frame now
+                self.holders[slot].discard(consumer)
+
+    def _drop_consumer(self, consumer):
+        self.consumers.discard(consumer)
+        for holders in self.holders:
+            holders.discard(consumer)
+
+    def _acquire_slot(self):
+        now = time.monotonic()
+        for offset in range(self.slots):
+            slot = (self.next_slot + offset) % self.slots
+            if self.holders[slot] and now > self.deadlines[slot]:
+                # Lease expired: whoever still holds the slot has stopped releasing
+                for consumer in list(self.holders[slot]):
+                    logging.warning(f"[FRAME_RING:{self.name}] Consumer {consumer} stopped releasing; dropped")
+                    self._drop_consumer(consumer)
+            if not self.holders[slot]:
+                self.next_slot = (slot + 1) % self.slots
+                return slot
+        return None
+
+    def write(self, frame, node_id, timestamp):
+        """Copy frame into a free slot and return the frame_ref message, or None if all slots are busy."""
+        self._drain_releases()
+        if frame.nbytes > self.slot_bytes:
+            raise ValueError(f"Frame of {frame.nbytes} bytes does not fit {self.slot_bytes}-byte slots")
+        slot = self._acquire_slot()
+        if slot is None:
+            return None
+
+        self.seq += 1
+        offset = slot * self.slot_size
+        data = np.ndarray(frame.shape, dtype=frame.dtype, buffer=self.shm.buf, offset=offset + SLOT_HEADER.size)
+        data[...] = frame
+        SLOT_HEADER.pack_into(self.shm.buf, offset, self.seq, frame.nbytes)
+        self.holders[slot] = set(self.consumers)
+        self.deadlines[slot] = time.monotonic() + self.lease
+        return {
+            "type": "frame_ref",
+            "node_id": node_id,
+            "shm": self.name,
+            "ring": self.ring_id,
+            "release": self.release_endpoint,
+            "slot": slot,
+            "offset": offset,
+            "seq": self.seq,
+            "shape": list(frame.shape),
+            "dtype": str(frame.dtype),
+            "ts": timestamp,
+        }
+
+    def close(self):
+        self.release_sock.close()
+        self.shm.close()
+        self.shm.unlink()
+
+
+class SharedFrameReader:
+    """Consumer side: maps slots of one producer's ring and releases them."""
+
+    def __init__(self, context, name, release_endpoint, ring_id=None):
+        self.shm = shared_memory.SharedMemory(name=name)
+        self.ring_id = ring_id
+        # Only the producer may unlink the segment; keep the resource tracker
+        # from removing it when this process exits
+        resource_tracker.unregister(self.shm._name, "shared_memory")
+        self.consumer_id = f"{socket.gethostname()}-{os.getpid()}-{id(self)}"
+        self.release_sock = context.socket(zmq.PUSH)
+        self.release_sock.setsockopt(zmq.LINGER, 0)
+        self.release_sock.connect(release_endpoint)
+        self.release_sock.send_json({"op": "hello", "consumer": self.consumer_id})
+
+    def view(self, ref):
+        """Return a zero-copy array for the slot named in a frame_ref message."""
+        return np.ndarray(tuple(ref["shape"]), dtype=ref["dtype"], buffer=self.shm.buf,
+                          offset=ref["offset"] + SLOT_HEADER.size)
+
+    def same_ring(self, ref):
+        """False if the producer recreated the ring since this reader attached."""
+        return ref.get("ring") == self.ring_id
+
+    def is_current(self, ref):
+        """False if the producer reused the slot (lease expired) since ref was sent."""
+        seq, _ = SLOT_HEADER.unpack_from(self.shm.buf, ref["offset"])
+        return seq == ref["seq"]
+
+    def release(self, ref):
+        self.release_sock.send_json({"op": "release", "consumer": self.consumer_id,
+                                     "slot": ref["slot"], "seq": ref["seq"]})
+
+    def close(self):
+        try:
+            self.release_sock.send_json({"op": "bye", "consumer": self.consumer_id})
+        except zmq.ZMQError:
+            pass
+        self.release_sock.close()
+        self.shm.close()
@@ -0,0 +1,173 @@
+import threading
+from collections import deque
+
+# Numeric fields of a system_status message that are kept in the history
+METRIC_FIELDS = (
+    'cpu',
+    'memory_used_gb',
+    'memory_total_gb',
+    'memory_percent',
+    'disk_read_kbs',
+    'disk_write_kbs',
+    'network_send_kbs',
+    'network_recv_kbs',
+    'disk_free_gb',
+    'storage_used_gb',
+    'storage_added_kbs',
+    'storage_deleted_kbs',
+    'numeric_gpu',
+    'numeric_temp',
+)
+
+# (bucket width in seconds, number of buckets kept)
+# 1s for 1 hour, 10s for 6 hours, 1min for 24 hours
+HISTORY_TIERS = (
+    (1, 3600),
+    (10, 2160),
+    (60, 1440),
+)
+
+
+def parse_percent(value):
+    """Parse a '12.5%' string into a float, NaN if not available."""
+    if isinstance(value, str) and value.endswith('%'):
+        try:
+            return float(value.rstrip('%'))
+        except ValueError:
+            pass
+    return float('nan')
+
+
+def parse_temperature(value):
+    """Parse a '55.0°C' string into a float, NaN if not available."""
+    if isinstance(value, str) and value.endswith('°C'):
+        try:
+            return float(value.rstrip('°C'))
+        except ValueError:
+            pass
+    return float('nan')
+
+
+def status_to_sample(msg, recv_time):
+    """Flatten a system_status message into a numeric sample row."""
+    sample = {'time': recv_time}
+    for field in METRIC_FIELDS:
+        value = msg.get(field)
+        sample[field] = float(value) if isinstance(value, (int, float)) else float('nan')
+    sample['numeric_gpu'] = parse_percent(msg.get('gpu'))
+    sample['numeric_temp'] = parse_temperature(msg.get('temperature'))
+    return sample
+
+
+class _Tier:
+    """Fixed-width time buckets averaged into a bounded ring buffer."""
+
+    def __init__(self, width, maxlen):
+        self.width = width
+        self.samples = deque(maxlen=maxlen)
+        self._bucket = None
+        self._sums = {}
+        self._counts = {}
+
+    @property
+    def span(self):
+        return self.width * self.samples.maxlen
+
+    def add(self, sample):
+        bucket = int(sample['time'] // self.width)
+        if self._bucket is not None and bucket != self._bucket:
+            self._flush()
+        self._bucket = bucket
+        for field in METRIC_FIELDS:
+            value = sample[field]
+            if value == value:  # skip NaN
+                self._sums[field] = self._sums.get(field, 0.0) + value
+                self._counts[field] = self._counts.get(field, 0) + 1
+
+    def _flush(self):
+        row = {'time': float(self._bucket * self.width)}
+        for field in METRIC_FIELDS:
+            count = self._counts.get(field, 0)
+            row[field] = self._sums[field] / count if count else float('nan')
+        self.samples.append(row)
+        self._sums = {}
+        self._counts = {}
+
+    def since(self, start):
+        """Return samples newer than start, walking back from the newest."""
+        rows = []
+        for row in reversed(self.samples):
+            if row['time'] < start:
+                break
+            rows.append(row)
+        rows.reverse()
+        return rows
+
+
+class NodeHistory:
+    """Multi-resolution metric history for a single node."""
+
+    def __init__(self, tiers=HISTORY_TIERS):
+        # The finest tier stores raw samples as they arrive
+        self.tiers = [_Tier(width, maxlen) for width, maxlen in tiers]
+        self.latest = None
+        self.version = 0
+
+    def add(self, msg, recv_time):
+        sample = status_to_sample(msg, recv_time)
+        self.latest = msg
+        self.version += 1
+        self.tiers[0].samples.append(sample)
+        for tier in self.tiers[1:]:
+            tier.add(sample)
+        return sample
+
+    def select(self, seconds, now):
+        """Return samples for the last `seconds` from the finest tier that covers them."""
+        tier = next((t for t in self.tiers if t.span >= seconds), self.tiers[-1])
+        return tier.since(now - seconds)
+
+
+class MetricHistory:
+    """Thread-safe per-node metric histories keyed by node_id."""
+
+    def __init__(self, tiers=HISTORY_TIERS):
+        self.tiers = tiers
+        self.nodes = {}
+        self.listeners = []
+        self.lock = threading.Lock()
+
+    def subscribe(self, callback):
+        """Register callback(node_id, sample) called for every new raw sample."""
+        self.listeners.append(callback)
+
+    def add(self, msg, recv_time):
+        node_id = msg.get('node_id', 'unknown')
+        with self.lock:
+            history = self.nodes.get(node_id)
+            if history is None:
+                history = self.nodes[node_id] = NodeHistory(self.tiers)
+            sample = history.add(msg, recv_time)
+        for callback in self.listeners:
+            callback(node_id, sample)
+        return sample
+
+    def version(self, node_id):
+        """Number of samples received for node_id, used to detect changes."""
+        with self.lock:
+            history = self.nodes.get(node_id)
+            return history.version if history else 0
+
+    def node_ids(self):
+        with self.lock:
+            return sorted(self.nodes)
+
+    def latest(self, node_id):
+        with self.lock:
+            history = self.nodes.get(node_id)
+            return history.latest if history else None
+
+    def select(self, node_id, seconds, now):
+        with self.lock:
+            history = self.nodes.get(node_id)
+            return history.select(seconds, now) if history else []
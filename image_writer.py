@@ -0,0 +1,174 @@
+"""
+Background image writer with date/hour sharding and grouped commits.
+
+Producers call ImageWriter.submit() with the already-encoded JPEG bytes, or
+with a render callable that produces them (e.g. drawing detections), so
+plotting and encoding run on a writer thread rather than on the caller's.
+submit() never blocks: when the bounded queue is full the image is dropped
+and counted.
+
+Files go to <root>/YYYY-MM-DD/HH/<name>, so no directory grows without
+bound. Each worker writes a batch of files to temporary names, then fsyncs
+each file, renames it into place and fsyncs each touched directory once per
+batch. A crash therefore never leaves a truncated JPEG under its final name.
+Every file still gets its own fsync; batching saves the directory fsyncs
+(one per directory per batch instead of one per image) and lets the worker
+write a burst of images before waiting on the card.
+"""
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from datetime import datetime
+
+# Add parent directory to path to import config
+sys.path.append('.')
+
+from config import (
+    IMAGE_WRITER_FSYNC_BATCH,
+    IMAGE_WRITER_FSYNC_INTERVAL,
+    IMAGE_WRITER_QUEUE,
+    IMAGE_WRITER_WORKERS,
+)
+
+TMP_SUFFIX = ".tmp"
+
+
+class ImageWriter:
+    """Write images from a bounded queue with a pool of worker threads."""
+
+    def __init__(self, root, workers=IMAGE_WRITER_WORKERS, queue_size=IMAGE_WRITER_QUEUE,
+                 fsync_batch=IMAGE_WRITER_FSYNC_BATCH, fsync_interval=IMAGE_WRITER_FSYNC_INTERVAL):
+        self.root = root
+        self.fsync_batch = fsync_batch
+        self.fsync_interval = fsync_interval
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.workers = [
+            threading.Thread(target=self._work, name=f"image-writer-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        self.lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.bytes = 0
+        self.batches = 0
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+        return self
+
+    def stop(self):
+        """Write everything still queued, then stop the workers."""
+        for _ in self.workers:
+            self.queue.put(None)
+        for worker in self.workers:
+            worker.join()
+
+    def path_for(self, name, when=None):
+        when = when or datetime.now()
+        return os.path.join(self.root, when.strftime("%Y-%m-%d"), when.strftime("%H"), name)
+
+    def submit(self, name, jpeg_bytes=None, render=None, when=None):
+        """Queue an image; returns the path it will be written to, or None if dropped.
+
+        Pass the encoded bytes, or a render() callable that returns them and
+        runs on a writer thread.
+        """
+        path = self.path_for(name, when)
+        try:
+            self.queue.put_nowait((path, jpeg_bytes, render))
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+            return None
+        return path
+
+    def _work(self):
+        pending = []  # (open file, temporary path, final path)
+        deadline = None
+        stopping = False
+        while not stopping:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = False  # flush interval elapsed
+            if item is None:
+                stopping = True
+            elif item is not False:
+                written = self._write(*item)
+                if written is not None:
+                    pending.append(written)
+                    if deadline is None:
+                        deadline = time.monotonic() + self.fsync_interval
+            if pending and (stopping or item is False or len(pending) >= self.fsync_batch):
+                self._commit(pending)
+                pending = []
+                deadline = None
+
+    def _write(self, path, jpeg_bytes, render):
+        try:
+            if render is not None:
+                jpeg_bytes = render()
+            if not jpeg_bytes:
+                return None
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = path + TMP_SUFFIX
+            f = open(tmp_path, "wb")
+            f.write(jpeg_bytes)
+            f.flush()
+        except Exception as e:
+            logging.error(f"[IMAGE_WRITER] Failed to write {path}: {e}")
+            with self.lock:
+                self.failed += 1
+            return None
+        with self.lock:
+            self.bytes += len(jpeg_bytes)
+        return f, tmp_path, path
+
+    def _commit(self, pending):
+        """fsync each file of a batch, move it into place, then fsync each directory once."""
+        directories = set()
+        committed = 0
+        for f, tmp_path, path in pending:
+            try:
+                os.fsync(f.fileno())
+                f.close()
+                os.replace(tmp_path, path)
+                directories.add(os.path.dirname(path))
+                committed += 1
+            except OSError as e:
+                logging.error(f"[IMAGE_WRITER] Failed to commit {path}: {e}")
+                f.close()
+                with self.lock:
+                    self.failed += 1
+        for directory in directories:
+            try:
+                fd = os.open(directory, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            except OSError:
+                pass
+        with self.lock:
+            self.written += committed
+            self.batches += 1
+
+    def take_stats(self):
+        """Return and reset the counters."""
+        with self.lock:
+            stats = {
+                "written": self.written,
+                "dropped": self.dropped,
+                "failed": self.failed,
+                "written_kb": self.bytes / 1024,
+                "fsync_batches": self.batches,
+                "queued": self.queue.qsize(),
+            }
+            self.written = self.dropped = self.failed = self.bytes = self.batches = 0
+        return stats
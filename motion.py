@@ -2,50 +2,65 @@ import ffmpeg
 import base64
 import json
 import os
+import queue
 import sys
 import socket
 import threading
 import uuid
 import numpy as np
 import cv2
+import psutil
 import time
 import zmq
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 # Add parent directory to path to import config
 sys.path.append('.')
 
 from config import (
+    CAMERA_STATS_INTERVAL,
+    MOTION_CAMERAS,
     MOTION_FLAG_PORT,
+    MOTION_IDLE_AFTER,
+    MOTION_IDLE_FPS,
     MOTION_IMAGE_PORT,
-    MOTION_URL,
+    MOTION_REPLAY_PORT,
     MOTION_THRESHOLD,
     MOTION_FPS,
+    MOTION_WAKE_RATIO,
+    MOTION_WORKERS,
     PIXEL_DIFF_THRESHOLD,
     BLUR_SIGMA,
     KERNEL_SIZE,
+    TRACK_FPS,
+)
+from frame_ring import SharedFrameWriter, ipc_endpoint, ring_name
+from replay import SequencedPublisher
+from tsdb import TimeSeriesStore
+from utils import (
+    TOPIC_IMAGE,
+    TOPIC_MOTION_FLAG,
+    TOPIC_TRACK_FRAME,
+    ZMQNode,
+    make_topic,
+    send_message,
 )
-from utils import ZMQNode
 
 def get_video_dimensions(url):
     """Probe the video stream and return width and height."""
-    probe = ffmpeg.probe(MOTION_URL)
+    probe = ffmpeg.probe(url)
     video_info = next(s for s in probe['streams'] if s['codec_type'] == 'video')
     width = int(video_info['width'])
     height = int(video_info['height'])
     return width, height
 
-class MotionDetector(ZMQNode):
+class MotionAnalyzer:
+    """Frame-differencing motion detection for one video source."""
+
     def __init__(self):
-        super().__init__('motion')
-        self.pub_port = MOTION_IMAGE_PORT  # For discovery
-        self.flag_pub = self.context.socket(zmq.PUB)
-        self.flag_pub.bind(f"tcp://*:{MOTION_FLAG_PORT}")
-        self.image_pub = self.context.socket(zmq.PUB)
-        self.image_pub.bind(f"tcp://*:{MOTION_IMAGE_PORT}")
         self.prev_blurred_frame = None
-        self.last_motion_state = 0
 
     def gaussian_blur(self, image, kernel_size, sigma):
         return cv2.GaussianBlur(image, (kernel_size, kernel_size), sigma)
@@ -53,99 +68,414 @@ class MotionDetector(ZMQNode):
     def detect_motion(self, prev_frame, current_frame, pixel_diff_threshold):
         if prev_frame is None:
             return None
-        
+
         diff = np.abs(current_frame - prev_frame)
         changed_pixels = (diff > pixel_diff_threshold).astype(np.float32)
         change_ratio = np.mean(changed_pixels)
-        
+
         return change_ratio
 
-    def publish_motion_flag(self, flag, timestamp):
-        self.flag_pub.send_json({
+    def process(self, frame):
+        """Return (change_ratio, motion_detected) for the next BGR frame."""
+        frame_gray = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
+
+        blurred_frame = self.gaussian_blur(frame_gray, KERNEL_SIZE, BLUR_SIGMA)
+
+        change_ratio = self.detect_motion(self.prev_blurred_frame, blurred_frame, PIXEL_DIFF_THRESHOLD)
+
+        motion_detected = change_ratio is not None and change_ratio > MOTION_THRESHOLD
+
+        self.prev_blurred_frame = blurred_frame
+        return change_ratio, motion_detected
+
+
+class AnalysisSchedule:
+    """Which decoded frames to analyse: all while active, idle_fps while the scene is quiet.
+
+    Any change ratio of at least wake_ratio (or motion) switches to full rate
+    at once; idle_after quiet seconds switch back. Times are time.monotonic().
+    """
+
+    def __init__(self, idle_fps=MOTION_IDLE_FPS, wake_ratio=MOTION_WAKE_RATIO, idle_after=MOTION_IDLE_AFTER):
+        self.period = 1.0 / idle_fps if idle_fps else 0.0
+        self.wake_ratio = wake_ratio
+        self.idle_after = idle_after
+        now = time.monotonic()
+        self.active_until = now + idle_after  # start at full rate
+        self.next_idle_frame = 0.0
+        self.idle = False
+        self.mode_since = now
+        self.idle_seconds = 0.0
+
+    def _set_idle(self, idle, now):
+        if idle == self.idle:
+            return
+        if self.idle:
+            self.idle_seconds += now - self.mode_since
+        self.idle = idle
+        self.mode_since = now
+
+    def due(self, now):
+        """True if the frame decoded at now should be analysed."""
+        if not self.period or now < self.active_until:
+            return True
+        self._set_idle(True, now)
+        if now < self.next_idle_frame:
+            return False
+        # Keep to the idle grid despite frame jitter; restart it after a pause
+        if now - self.next_idle_frame < self.period:
+            self.next_idle_frame += self.period
+        else:
+            self.next_idle_frame = now + self.period
+        return True
+
+    def observe(self, change_ratio, motion_detected, now):
+        """Feed an analysis result; returns True if it woke the camera up."""
+        if not motion_detected and (change_ratio is None or change_ratio < self.wake_ratio):
+            return False
+        woke = self.idle
+        self.active_until = now + self.idle_after
+        self._set_idle(False, now)
+        return woke
+
+    def take_idle_seconds(self, now):
+        """Return and reset the time spent idle."""
+        if self.idle:
+            self.idle_seconds += now - self.mode_since
+            self.mode_since = now
+        idle_seconds, self.idle_seconds = self.idle_seconds, 0.0
+        return idle_seconds
+
+
+def encode_jpeg_b64(frame):
+    """JPEG-encode a frame for the image message; returns (base64 str, size in bytes) or None."""
+    success, encoded_img = cv2.imencode('.jpg', frame)
+    if not success:
+        return None
+    image_bytes = encoded_img.tobytes()
+    return base64.b64encode(image_bytes).decode("ascii"), len(image_bytes)
+
+class SubscriberCount:
+    """Subscriptions per topic kind on an XPUB socket, from its (un)subscribe notifications."""
+
+    def __init__(self, sock, kinds):
+        self.sock = sock
+        self.prefixes = {kind: f"{kind}.".encode("utf-8") for kind in kinds}
+        self.counts = dict.fromkeys(kinds, 0)
+
+    def update(self):
+        while True:
+            try:
+                event = self.sock.recv(zmq.NOBLOCK)
+            except zmq.Again:
+                return
+            change = {b"\x01": 1, b"\x00": -1}.get(event[:1])
+            if change is None:
+                continue
+            prefix = event[1:]
+            for kind, kind_prefix in self.prefixes.items():
+                # "image." or "image.<node>/<camera>\0" for one kind, "" for everything
+                if prefix.startswith(kind_prefix) or kind_prefix.startswith(prefix):
+                    self.counts[kind] = max(0, self.counts[kind] + change)
+
+    def __getitem__(self, kind):
+        return self.counts[kind]
+
+class Camera:
+    """One video source: its ffmpeg reader, motion state and load counters."""
+
+    def __init__(self, camera_id, url):
+        self.camera_id = camera_id
+        self.url = url
+        self.width, self.height = get_video_dimensions(url)
+        self.bytes_per_frame = self.width * self.height * 3
+        self.process = None
+        self.ffmpeg_proc = None
+        self.frame_ring = None
+        self.analyzer = MotionAnalyzer()
+        self.schedule = AnalysisSchedule()
+        # Set while a frame of this camera is being analysed; newer frames are dropped
+        self.busy = threading.Event()
+        self.lock = threading.Lock()
+        self.frames = 0
+        self.dropped = 0
+        self.skipped = 0  # not analysed while idle
+        self.cpu_seconds = 0.0
+        self.idle_cpu_seconds = 0.0
+        self.next_track = 0.0  # monotonic time the next tracking frame is due
+
+    def open(self):
+        self.process = (ffmpeg
+            .input(self.url, rtsp_transport='udp')
+            .filter('fps', fps=MOTION_FPS)  # Limit to MOTION_FPS FPS for processing
+            .output('pipe:', format='rawvideo', pix_fmt='bgr24')
+            .global_args('-loglevel', 'quiet')
+            .run_async(pipe_stdout=True))
+        self.ffmpeg_proc = psutil.Process(self.process.pid)
+        self.ffmpeg_proc.cpu_percent(None)
+
+    def read(self):
+        """Block for the next raw frame; None when the stream ends."""
+        in_bytes = self.process.stdout.read(self.bytes_per_frame)
+        if len(in_bytes) != self.bytes_per_frame:
+            return None
+        return np.frombuffer(in_bytes, np.uint8).reshape((self.height, self.width, 3))
+
+    def take_stats(self, elapsed):
+        """Return fps, CPU, drop and idle counts since the previous call."""
+        with self.lock:
+            frames, dropped, skipped = self.frames, self.dropped, self.skipped
+            cpu_seconds, idle_cpu_seconds = self.cpu_seconds, self.idle_cpu_seconds
+            idle_seconds = self.schedule.take_idle_seconds(time.monotonic())
+            self.frames = self.dropped = self.skipped = 0
+            self.cpu_seconds = self.idle_cpu_seconds = 0.0
+        try:
+            ffmpeg_cpu = self.ffmpeg_proc.cpu_percent(None)
+        except psutil.Error:
+            ffmpeg_cpu = 0.0
+        active_seconds = max(0.0, elapsed - idle_seconds)
+        return {
+            "fps": frames / elapsed,
+            "dropped": dropped,
+            "skipped": skipped,
+            "analysis_cpu": cpu_seconds / elapsed * 100,
+            "ffmpeg_cpu": ffmpeg_cpu,
+            # Analysis CPU per mode: the idle figure against the active one shows the saving
+            "idle_fraction": min(1.0, idle_seconds / elapsed),
+            "idle_analysis_cpu": idle_cpu_seconds / idle_seconds * 100 if idle_seconds else None,
+            "active_analysis_cpu": (cpu_seconds - idle_cpu_seconds) / active_seconds * 100
+                                   if active_seconds else None,
+        }
+
+    def close(self):
+        if self.process is not None:
+            self.process.terminate()
+        if self.frame_ring is not None:
+            self.frame_ring.close()
+
+class MotionDetector(ZMQNode):
+    def __init__(self, cameras=MOTION_CAMERAS):
+        super().__init__('motion')
+        self.pub_port = MOTION_IMAGE_PORT  # For discovery
+        self.cameras = {camera_id: Camera(camera_id, url) for camera_id, url in cameras.items()}
+        # streams: recorders record the flagged camera from this node's own URL
+        self.advertise("motion.flag", MOTION_FLAG_PORT, cameras=list(self.cameras), replay_port=MOTION_REPLAY_PORT,
+                       streams={camera_id: camera.url for camera_id, camera in self.cameras.items()})
+        self.flag_pub = self.socket(zmq.PUB, "reliable")
+        self.flag_pub.bind(f"tcp://*:{MOTION_FLAG_PORT}")
+        # Flags are numbered; subscribers fetch missed ones from this buffer
+        self.flag_replay = self.socket(zmq.ROUTER, "reliable")
+        self.flag_replay.bind(f"tcp://*:{MOTION_REPLAY_PORT}")
+        self.flag_events = SequencedPublisher(self.flag_pub, self.flag_replay, self.stop_event)
+        # XPUB so the node knows whether anyone still needs JPEGs over TCP
+        self.image_pub = self.socket(zmq.XPUB, "bulk")
+        self.image_pub.setsockopt(zmq.XPUB_VERBOSER, 1)
+        self.image_pub.bind(f"tcp://*:{MOTION_IMAGE_PORT}")
+        self.tcp_subscribers = SubscriberCount(self.image_pub, (TOPIC_IMAGE, TOPIC_TRACK_FRAME))
+        # Co-located consumers get raw frames through shared memory instead;
+        # XPUB too, so tracking frames only take ring slots when someone reads them
+        self.ring_endpoint = ipc_endpoint(ring_name(self.node_id), "frames")
+        self.ring_pub = self.socket(zmq.XPUB, "bulk")
+        self.ring_pub.setsockopt(zmq.XPUB_VERBOSER, 1)
+        self.ring_pub.bind(self.ring_endpoint)
+        self.ipc_subscribers = SubscriberCount(self.ring_pub, (TOPIC_IMAGE, TOPIC_TRACK_FRAME))
+        # Camera readers hand frames to the pool; results come back to the
+        # main thread, which owns the sockets
+        self.executor = ThreadPoolExecutor(max_workers=MOTION_WORKERS, thread_name_prefix='motion')
+        self.results = queue.Queue()
+        self.store = TimeSeriesStore().start()
+
+    def analyze(self, camera, frame):
+        """Update one camera's motion state with a frame. Runs in the worker pool."""
+        cpu_start = time.thread_time()
+        idle = camera.schedule.idle
+        try:
+            change_ratio, motion_detected = camera.analyzer.process(frame)
+            with camera.lock:
+                woke = camera.schedule.observe(change_ratio, motion_detected, time.monotonic())
+            if woke:
+                logging.info(f"[{camera.camera_id}] Change ratio {change_ratio:.4f}: analysing at full rate")
+            self.results.put((camera, frame, change_ratio, motion_detected))
+        finally:
+            cpu_seconds = time.thread_time() - cpu_start
+            with camera.lock:
+                camera.frames += 1
+                camera.cpu_seconds += cpu_seconds
+                if idle:
+                    camera.idle_cpu_seconds += cpu_seconds
+            camera.busy.clear()
+
+    def read_camera(self, camera):
+        """Reader thread: pull frames from one camera's ffmpeg pipe."""
+        while not self.stop_event.is_set():
+            frame = camera.read()
+            if frame is None:
+                logging.warning(f"[{camera.camera_id}] Incomplete frame received. Try again...")
+                self.results.put((camera, None, None, False))
+                return
+            with camera.lock:
+                due = camera.schedule.due(time.monotonic())
+                if not due:
+                    camera.skipped += 1
+            if not due:
+                # Quiet scene: the frame was read off the pipe but is not analysed
+                continue
+            if camera.busy.is_set():
+                # Analysis is behind; keep latency flat by skipping this frame
+                with camera.lock:
+                    camera.dropped += 1
+                continue
+            camera.busy.set()
+            self.executor.submit(self.analyze, camera, frame)
+
+    def publish_motion_flag(self, camera, flag, timestamp):
+        self.flag_events.publish(make_topic(TOPIC_MOTION_FLAG, self.node_id, camera.camera_id), {
             "type": "motion_flag",
             "node_id": self.node_id,
+            "camera_id": camera.camera_id,
             "flag": flag,
             "ts": timestamp,
         })
 
-    def publish_motion_image(self, frame, timestamp):
-        success, encoded_img = cv2.imencode('.jpg', frame)
-        if success:
-            image_bytes = encoded_img.tobytes()
-            image_b64 = base64.b64encode(image_bytes).decode("ascii")
-            image_size_kb = len(image_bytes) / 1024
-            message = {
-                "type": "image",
-                "node_id": self.node_id,
-                "size": f"{image_size_kb:.2f} KB",
-                "image_data": image_b64,
-                "ts": timestamp,
-            }
-            self.image_pub.send_json(message)
-            logging.info(f"{self.node_id} triggered motion event at {timestamp} and published image ({image_size_kb:.2f} KB)")
-        else:
+    def publish_frame_ref(self, camera, frame, timestamp, kind=TOPIC_IMAGE):
+        ref = camera.frame_ring.write(frame, self.node_id, timestamp)
+        if ref is None:
+            logging.warning(f"[{camera.camera_id}] All shared frame slots are in use; frame not shared")
+            return
+        ref["camera_id"] = camera.camera_id
+        send_message(self.ring_pub, make_topic(kind, self.node_id, camera.camera_id), ref)
+
+    def publish_jpeg(self, camera, frame, timestamp, kind=TOPIC_IMAGE):
+        """JPEG-encode a frame and publish it to TCP subscribers; returns its size in KB, None on failure."""
+        encoded = encode_jpeg_b64(frame)
+        if encoded is None:
             logging.error("Failed to encode image")
+            return None
+        image_b64, image_size = encoded
+        image_size_kb = image_size / 1024
+        message = {
+            "type": "image",
+            "node_id": self.node_id,
+            "camera_id": camera.camera_id,
+            "size": f"{image_size_kb:.2f} KB",
+            "image_data": image_b64,
+            "ts": timestamp,
+        }
+        send_message(self.image_pub, make_topic(kind, self.node_id, camera.camera_id), message)
+        return image_size_kb
+
+    def publish_motion_image(self, camera, frame, timestamp):
+        self.publish_frame_ref(camera, frame, timestamp)
+        self.tcp_subscribers.update()
+        if self.tcp_subscribers[TOPIC_IMAGE] == 0:
+            # Only local consumers: skip the JPEG encode entirely
+            return
+        image_size_kb = self.publish_jpeg(camera, frame, timestamp)
+        if image_size_kb is not None:
+            logging.info(f"{self.node_id}/{camera.camera_id} triggered motion event at {timestamp} and published image ({image_size_kb:.2f} KB)")
+
+    def publish_track_frame(self, camera, frame):
+        """While motion lasts, share frames at TRACK_FPS with nodes tracking objects."""
+        now = time.monotonic()
+        if not TRACK_FPS or now < camera.next_track:
+            return
+        period = 1.0 / TRACK_FPS
+        # Keep to the TRACK_FPS grid despite frame jitter; restart it after a pause
+        camera.next_track = camera.next_track + period if now - camera.next_track < period else now + period
+        self.ipc_subscribers.update()
+        self.tcp_subscribers.update()
+        timestamp = datetime.now().time().isoformat()
+        if self.ipc_subscribers[TOPIC_TRACK_FRAME]:
+            self.publish_frame_ref(camera, frame, timestamp, TOPIC_TRACK_FRAME)
+        if self.tcp_subscribers[TOPIC_TRACK_FRAME]:
+            self.publish_jpeg(camera, frame, timestamp, TOPIC_TRACK_FRAME)
+
+    def handle_result(self, camera, frame, change_ratio, motion_detected, was_moving):
+        if motion_detected and not was_moving:
+            event_ts = datetime.now().time().isoformat()
+            self.publish_motion_flag(camera, 1, event_ts)
+            self.publish_motion_image(camera, frame, event_ts)
+        elif motion_detected:
+            self.publish_track_frame(camera, frame)
+        elif not motion_detected and was_moving:
+            event_ts = datetime.now().time().isoformat()
+            self.publish_motion_flag(camera, 0, event_ts)
+            print(f"[{camera.camera_id}] Motion ended: sent flag 0")
+
+        if change_ratio is not None:
+            print(f"[{camera.camera_id}] Motion ratio: {change_ratio:.4f} - {'MOTION DETECTED' if motion_detected else 'No motion'}")
+
+    def report_camera_stats(self, elapsed):
+        """Log and store per-camera load so capacity per Pi can be sized."""
+        for camera in self.cameras.values():
+            stats = camera.take_stats(elapsed)
+            self.store.write_points(stats, f"{self.node_id}/{camera.camera_id}")
+            logging.info(
+                f"[{camera.camera_id}] {stats['fps']:.1f} fps, analysis CPU {stats['analysis_cpu']:.1f}%, "
+                f"ffmpeg CPU {stats['ffmpeg_cpu']:.1f}%, dropped {stats['dropped']}, "
+                f"idle {stats['idle_fraction'] * 100:.0f}% of the time"
+            )
 
     def run(self):
-        # Start discovery thread
+        for camera in self.cameras.values():
+            camera.frame_ring = SharedFrameWriter(
+                self.context, ring_name(f"{self.node_id}-{camera.camera_id}"), camera.bytes_per_frame)
+        self.advertise("motion.image", MOTION_IMAGE_PORT, cameras=list(self.cameras),
+                       ipc=self.ring_endpoint, host=socket.gethostname())
+
+        # Start discovery and replay threads
         self.start_discovery()
+        self.flag_events.start()
 
         logging.info(f"[FLAG_PUB:{self.node_id}] Listening on tcp://*:{MOTION_FLAG_PORT}")
+        logging.info(f"[FLAG_REPLAY:{self.node_id}] Listening on tcp://*:{MOTION_REPLAY_PORT}")
         logging.info(f"[IMAGE_PUB:{self.node_id}] Listening on tcp://*:{MOTION_IMAGE_PORT}")
+        logging.info(f"[RING_PUB:{self.node_id}] Sharing frames on {self.ring_endpoint}")
         logging.info(f"[PUB:{self.node_id}] Local IP: {self.get_local_ip()}")
 
-        width, height = get_video_dimensions(MOTION_URL)
-
-        process = (ffmpeg
-            .input(MOTION_URL, rtsp_transport='udp')
-            .filter('fps', fps=MOTION_FPS)  # Limit to MOTION_FPS FPS for processing
-            .output('pipe:', format='rawvideo', pix_fmt='bgr24')
-            .global_args('-loglevel', 'quiet')
-            .run_async(pipe_stdout=True))
-
-        bytes_per_frame = width * height * 3
+        for camera in self.cameras.values():
+            camera.open()
+            threading.Thread(target=self.read_camera, args=(camera,), daemon=True,
+                             name=f"camera-{camera.camera_id}").start()
 
-        logging.info("Starting motion detection... Press Ctrl+C to stop.")
+        logging.info(f"Starting motion detection on {len(self.cameras)} camera(s)... Press Ctrl+C to stop.")
 
+        # Motion state as last published, per camera
+        moving = {camera_id: False for camera_id in self.cameras}
+        active = len(self.cameras)
+        last_report = time.monotonic()
         try:
-            while True:
-                in_bytes = process.stdout.read(bytes_per_frame)
-                
-                if len(in_bytes) != bytes_per_frame:
-                    logging.warning("Incomplete frame received. Try again...")
-                    break
-                
-                frame = np.frombuffer(in_bytes, np.uint8).reshape((height, width, 3))
-
-                frame_gray = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
-                
-                blurred_frame = self.gaussian_blur(frame_gray, KERNEL_SIZE, BLUR_SIGMA)
-                
-                change_ratio = self.detect_motion(self.prev_blurred_frame, blurred_frame, PIXEL_DIFF_THRESHOLD)
-                
-                motion_detected = change_ratio is not None and change_ratio > MOTION_THRESHOLD
-
-                if motion_detected and self.last_motion_state == 0:
-                    event_ts = datetime.now().time().isoformat()
-                    self.publish_motion_flag(1, event_ts)
-                    self.publish_motion_image(frame, event_ts)
-                elif not motion_detected and self.last_motion_state == 1:
-                    event_ts = datetime.now().time().isoformat()
-                    self.publish_motion_flag(0, event_ts)
-                    print("Motion ended: sent flag 0")
-
-                self.prev_blurred_frame = blurred_frame
-                self.last_motion_state = 1 if motion_detected else 0
-
-                if change_ratio is not None:
-                    print(f"Motion ratio: {change_ratio:.4f} - {'MOTION DETECTED' if motion_detected else 'No motion'}")
+            while active:
+                try:
+                    camera, frame, change_ratio, motion_detected = self.results.get(timeout=1)
+                except queue.Empty:
+                    camera = None
+                if camera is not None:
+                    if frame is None:
+                        active -= 1
+                    else:
+                        self.handle_result(camera, frame, change_ratio, motion_detected, moving[camera.camera_id])
+                        moving[camera.camera_id] = motion_detected
+
+                now = time.monotonic()
+                if now - last_report >= CAMERA_STATS_INTERVAL:
+                    self.report_camera_stats(now - last_report)
+                    last_report = now
 
         except KeyboardInterrupt:
             logging.info("User stopped motion detection with Ctrl+C.")
         finally:
-            process.terminate()
+            self.stop_event.set()
+            for camera in self.cameras.values():
+                camera.close()
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            if self.flag_events.thread is not None:
+                self.flag_events.thread.join()
             self.flag_pub.close()
+            self.flag_replay.close()
             self.image_pub.close()
+            self.ring_pub.close()
+            self.store.close()
             self.cleanup()
 
 if __name__ == "__main__":
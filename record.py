@@ -1,78 +1,197 @@
+import asyncio
 import ffmpeg
 import json
 import os
+import shutil
 import sys
-import threading
 import logging
+import time
+from urllib.parse import urlsplit, urlunsplit
 import zmq
-import subprocess
 
 # Add parent directory to path to import config
 sys.path.append('.')
 
 from config import (
-    MOTION_FLAG_PORT,
+    MOTION_CAMERAS,
     MOTION_URL,
     RECORD_DURATION,
+    RECORD_FORMAT,
     RECORD_FPS,
+    RECORD_FRAGMENT_SECONDS,
+    RECORD_MIN_FREE_BYTES,
+    RECORD_SEGMENT_SECONDS,
+    RECORD_VIDEO_CODEC,
 )
-from utils import ZMQNode
+from recording_index import RecordingIndex, index_clip, parse_time
+from runtime import AsyncZMQNode
+from utils import TOPIC_DETECTION, TOPIC_MOTION_FLAG, subscribe
 
-class Recorder(ZMQNode):
+# Detections that match no clip are kept this long (a clip is indexed after it ends)
+UNMATCHED_DETECTIONS_SECONDS = 86400
+
+
+def encode_args():
+    """ffmpeg video options for RECORD_VIDEO_CODEC."""
+    if RECORD_VIDEO_CODEC == 'copy':
+        # The camera's own keyframes then delimit fragments and segments
+        return ['-c:v', 'copy']
+    return [
+        '-r', str(RECORD_FPS),
+        '-c:v', RECORD_VIDEO_CODEC,
+        '-preset', 'fast',
+        # Regular keyframes: fragments, HLS segments and seek points every RECORD_FRAGMENT_SECONDS
+        '-g', str(max(1, round(RECORD_FPS * RECORD_FRAGMENT_SECONDS))),
+    ]
+
+
+def output_args(base):
+    """ffmpeg output options and path of a clip for RECORD_FORMAT."""
+    if RECORD_FORMAT == "hls":
+        # fMP4 segments and an event playlist, rewritten after every segment
+        os.makedirs(base, exist_ok=True)
+        return [
+            '-f', 'hls',
+            '-hls_time', str(RECORD_SEGMENT_SECONDS),
+            '-hls_segment_type', 'fmp4',
+            '-hls_playlist_type', 'event',
+            '-hls_segment_filename', os.path.join(base, 'seg_%05d.m4s'),
+        ], os.path.join(base, 'index.m3u8')
+    if RECORD_FORMAT == "fmp4":
+        # moov first and empty, then one moof/mdat per keyframe: every complete
+        # fragment is playable while recording and after a crash
+        # (written out as each fragment completes, not held in ffmpeg's buffers)
+        return ['-movflags', '+frag_keyframe+empty_moov+default_base_moof',
+                '-flush_packets', '1'], base + ".mp4"
+    return [], base + ".mp4"
+
+class Recorder(AsyncZMQNode):
     def __init__(self):
         super().__init__('recorder')
-        self.sub = self.context.socket(zmq.SUB)
-        self.sub.connect(f"tcp://localhost:{MOTION_FLAG_PORT}")
-        self.sub.setsockopt_string(zmq.SUBSCRIBE, "")
-        self.is_recording = False
+        self.sub = self.async_socket(zmq.SUB, "reliable")
+        subscribe(self.sub, TOPIC_MOTION_FLAG)
+        self.flag_sources = self.subscribe_service(self.sub, "motion.flag")
+        # Detection results are stored in the catalog to find clips by class
+        self.det_sub = self.async_socket(zmq.SUB, "reliable")
+        subscribe(self.det_sub, TOPIC_DETECTION)
+        self.detection_sources = self.subscribe_service(self.det_sub, "detection")
+        self.index = RecordingIndex()
+        # (node_id, camera_id) of cameras with a clip in progress
+        self.recording = set()
+
+    def stream_url(self, node_id, camera_id):
+        """The camera's stream as advertised by the motion node that raised the flag."""
+        record = self.resolve("motion.flag").get(node_id) or {}
+        url = (record.get("streams") or {}).get(camera_id)
+        if url is None:
+            logging.warning(f"{node_id} advertises no stream for {camera_id}; using the local MOTION_CAMERAS")
+            return MOTION_CAMERAS.get(camera_id, MOTION_URL)
+        # A loopback URL is relative to the motion node's host
+        parts = urlsplit(url)
+        peer_ip = self.peers_info.get(node_id, {}).get("ip")
+        if parts.hostname in ("127.0.0.1", "localhost") and peer_ip and peer_ip != self.get_local_ip():
+            netloc = parts.netloc.replace(parts.hostname, peer_ip, 1)
+            url = urlunsplit(parts._replace(netloc=netloc))
+        return url
 
-    def record_clip(self, start_ts):
-        """Record a 15-second clip using FFmpeg."""
+    async def record_clip(self, camera_id, start_ts, node_id=None, event_id=None):
+        """Record a 15-second clip of one camera using FFmpeg, then add it to the catalog."""
         os.makedirs("recordings", exist_ok=True)
         safe_ts = start_ts.replace(":", "-")
-        filename = f"recordings/record_{safe_ts}.mp4"
+        options, filename = output_args(f"recordings/record_{node_id}_{camera_id}_{safe_ts}")
 
         cmd = [
             'ffmpeg',
-            '-i', MOTION_URL,
+            '-i', self.stream_url(node_id, camera_id),
             '-t', str(RECORD_DURATION),
-            '-r', str(RECORD_FPS),
-            '-c:v', 'libx264',
-            '-preset', 'fast',
+            *encode_args(),
+            *options,
             '-y', filename
         ]
 
+        process = None
+        started = time.time()
         try:
-            subprocess.run(cmd, check=True)
-            logging.info(f"Saved recording: {filename}")
-        except subprocess.CalledProcessError as e:
+            # Catalogued right away, so the clip can be found (and, as fMP4/HLS, watched) while recording
+            await self.offload(self.index.add_recording, filename, node_id, camera_id,
+                               started, started + RECORD_DURATION, event_id)
+            process = await asyncio.create_subprocess_exec(*cmd)
+            returncode = await process.wait()
+            if returncode == 0:
+                logging.info(f"Saved recording: {filename}")
+            else:
+                logging.error(f"Failed to record: ffmpeg exited with {returncode}")
+            # Probing and thumbnails run as their own task; the camera is free again.
+            # A failed clip keeps whatever fragments were written before the error.
+            self.spawn(self.finish_clip(filename, node_id, camera_id, started, event_id))
+        except OSError as e:
             logging.error(f"Failed to record: {e}")
         finally:
-            self.is_recording = False
-
-    def subscriber_loop(self):
-        """Listen for motion flags and trigger recordings."""
-        while not self.stop_event.is_set():
-            try:
-                if self.sub.poll(1000):
-                    msg = self.sub.recv_json()
-                    if msg.get("type") == "motion_flag":
-                        self.handle_flag(msg)
-            except zmq.error.ContextTerminated:
-                break
-
-    def handle_flag(self, msg):
+            # Stop ffmpeg if the node shuts down mid-clip
+            if process is not None and process.returncode is None:
+                process.terminate()
+                await process.wait()
+            self.recording.discard((node_id, camera_id))
+
+    async def handle_flag(self, topic, msg):
         """Handle motion flag messages."""
         flag = msg["flag"]
         ts = msg["ts"]
-        if flag == 1 and not self.is_recording:
-            self.is_recording = True
-            threading.Thread(target=self.record_clip, args=(ts,), daemon=True).start()
-            logging.info(f"Started recording on motion at {ts}")
+        camera_id = msg.get("camera_id", "cam0")
+        node_id = msg.get("node_id")
+        if flag == 1 and (node_id, camera_id) not in self.recording:
+            # system_monitor's storage manager frees space; until it has, a
+            # clip would only fail half-written when the disk fills
+            free = shutil.disk_usage(".").free
+            if free < RECORD_MIN_FREE_BYTES:
+                logging.warning(f"Not recording {camera_id}: only {free / 2**20:.0f} MB free")
+                return
+            self.recording.add((node_id, camera_id))
+            event_id = f"{node_id}/{camera_id}/{msg.get('epoch')}-{msg.get('seq')}"
+            self.spawn(self.record_clip(camera_id, ts, node_id, event_id))
+            logging.info(f"Started recording {camera_id} on motion at {ts}")
 
-    def run(self):
-        # Start discovery if needed
-        self.start_discovery()
+    async def finish_clip(self, filename, node_id, camera_id, started, event_id):
+        """Complete a clip's catalog entry from the file, or drop it if nothing playable was written."""
+        recording_id = None
+        if os.path.exists(filename):
+            recording_id = await index_clip(self.index, filename, node_id, camera_id, started, event_id)
+        if recording_id is None:
+            await self.offload(self.index.remove_path, filename)
+        return recording_id
+
+    async def recover_clips(self, before_ts):
+        """Complete catalog entries of clips cut short by a crash or shutdown."""
+        for clip in await self.offload(self.index.unfinished):
+            if clip["start_ts"] >= before_ts:
+                continue  # started by this run
+            # Fragmented output stays playable up to the last complete fragment
+            if await self.finish_clip(clip["path"], clip["node_id"], clip["camera_id"],
+                                      clip["start_ts"], clip["event_id"]) is not None:
+                logging.info(f"Recovered interrupted recording: {clip['path']}")
+
+    async def handle_detection(self, topic, msg):
+        """Store detection results for the clips they overlap."""
+        try:
+            ts = parse_time(msg.get("ts"))
+        except ValueError:
+            return
+        if ts is None or not msg.get("detections"):
+            return
+        await self.offload(self.index.add_detections, msg.get("sender"), msg.get("camera_id"),
+                           ts, msg["detections"], msg.get("node_id"))
+
+    async def prune_detections(self):
+        while True:
+            await asyncio.sleep(3600)
+            await self.offload(self.index.prune_detections, time.time() - UNMATCHED_DETECTIONS_SECONDS)
+
+    async def start(self):
+        # Sequenced: flags missed during joins or reconnects are replayed
+        self.spawn(self.reliable_loop(self.flag_sources, self.handle_flag))
+        self.spawn(self.subscription_loop(self.detection_sources, self.handle_detection))
+        self.spawn(self.prune_detections())
+        self.spawn(self.recover_clips(time.time()))
 
         logging.info(f"[RECORDER:{self.node_id}] Listening on motion flags")
         logging.info(f"[RECORDER:{self.node_id}] Local IP: {self.get_local_ip()}")
@@ -80,13 +199,10 @@ class Recorder(ZMQNode):
         print(f"[RECORDER:{self.node_id}] Recorder started")
         print(f"[RECORDER:{self.node_id}] Local IP: {self.get_local_ip()}\n")
 
-        try:
-            self.subscriber_loop()
-        except KeyboardInterrupt:
-            logging.info("User stopped recorder with Ctrl+C.")
-        finally:
-            self.sub.close()
-            self.cleanup()
+    def close(self):
+        self.sub.close()
+        self.det_sub.close()
+        self.index.close()
 
 if __name__ == "__main__":
     recorder = Recorder()
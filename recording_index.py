@@ -0,0 +1,383 @@
+"""
+Catalog of recorded clips, kept in SQLite (RECORDING_INDEX_PATH).
+
+record.py adds a row when a clip starts (size NULL: still recording, or
+cut short by a crash) and completes it when the clip ends: motion node,
+camera, start/end time, the motion event that triggered it, file size,
+keyframe byte offsets (for seeking without parsing the MP4) and a
+thumbnail strip. It also stores
+every detection result it receives; detections are matched to clips by
+node, camera and time, so a detection that arrives after its clip was
+indexed still shows up. Lookups by time range or by detected class are
+index scans and never open a video file.
+
+    python recording_index.py find --since 2026-10-19T08:00 --class person
+    python recording_index.py show 42 --thumbnail strip.jpg
+    python recording_index.py backfill recordings/
+"""
+import argparse
+import asyncio
+import bisect
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
+
+# Add parent directory to path to import config
+sys.path.append('.')
+
+from config import (
+    RECORDING_INDEX_PATH,
+    RECORDING_THUMBNAIL_WIDTH,
+    RECORDING_THUMBNAILS,
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS recordings (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    node_id TEXT,
+    camera_id TEXT,
+    start_ts REAL NOT NULL,
+    end_ts REAL NOT NULL,
+    event_id TEXT,
+    size INTEGER,
+    keyframes TEXT
+);
+CREATE INDEX IF NOT EXISTS recordings_start ON recordings (start_ts);
+CREATE INDEX IF NOT EXISTS recordings_camera_start ON recordings (camera_id, start_ts);
+CREATE TABLE IF NOT EXISTS thumbnails (
+    recording_id INTEGER PRIMARY KEY,
+    jpeg BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS detections (
+    ts REAL NOT NULL,
+    node_id TEXT,
+    camera_id TEXT,
+    class TEXT NOT NULL,
+    confidence REAL,
+    detector TEXT
+);
+CREATE INDEX IF NOT EXISTS detections_camera_ts ON detections (node_id, camera_id, ts);
+CREATE INDEX IF NOT EXISTS detections_class_ts ON detections (class, ts);
+-- Classes detected during each clip, so lookups by class are range scans
+CREATE TABLE IF NOT EXISTS recording_classes (
+    class TEXT NOT NULL,
+    start_ts REAL NOT NULL,
+    recording_id INTEGER NOT NULL,
+    PRIMARY KEY (class, start_ts, recording_id)
+) WITHOUT ROWID;
+"""
+
+# Clips are at most a few minutes long; bounds the start_ts range scanned for overlaps
+MAX_CLIP_SECONDS = 3600
+
+
+def parse_time(value):
+    """Accept epoch seconds or an ISO 8601 timestamp; None stays None."""
+    if value is None or value == "":
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+class RecordingIndex:
+    def __init__(self, path=RECORDING_INDEX_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    # --- Writing ---
+
+    def add_recording(self, path, node_id, camera_id, start_ts, end_ts, event_id=None,
+                      size=None, keyframes=(), thumbnail=None):
+        """Index a finished clip; keyframes are (seconds into clip, byte offset). Returns its id."""
+        with self.lock, self.conn:
+            self._delete(path)  # re-indexing a clip replaces it
+            cursor = self.conn.execute(
+                "INSERT INTO recordings "
+                "(path, node_id, camera_id, start_ts, end_ts, event_id, size, keyframes) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (path, node_id, camera_id, start_ts, end_ts, event_id, size,
+                 json.dumps([list(k) for k in keyframes])),
+            )
+            recording_id = cursor.lastrowid
+            if thumbnail:
+                self.conn.execute("INSERT OR REPLACE INTO thumbnails VALUES (?, ?)", (recording_id, thumbnail))
+            # Detections that arrived while the clip was being recorded
+            self.conn.execute(
+                "INSERT OR IGNORE INTO recording_classes "
+                "SELECT DISTINCT class, ?, ? FROM detections "
+                "WHERE node_id IS ? AND camera_id IS ? AND ts BETWEEN ? AND ?",
+                (start_ts, recording_id, node_id, camera_id, start_ts, end_ts),
+            )
+        return recording_id
+
+    def add_detections(self, node_id, camera_id, ts, detections, detector=None):
+        """Store one detection_results message (a list of {"class", "confidence"})."""
+        rows = [(ts, node_id, camera_id, d["class"], d.get("confidence"), detector) for d in detections]
+        if not rows:
+            return
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT INTO detections VALUES (?, ?, ?, ?, ?, ?)", rows)
+            # Clips already indexed that this detection falls into
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO recording_classes "
+                "SELECT ?, start_ts, id FROM recordings "
+                "WHERE camera_id IS ? AND node_id IS ? AND start_ts BETWEEN ? AND ? AND end_ts >= ?",
+                [(cls, camera_id, node_id, ts - MAX_CLIP_SECONDS, ts, ts) for cls in {row[3] for row in rows}],
+            )
+
+    def remove_path(self, path):
+        """Drop a clip whose file was deleted (called by the storage manager)."""
+        with self.lock, self.conn:
+            self._delete(path)
+
+    def _delete(self, path):
+        row = self.conn.execute("SELECT id FROM recordings WHERE path = ?", (path,)).fetchone()
+        if row is None:
+            return
+        self.conn.execute("DELETE FROM thumbnails WHERE recording_id = ?", (row["id"],))
+        self.conn.execute("DELETE FROM recording_classes WHERE recording_id = ?", (row["id"],))
+        self.conn.execute("DELETE FROM recordings WHERE id = ?", (row["id"],))
+
+    def unfinished(self):
+        """Clips started but never completed: being recorded, or interrupted by a crash."""
+        with self.lock:
+            rows = self.conn.execute("SELECT * FROM recordings WHERE size IS NULL ORDER BY start_ts").fetchall()
+        return [dict(row) for row in rows]
+
+    def prune_detections(self, before_ts):
+        """Delete detections older than before_ts that no longer overlap any clip."""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "DELETE FROM detections WHERE ts < ? AND NOT EXISTS ("
+                " SELECT 1 FROM recordings r WHERE r.node_id IS detections.node_id"
+                " AND r.camera_id IS detections.camera_id"
+                " AND detections.ts BETWEEN r.start_ts AND r.end_ts)",
+                (before_ts,),
+            )
+
+    # --- Reading ---
+
+    def find(self, since=None, until=None, camera_id=None, object_class=None, limit=100):
+        """Clips overlapping [since, until], newest first, optionally only those with a detected class."""
+        # Both paths walk a (.., start_ts) index newest first and stop after limit rows
+        if object_class is not None:
+            source = "recording_classes c JOIN recordings r ON r.id = c.recording_id"
+            start_column = "c.start_ts"
+            clauses, params = ["c.class = ?"], [object_class]
+        else:
+            source = "recordings r"
+            start_column = "r.start_ts"
+            clauses, params = [], []
+        if since is not None:
+            # Clips end at most MAX_CLIP_SECONDS after they start
+            clauses.append(f"{start_column} >= ? AND r.end_ts >= ?")
+            params += [since - MAX_CLIP_SECONDS, since]
+        if until is not None:
+            clauses.append(f"{start_column} <= ?")
+            params.append(until)
+        if camera_id is not None:
+            clauses.append("r.camera_id = ?")
+            params.append(camera_id)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        query = (f"SELECT r.id, r.path, r.node_id, r.camera_id, r.start_ts, r.end_ts, r.event_id, r.size "
+                 f"FROM {source} {where} ORDER BY {start_column} DESC LIMIT ?")
+        with self.lock:
+            rows = self.conn.execute(query, (*params, limit)).fetchall()
+        return [dict(row) for row in rows]
+
+    def get(self, recording_id):
+        """One clip with its keyframes and the detections that fall inside it, or None."""
+        with self.lock:
+            row = self.conn.execute("SELECT * FROM recordings WHERE id = ?", (recording_id,)).fetchone()
+            if row is None:
+                return None
+            detections = self.conn.execute(
+                "SELECT ts, class, confidence, detector FROM detections "
+                "WHERE node_id IS ? AND camera_id IS ? AND ts BETWEEN ? AND ? ORDER BY ts",
+                (row["node_id"], row["camera_id"], row["start_ts"], row["end_ts"]),
+            ).fetchall()
+        recording = dict(row)
+        recording["keyframes"] = json.loads(recording["keyframes"] or "[]")
+        recording["detections"] = [dict(d) for d in detections]
+        return recording
+
+    def thumbnail(self, recording_id):
+        with self.lock:
+            row = self.conn.execute("SELECT jpeg FROM thumbnails WHERE recording_id = ?", (recording_id,)).fetchone()
+        return row["jpeg"] if row else None
+
+    def seek(self, recording_id, ts):
+        """Return (keyframe time, byte offset) of the last keyframe at or before ts, or None."""
+        recording = self.get(recording_id)
+        if recording is None or not recording["keyframes"]:
+            return None
+        offset_s = ts - recording["start_ts"]
+        times = [k[0] for k in recording["keyframes"]]
+        position = max(0, bisect.bisect_right(times, offset_s) - 1)
+        return tuple(recording["keyframes"][position])
+
+
+# --- Probing clips (needs the ffprobe/ffmpeg binaries) ---
+
+async def _run(*cmd):
+    process = await asyncio.create_subprocess_exec(
+        *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL)
+    stdout, _ = await process.communicate()
+    return process.returncode, stdout
+
+
+async def probe_keyframes(path):
+    """Return (duration, [(seconds, byte offset), ...]) of a clip's video keyframes."""
+    returncode, stdout = await _run(
+        'ffprobe', '-v', 'error', '-select_streams', 'v:0', '-skip_frame', 'nokey',
+        '-show_entries', 'frame=pts_time,pkt_pos:format=duration', '-of', 'json', path)
+    if returncode != 0:
+        return None, []
+    info = json.loads(stdout or b"{}")
+    keyframes = []
+    # Byte offsets only mean something in a single file, not across HLS segments
+    single_file = not path.endswith(".m3u8")
+    for frame in info.get("frames", []):
+        try:
+            keyframes.append((float(frame["pts_time"]), int(frame["pkt_pos"]) if single_file else None))
+        except (KeyError, ValueError):
+            continue
+    duration = info.get("format", {}).get("duration")
+    return (float(duration) if duration else None), keyframes
+
+
+async def make_thumbnail_strip(path, duration, count=RECORDING_THUMBNAILS, width=RECORDING_THUMBNAIL_WIDTH):
+    """Return one JPEG with count frames spread over the clip side by side, or None."""
+    rate = count / duration if duration else 1
+    returncode, stdout = await _run(
+        'ffmpeg', '-v', 'error', '-i', path,
+        '-vf', f'fps={rate:.6f},scale={width}:-2,tile={count}x1',
+        '-frames:v', '1', '-f', 'image2', '-c:v', 'mjpeg', 'pipe:1')
+    return stdout if returncode == 0 and stdout else None
+
+
+def clip_size(path):
+    """Bytes of a clip: the file, or for an HLS playlist everything in its directory."""
+    if path.endswith(".m3u8"):
+        directory = os.path.dirname(path)
+        return sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+    return os.path.getsize(path)
+
+
+async def index_clip(index, path, node_id, camera_id, start_ts, event_id=None):
+    """Probe a finished clip and add it to the index; returns its id, or None."""
+    duration, keyframes = await probe_keyframes(path)
+    if duration is None:
+        logging.warning(f"Cannot probe {path}; not indexed")
+        return None
+    thumbnail = await make_thumbnail_strip(path, duration)
+    size = clip_size(path)
+    return await asyncio.get_running_loop().run_in_executor(
+        None, lambda: index.add_recording(path, node_id, camera_id, start_ts, start_ts + duration,
+                                          event_id, size, keyframes, thumbnail))
+
+
+def parse_clip_name(clip_name):
+    """Return (node_id, camera_id) from a clip name written by record.py, None where unknown.
+
+    Clips are named record_<node_id>_<camera_id>_<ts>; older clips were
+    record_<camera_id>_<ts>. Node ids are hostname based, so they hold no "_".
+    """
+    if not clip_name.startswith("record_"):
+        return None, None
+    fields, _, _ = clip_name[len("record_"):].rpartition("_")
+    if not fields:
+        return None, None
+    node_id, _, camera_id = fields.partition("_")
+    if not camera_id:
+        return None, node_id
+    return node_id, camera_id
+
+
+async def backfill(index, directory):
+    """Index clips that are on disk but not in the catalog, using file times as start."""
+    known = {row["path"] for row in index.find(limit=-1)}
+    added = 0
+    for root, _, files in os.walk(directory):
+        if "index.m3u8" in files:
+            # An HLS clip directory: the playlist is the clip, the rest are its segments
+            files = ["index.m3u8"]
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            if not name.endswith((".mp4", ".m3u8")) or path in known:
+                continue
+            clip_name = os.path.basename(root) if name == "index.m3u8" else name
+            node_id, camera_id = parse_clip_name(clip_name)
+            duration, _ = await probe_keyframes(path)
+            start_ts = os.path.getmtime(path) - (duration or 0)
+            if await index_clip(index, path, node_id, camera_id, start_ts) is not None:
+                added += 1
+    return added
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index", default=RECORDING_INDEX_PATH)
+    commands = parser.add_subparsers(dest="command", required=True)
+    find = commands.add_parser("find", help="list clips by time, camera or detected class")
+    find.add_argument("--since", help="epoch seconds or ISO 8601")
+    find.add_argument("--until", help="epoch seconds or ISO 8601")
+    find.add_argument("--camera")
+    find.add_argument("--class", dest="object_class")
+    find.add_argument("--limit", type=int, default=20)
+    show = commands.add_parser("show", help="one clip with keyframes and detections")
+    show.add_argument("id", type=int)
+    show.add_argument("--thumbnail", help="write the thumbnail strip to this file")
+    fill = commands.add_parser("backfill", help="index clips recorded before the catalog existed")
+    fill.add_argument("directory", nargs="?", default="recordings")
+    args = parser.parse_args()
+
+    index = RecordingIndex(args.index)
+    try:
+        if args.command == "find":
+            started = time.perf_counter()
+            clips = index.find(parse_time(args.since), parse_time(args.until), args.camera,
+                               args.object_class, args.limit)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            for clip in clips:
+                start = datetime.fromtimestamp(clip["start_ts"]).isoformat(timespec="seconds")
+                print(f"{clip['id']:>6}  {start}  {clip['end_ts'] - clip['start_ts']:5.1f}s  "
+                      f"{clip['camera_id'] or '-':8} {clip['path']}")
+            print(f"{len(clips)} clips in {elapsed_ms:.1f} ms")
+        elif args.command == "show":
+            clip = index.get(args.id)
+            if clip is None:
+                raise SystemExit(f"No recording {args.id}")
+            print(json.dumps(clip, indent=2))
+            if args.thumbnail:
+                jpeg = index.thumbnail(args.id)
+                if jpeg is None:
+                    raise SystemExit("No thumbnail for this recording")
+                with open(args.thumbnail, "wb") as f:
+                    f.write(jpeg)
+        else:
+            print(f"Indexed {asyncio.run(backfill(index, args.directory))} clips")
+    finally:
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Sequence numbers and gap recovery for PUB/SUB event streams.
+
+A SequencedPublisher stamps every event with the publisher's epoch (its
+start time) and a monotonically increasing seq, keeps the last
+REPLAY_BUFFER_SIZE encoded frames and serves them on a ROUTER side channel.
+Subscribers (AsyncZMQNode.reliable_loop) track the last seq per publisher,
+and when they see a gap, a restarted publisher or a publisher for the first
+time, they fetch the missing frames with request_replay. The live path is
+still a plain PUB send, so throughput is unchanged.
+"""
+import json
+import logging
+import sys
+import threading
+import time
+from collections import deque
+
+import zmq
+
+# Add parent directory to path to import config
+sys.path.append('.')
+
+from config import REPLAY_BUFFER_SIZE, REPLAY_TIMEOUT
+from utils import decode_frame, encode_frame
+
+
+class SequencedPublisher:
+    """Publish numbered events on a PUB socket and replay them on request over ROUTER."""
+
+    def __init__(self, pub, router, stop_event, size=REPLAY_BUFFER_SIZE):
+        self.pub = pub
+        self.router = router
+        self.stop_event = stop_event
+        self.epoch = int(time.time() * 1000)
+        self.seq = 0
+        # (seq, wall time, encoded frame)
+        self.buffer = deque(maxlen=size)
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def publish(self, topic, message):
+        """Number, buffer and send one event. Call from the thread that owns pub."""
+        with self.lock:
+            self.seq += 1
+            message["seq"] = self.seq
+            message["epoch"] = self.epoch
+            frame = encode_frame(topic, message)
+            self.buffer.append((self.seq, time.time(), frame))
+        self.pub.send(frame)
+
+    def _lookup(self, request):
+        with self.lock:
+            entries = list(self.buffer)
+            seq = self.seq
+        if request.get("op") == "since":
+            since = request.get("ts", 0)
+            frames = [frame for _, sent, frame in entries if sent >= since]
+        else:
+            first, last = request.get("from", 1), request.get("to", seq)
+            frames = [frame for entry_seq, _, frame in entries if first <= entry_seq <= last]
+        oldest = entries[0][0] if entries else seq + 1
+        return {"epoch": self.epoch, "seq": seq, "oldest": oldest}, frames
+
+    def _serve(self):
+        while not self.stop_event.is_set():
+            if not self.router.poll(200):
+                continue
+            identity, _, payload = self.router.recv_multipart()
+            try:
+                header, frames = self._lookup(json.loads(payload))
+            except (ValueError, TypeError) as e:
+                logging.warning(f"Bad replay request: {e}")
+                continue
+            self.router.send_multipart([identity, b"", json.dumps(header).encode("utf-8"), *frames])
+
+    def start(self):
+        self.thread = threading.Thread(target=self._serve, daemon=True, name="replay")
+        self.thread.start()
+        return self
+
+
+async def request_replay(context, endpoint, request, timeout=REPLAY_TIMEOUT):
+    """
+    Ask a publisher's replay endpoint for buffered events.
+
+    Returns (header, [(topic, message), ...]) or (None, []) if the publisher
+    did not answer within timeout.
+    """
+    sock = context.socket(zmq.DEALER)
+    sock.setsockopt(zmq.LINGER, 0)
+    sock.connect(endpoint)
+    try:
+        await sock.send_multipart([b"", json.dumps(request).encode("utf-8")])
+        if not await sock.poll(int(timeout * 1000)):
+            return None, []
+        _, header, *frames = await sock.recv_multipart()
+        return json.loads(header), [decode_frame(frame) for frame in frames]
+    finally:
+        sock.close()
@@ -0,0 +1,210 @@
+"""
+asyncio runtime for ZMQNode.
+
+Nodes built on AsyncZMQNode run discovery, subscriptions and publishers as
+tasks on one event loop (zmq.asyncio) instead of daemon threads with
+poll(1000) loops. CPU-bound stages are offloaded to a thread pool, shutdown
+cancels every task cooperatively, and the event-loop lag is sampled and
+exposed as loop_lag_ms.
+"""
+import asyncio
+import logging
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import zmq
+import zmq.asyncio
+
+# Add parent directory to path to import config
+sys.path.append('.')
+
+from config import EXECUTOR_WORKERS, LOOP_LAG_INTERVAL
+from replay import request_replay
+from utils import ZMQNode, decode_frame, encode_frame, make_socket
+
+
+class AsyncZMQNode(ZMQNode):
+    def __init__(self, node_suffix, executor_workers=EXECUTOR_WORKERS):
+        super().__init__(node_suffix)
+        self.acontext = zmq.asyncio.Context.shadow(self.context)
+        self.executor = ThreadPoolExecutor(max_workers=executor_workers, thread_name_prefix=node_suffix)
+        self.tasks = set()
+        self.loop = None
+        self.stopping = None
+        self.loop_lag_ms = 0.0
+        self.loop_lag_max_ms = 0.0
+
+    def async_socket(self, socket_type, profile, single_source=False):
+        """Create an asyncio socket using a named stream profile."""
+        return make_socket(self.acontext, socket_type, profile, single_source)
+
+    def spawn(self, coro):
+        """Run coro as a task owned by the node; it is cancelled on shutdown."""
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self._task_done)
+        return task
+
+    def _task_done(self, task):
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(f"[{self.node_id}] Task failed: {task.exception()!r}")
+
+    async def offload(self, func, *args):
+        """Run a CPU-bound function in the executor without blocking the loop."""
+        return await self.loop.run_in_executor(self.executor, func, *args)
+
+    async def send(self, sock, topic, message):
+        await sock.send(encode_frame(topic, message))
+
+    def start_discovery(self):
+        self.discovery = self.make_discovery()
+        if self.discovery.open():
+            self.spawn(self.discovery.run_async())
+
+    def on_peer_join(self, peer_id, info):
+        super().on_peer_join(peer_id, info)
+        # Discovery runs on the loop thread, so sockets can be updated right away
+        for subscription in self.subscriptions:
+            subscription.apply()
+
+    def on_peer_leave(self, peer_id, info):
+        super().on_peer_leave(peer_id, info)
+        for subscription in self.subscriptions:
+            subscription.apply()
+
+    async def subscription_loop(self, subscription, handler):
+        """Receive from a ServiceSubscription's socket and await handler(topic, message)."""
+        subscription.apply()
+        while True:
+            data = await subscription.sock.recv()
+            try:
+                topic, message = decode_frame(data)
+                await handler(topic, message)
+            except Exception as e:
+                logging.error(f"[{self.node_id}] Error handling {subscription.service_type}: {e}")
+
+    async def reliable_loop(self, subscription, handler):
+        """
+        subscription_loop for sequenced streams (see replay.py). Events lost to
+        slow joins, reconnects or HWM drops are fetched from the publisher's
+        replay buffer and handled in order before the event that revealed the
+        gap; duplicates are skipped.
+        """
+        subscription.apply()
+        last_seen = {}  # publisher node_id -> (epoch, seq)
+        while True:
+            data = await subscription.sock.recv()
+            try:
+                topic, message = decode_frame(data)
+                for topic, message in await self._recover(subscription, last_seen, topic, message):
+                    await handler(topic, message)
+            except Exception as e:
+                logging.error(f"[{self.node_id}] Error handling {subscription.service_type}: {e}")
+
+    def _replay_endpoint(self, subscription, publisher):
+        record = self.peers_info.get(publisher, {}).get("services", {}).get(subscription.service_type, {})
+        if "replay_port" not in record:
+            return None
+        host = record["endpoint"].rsplit(":", 1)[0]
+        return f"{host}:{record['replay_port']}"
+
+    async def _recover(self, subscription, last_seen, topic, message):
+        """Return the events to handle for one received message, recovered ones first."""
+        publisher, epoch, seq = message.get("node_id"), message.get("epoch"), message.get("seq")
+        if seq is None:
+            return [(topic, message)]
+
+        known = last_seen.get(publisher)
+        if known is not None and epoch < known[0]:
+            # Late event from before the publisher restarted
+            return []
+        if known is not None and known[0] == epoch:
+            if seq <= known[1]:
+                return []
+            after = known[1]
+            request = None if seq == after + 1 else {"op": "range", "from": after + 1, "to": seq - 1}
+        elif known is None:
+            # First event from this publisher: fetch what was sent while the
+            # subscription was still propagating (slow joiner)
+            after = 0
+            since = subscription.connected_at.get(publisher, time.time())
+            request = {"op": "since", "ts": since}
+        else:
+            # Publisher restarted: everything in its new epoch so far
+            after = 0
+            request = None if seq == 1 else {"op": "range", "from": 1, "to": seq - 1}
+        last_seen[publisher] = (epoch, seq)
+
+        events = []
+        if request is not None:
+            endpoint = self._replay_endpoint(subscription, publisher)
+            header, replayed = (None, []) if endpoint is None else await request_replay(self.acontext, endpoint, request)
+            if header is None:
+                if request["op"] == "range":
+                    logging.warning(f"[{self.node_id}] Lost {subscription.service_type} events "
+                                    f"{request['from']}-{request['to']} from {publisher}: no replay")
+            else:
+                events = [
+                    (t, m) for t, m in replayed
+                    if m.get("epoch") == epoch and after < m.get("seq", 0) < seq
+                ]
+                if request["op"] == "range" and header["oldest"] > request["from"]:
+                    logging.warning(f"[{self.node_id}] Lost {header['oldest'] - request['from']} "
+                                    f"{subscription.service_type} events from {publisher}: replay buffer exceeded")
+                if events:
+                    logging.info(f"[{self.node_id}] Recovered {len(events)} {subscription.service_type} events from {publisher}")
+        events.append((topic, message))
+        return events
+
+    async def monitor_loop_lag(self, interval=LOOP_LAG_INTERVAL):
+        """Sample how late the loop wakes up; high lag means something blocks it."""
+        while True:
+            start = self.loop.time()
+            await asyncio.sleep(interval)
+            lag = max(0.0, (self.loop.time() - start - interval) * 1000)
+            self.loop_lag_ms = lag
+            self.loop_lag_max_ms = max(self.loop_lag_max_ms, lag)
+            store = getattr(self, 'store', None)
+            if store is not None:
+                store.write_point("loop_lag_ms", lag, self.node_id)
+
+    async def start(self):
+        """Spawn the node's own tasks. Override in subclasses."""
+
+    def close(self):
+        """Close the node's sockets and resources. Override in subclasses."""
+
+    def stop(self):
+        """Request shutdown; safe to call from any thread."""
+        if self.loop is not None and self.stopping is not None:
+            self.loop.call_soon_threadsafe(self.stopping.set)
+
+    async def shutdown(self):
+        self.stop_event.set()
+        tasks = list(self.tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _main(self):
+        self.loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        try:
+            self.start_discovery()
+            self.spawn(self.monitor_loop_lag())
+            await self.start()
+            await self.stopping.wait()
+        finally:
+            await self.shutdown()
+
+    def run(self):
+        try:
+            asyncio.run(self._main())
+        except KeyboardInterrupt:
+            logging.info(f"User stopped {self.node_id} with Ctrl+C.")
+        finally:
+            self.close()
+            self.cleanup()
@@ -1,14 +1,18 @@
 """
 Run with: streamlit run server.py
 
+The collector also serves a push-based live view on DASHBOARD_STREAM_PORT
+(http://<host>:8502/) that appends new samples to the charts over SSE.
+The Streamlit view itself still rebuilds and redraws its charts on every
+tick (Streamlit has no way to append points to a chart in place); only its
+fragment reruns, and the data frames are shared between sessions.
 """
 import zmq
 import threading
 import sys
 import time
-from datetime import datetime
-from config import SYSTEM_MONITOR_PORT, SYSTEM_MONITOR_INTERVAL
-from collections import deque
+from urllib.parse import urlsplit
+from config import SYSTEM_MONITOR_INTERVAL, DASHBOARD_STREAM_PORT, DASHBOARD_TSDB_DIR
 import pandas as pd
 import streamlit as st
 import plotly.express as px
@@ -17,81 +21,136 @@ import plotly.graph_objects as go
 # Add parent directory to path to import config
 sys.path.append('.')
 
+from history import HISTORY_TIERS, METRIC_FIELDS, MetricHistory
+from stream import MetricStream
+from tsdb import TimeSeriesStore
+from utils import TOPIC_SYSTEM_STATUS, ZMQNode, recv_message, subscribe
+
+# Selectable dashboard time ranges (label -> seconds)
+TIME_RANGES = {
+    "Last 1 min": 60,
+    "Last 10 min": 600,
+    "Last 1 hour": 3600,
+    "Last 6 hours": 6 * 3600,
+    "Last 24 hours": 24 * 3600,
+    "Last 7 days": 7 * 24 * 3600,
+    "Last 30 days": 30 * 24 * 3600,
+}
+
+# Ranges longer than the in-memory history are read from the local store
+MEMORY_SPAN = max(width * maxlen for width, maxlen in HISTORY_TIERS)
+STORE_CHART_POINTS = 1000
+
 # --- Backend: Data Collection (Cached Resource) ---
 @st.cache_resource
-class DataCollector:
+class DataCollector(ZMQNode):
     def __init__(self):
-        self.data = deque(maxlen=60)
-        self.lock = threading.Lock()
+        super().__init__('dashboard')
+        self.history = MetricHistory()
+        # Own store, written with every received sample: the monitors' stores
+        # under metrics/ are local to each node
+        self.store = TimeSeriesStore(DASHBOARD_TSDB_DIR).start()
+        try:
+            self.stream = MetricStream(self.history, DASHBOARD_STREAM_PORT).start()
+        except OSError as e:
+            # The dashboard works without the live view
+            print(f"Live view disabled, cannot listen on port {DASHBOARD_STREAM_PORT}: {e}")
+            self.stream = None
+        # Converted frames shared by all sessions: (node_id, seconds) -> (version, df)
+        self.frames = {}
+        self.frames_lock = threading.Lock()
         self.running = True
+        self.start_discovery()
         self.thread = threading.Thread(target=self._subscriber_thread, daemon=True)
         self.thread.start()
         print("DataCollector started")
 
     def _subscriber_thread(self):
-        context = zmq.Context()
-        socket = context.socket(zmq.SUB)
+        socket_ = self.socket(zmq.SUB, "latest")
         try:
-            socket.connect(f"tcp://localhost:{SYSTEM_MONITOR_PORT}")
-            socket.setsockopt_string(zmq.SUBSCRIBE, "")
-            print(f"Listening on {SYSTEM_MONITOR_PORT}")
+            subscribe(socket_, TOPIC_SYSTEM_STATUS)
+            monitors = self.subscribe_service(socket_, "system_status")
+            print("Listening for discovered system_status services")
             
             while self.running:
                 try:
-                    if socket.poll(1000):
-                        msg = socket.recv_json()
-                        with self.lock:
-                            self.data.append(msg)
+                    monitors.apply()
+                    if socket_.poll(200):
+                        _, msg = recv_message(socket_)
+                        sample = self.history.add(msg, time.time())
+                        self.store.write_points(
+                            {field: sample[field] for field in METRIC_FIELDS if sample[field] == sample[field]},
+                            msg.get('node_id', 'unknown'),
+                            sample['time'],
+                        )
+                except zmq.error.ContextTerminated:
+                    break
                 except Exception as e:
                     print(f"Error accessing socket: {e}")
                     time.sleep(1)
         except Exception as e:
             print(f"Connection error: {e}")
         finally:
-            socket.close()
-            context.term()
-
-    def get_dataframe(self):
-        with self.lock:
-            if not self.data:
-                return pd.DataFrame()
-            df = pd.DataFrame(list(self.data))
-            if not df.empty and 'timestamp' in df.columns:
-                df['timestamp'] = pd.to_datetime(df['timestamp'], format='mixed')
-                df['numeric_gpu'] = df['gpu'].apply(lambda x: float(x.rstrip('%')) if isinstance(x, str) and x.endswith('%') and x != 'N/A' else float('nan'))
-                df['numeric_temp'] = df['temperature'].apply(lambda x: float(x.rstrip('°C')) if isinstance(x, str) and x.endswith('°C') and 'not available' not in x.lower() else float('nan'))
-            return df
+            socket_.close()
+
+    def get_node_ids(self):
+        now = time.time()
+        stored = self.store.node_ids(now - MEMORY_SPAN, now)
+        return sorted(set(self.history.node_ids()) | set(stored))
+
+    def get_dataframe(self, node_id, seconds):
+        """Return the chart frame, rebuilt at most once per new sample for all sessions."""
+        version = self.history.version(node_id)
+        if seconds > MEMORY_SPAN:
+            # Stored ranges change slowly; refresh them once per coarse step
+            version = int(time.time() // (seconds / STORE_CHART_POINTS))
+        key = (node_id, seconds)
+        with self.frames_lock:
+            cached = self.frames.get(key)
+            if cached is not None and cached[0] == version:
+                return cached[1]
+
+        now = time.time()
+        if seconds > MEMORY_SPAN:
+            rows = self.store.query_points(node_id, METRIC_FIELDS, now - seconds, now,
+                                           step=seconds / STORE_CHART_POINTS)
+        else:
+            rows = self.history.select(node_id, seconds, now)
+        if not rows:
+            return pd.DataFrame()
+        df = pd.DataFrame(rows, columns=['time', *METRIC_FIELDS])
+        df['timestamp'] = pd.to_datetime(df['time'], unit='s')
+        with self.frames_lock:
+            self.frames[key] = (version, df)
+        return df
             
-    def get_latest(self):
-        with self.lock:
-             return self.data[-1] if self.data else None
+    def get_latest(self, node_id):
+        return self.history.latest(node_id)
 
 # Initialize the collector (singleton)
 collector = DataCollector()
 
 # --- Frontend: Dashboard ---
-def run_dashboard():
-    st.set_page_config(page_title="System Monitor", page_icon="📊", layout="wide")
-    st.title("📊 Live System Monitor (Last 60s)")
-    
+@st.fragment(run_every=SYSTEM_MONITOR_INTERVAL)
+def live_panel(node_id, seconds):
+    """Only this fragment reruns on each tick, not the whole script."""
     # Get data
-    df = collector.get_dataframe()
-    latest = collector.get_latest()
+    df = collector.get_dataframe(node_id, seconds)
+    latest = collector.get_latest(node_id) or (df.iloc[-1].to_dict() if not df.empty else None)
 
-    if df.empty:
-        st.warning("Waiting for data... Ensure system_monitor.py is running.")
-        time.sleep(1)
-        st.rerun()
+    if df.empty or latest is None:
+        st.warning(f"No data for {node_id} in the selected range yet.")
         return
 
-    st.subheader(f"Node ID: {latest.get('node_id', 'Unknown')}")
+    st.subheader(f"Node ID: {node_id}")
 
     # Metrics Row
-    cols = st.columns(4)
+    cols = st.columns(5)
     cols[0].metric("CPU", f"{latest.get('cpu', 0):.1f}%")
     cols[1].metric("Memory", f"{latest.get('memory_used_gb', 0):.1f}/{latest.get('memory_total_gb', 0):.1f} GB")
     cols[2].metric("Temp", f"{latest.get('temperature', 'N/A')}")
     cols[3].metric("GPU", f"{latest.get('gpu', 'N/A')}")
+    cols[4].metric("Disk Free", f"{latest.get('disk_free_gb', 0):.1f} GB")
 
     st.divider()
 
@@ -132,9 +191,33 @@ def run_dashboard():
         )
         st.plotly_chart(fig, width='stretch')
 
-    # Auto-refresh loop
-    time.sleep(SYSTEM_MONITOR_INTERVAL)
-    st.rerun()
+def stream_host():
+    """Host the browser used to reach the dashboard, so the live view link works from other machines."""
+    try:
+        hostname = urlsplit(f"//{st.context.headers.get('Host', '')}").hostname
+    except ValueError:
+        hostname = None
+    if not hostname:
+        return collector.get_local_ip()
+    return f"[{hostname}]" if ':' in hostname else hostname
+
+def run_dashboard():
+    st.set_page_config(page_title="System Monitor", page_icon="📊", layout="wide")
+    st.title("📊 Live System Monitor")
+
+    node_ids = collector.get_node_ids()
+    if not node_ids:
+        st.warning("Waiting for data... Ensure system_monitor.py is running.")
+        time.sleep(1)
+        st.rerun()
+        return
+
+    node_id = st.sidebar.selectbox("Node", node_ids)
+    range_label = st.sidebar.radio("Time range", list(TIME_RANGES))
+    if collector.stream is not None:
+        st.sidebar.markdown(f"[Push-based live view](http://{stream_host()}:{DASHBOARD_STREAM_PORT}/)")
+
+    live_panel(node_id, TIME_RANGES[range_label])
 
 if __name__ == "__main__":
     if 'streamlit' in sys.modules:
@@ -0,0 +1,392 @@
+"""
+Disk quotas and retention for the directories nodes write media into.
+
+Each managed directory (recordings/, detection_images/, received_images/)
+has a size quota and a maximum file age. A DirectoryIndex keeps the files
+of one directory tree in memory, oldest first, and refreshes incrementally:
+a directory is only listed again when its own mtime changed (a file was
+created, renamed or deleted in it), and only files still being written are
+re-stat'ed. A refresh therefore costs one stat per directory, not per file.
+
+StorageManager runs the indexes in a background thread at the lowest CPU
+priority and deletes, oldest first:
+    1. files older than the directory's max age,
+    2. files over the directory's quota,
+    3. files from any directory while the disk has less than
+       STORAGE_MIN_FREE_BYTES free.
+An HLS clip directory (one holding an index.m3u8, see record.py) is a
+single entry keyed by its playlist: it is aged and sized as a whole and
+deleted in one go, so retention never strips a clip of its first segments
+and on_delete sees the path the recording catalog knows.
+Deletions are paced to STORAGE_DELETE_RATE files and
+STORAGE_DELETE_BYTES_PER_S per second so that cleaning up a backlog does not
+cause an I/O spike on the SD card. system_monitor.py runs the manager and
+publishes its free-space and churn metrics.
+"""
+import heapq
+import logging
+import os
+import shutil
+import sys
+import threading
+import time
+
+# Add parent directory to path to import config
+sys.path.append('.')
+
+from config import (
+    STORAGE_DELETE_BYTES_PER_S,
+    STORAGE_DELETE_RATE,
+    STORAGE_MIN_FREE_BYTES,
+    STORAGE_QUOTAS,
+    STORAGE_SCAN_INTERVAL,
+)
+
+# Playlist name of an HLS clip directory (record.output_args)
+HLS_PLAYLIST = "index.m3u8"
+
+
+class DirectoryIndex:
+    """Files under one directory, ordered by mtime, updated incrementally."""
+
+    def __init__(self, root, max_bytes=None, max_age_days=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age = max_age_days * 86400 if max_age_days else None
+        self.files = {}  # path -> (mtime, size)
+        self.heap = []  # (mtime, path); entries for removed files are skipped lazily
+        self.dirs = {}  # directory -> (mtime, subdirectories)
+        self.dir_files = {}  # directory -> paths of the files directly in it
+        self.growing = set()  # files whose size changed since the last refresh
+        self.clips = set()  # playlist paths standing for whole HLS clip directories
+        self.total_bytes = 0
+        self.added_bytes = 0  # churn counters, reset by take_churn()
+        self.deleted_bytes = 0
+        self.deleted_files = 0
+        self.scanned = False
+
+    def refresh(self):
+        """Pick up new, removed and growing files."""
+        self._refresh_dir(self.root)
+        for path in list(self.growing):
+            self._restat(path)
+        if not self.scanned:
+            # Files found by the first scan are existing data, not churn
+            self.added_bytes = 0
+            self.scanned = True
+
+    def _refresh_dir(self, directory):
+        try:
+            mtime = os.stat(directory).st_mtime
+        except FileNotFoundError:
+            self._forget_dir(directory)
+            return
+        known = self.dirs.get(directory)
+        if known is not None and known[0] == mtime:
+            subdirs = known[1]
+        else:
+            subdirs = self._list_dir(directory, mtime)
+        for subdir in subdirs:
+            self._refresh_dir(subdir)
+
+    def _list_dir(self, directory, mtime):
+        subdirs = []
+        present = set()
+        try:
+            entries = list(os.scandir(directory))
+        except OSError as e:
+            logging.warning(f"[STORAGE] Cannot list {directory}: {e}")
+            return subdirs
+        if directory != self.root and any(entry.name == HLS_PLAYLIST for entry in entries):
+            return self._list_clip(directory, mtime)
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                present.add(entry.path)
+                if entry.path not in self.files:
+                    try:
+                        st = entry.stat(follow_symlinks=False)
+                    except FileNotFoundError:
+                        continue
+                    self._add(entry.path, st.st_mtime, st.st_size)
+        # Files that disappeared from this directory without going through delete()
+        for path in self.dir_files.get(directory, set()) - present:
+            if path in self.files:
+                self._drop(path)
+        self.dir_files[directory] = present
+        for old in set(self.dirs.get(directory, (None, []))[1]) - set(subdirs):
+            self._forget_dir(old)
+        self.dirs[directory] = (mtime, subdirs)
+        return subdirs
+
+    def _list_clip(self, directory, mtime):
+        """Index an HLS clip directory as one entry; returns no subdirectories."""
+        playlist = os.path.join(directory, HLS_PLAYLIST)
+        # Segments seen before the playlist was written were indexed one by one
+        counted = 0
+        for path in self.dir_files.get(directory, set()) - {playlist}:
+            if path in self.files:
+                counted += self.files[path][1]
+                self._drop(path)
+        for old in self.dirs.get(directory, (None, []))[1]:
+            self._forget_dir(old)
+        self.dir_files[directory] = {playlist}
+        self.dirs[directory] = (mtime, [])
+        if playlist in self.files:
+            self._restat(playlist)
+            return []
+        try:
+            usage = self._clip_usage(directory)
+        except FileNotFoundError:
+            return []
+        self.clips.add(playlist)
+        self._add(playlist, *usage)
+        self.added_bytes -= min(counted, usage[1])  # already counted as churn
+        return []
+
+    def _clip_usage(self, directory):
+        """(newest mtime, total size) of the files in a clip directory."""
+        mtime = size = 0
+        for entry in os.scandir(directory):
+            if entry.is_file(follow_symlinks=False):
+                st = entry.stat(follow_symlinks=False)
+                mtime = max(mtime, st.st_mtime)
+                size += st.st_size
+        return mtime, size
+
+    def _forget_dir(self, directory):
+        prefix = directory + os.sep
+        for known in [d for d in self.dirs if d == directory or d.startswith(prefix)]:
+            for path in self.dir_files.pop(known, ()):
+                if path in self.files:
+                    self._drop(path)
+            del self.dirs[known]
+
+    def _add(self, path, mtime, size):
+        self.files[path] = (mtime, size)
+        heapq.heappush(self.heap, (mtime, path))
+        self.total_bytes += size
+        self.added_bytes += size
+        # A file still being written keeps growing; watch it until it settles
+        self.growing.add(path)
+
+    def _restat(self, path):
+        try:
+            if path in self.clips:
+                new_mtime, new_size = self._clip_usage(os.path.dirname(path))
+            else:
+                st = os.stat(path)
+                new_mtime, new_size = st.st_mtime, st.st_size
+        except FileNotFoundError:
+            self._drop(path)
+            return
+        mtime, size = self.files[path]
+        if new_size == size and new_mtime == mtime:
+            self.growing.discard(path)
+            return
+        self.growing.add(path)
+        self.total_bytes += new_size - size
+        self.added_bytes += max(0, new_size - size)
+        self.files[path] = (new_mtime, new_size)
+        heapq.heappush(self.heap, (new_mtime, path))
+
+    def _drop(self, path):
+        _, size = self.files.pop(path)
+        self.total_bytes -= size
+        self.growing.discard(path)
+        self.clips.discard(path)
+
+    def oldest(self):
+        """Return (mtime, path, size) of the oldest settled file, or None."""
+        while self.heap:
+            mtime, path = self.heap[0]
+            current = self.files.get(path)
+            if current is None or current[0] != mtime:
+                heapq.heappop(self.heap)  # removed or re-stat'ed since pushed
+                continue
+            if path in self.growing:
+                return None  # never delete a file that is still being written
+            return mtime, path, current[1]
+        return None
+
+    def over_limit(self, now):
+        """True if the oldest file is past the max age or the directory is over quota."""
+        oldest = self.oldest()
+        if oldest is None:
+            return False
+        if self.max_age is not None and now - oldest[0] > self.max_age:
+            return True
+        return self.max_bytes is not None and self.total_bytes > self.max_bytes
+
+    def delete(self, path):
+        """Remove a file or HLS clip (and its directory if left empty); returns the bytes freed, None on failure."""
+        size = self.files.get(path, (0, 0))[1]
+        clip = path in self.clips
+        try:
+            if clip:
+                shutil.rmtree(os.path.dirname(path))
+            else:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            # Stop tracking it, or it would stay first in line forever
+            logging.warning(f"[STORAGE] Cannot delete {path}: {e}")
+            self._drop(path)
+            return None
+        if path in self.files:
+            self._drop(path)
+        self.deleted_bytes += size
+        self.deleted_files += 1
+        directory = os.path.dirname(path)
+        if clip:
+            self._forget_dir(directory)
+            directory = os.path.dirname(directory)
+        if directory != self.root:
+            try:
+                os.rmdir(directory)  # only succeeds once a shard directory is empty
+            except OSError:
+                pass
+        return size
+
+    def take_churn(self):
+        """Return and reset (added bytes, deleted bytes, deleted files)."""
+        churn = (self.added_bytes, self.deleted_bytes, self.deleted_files)
+        self.added_bytes = self.deleted_bytes = self.deleted_files = 0
+        return churn
+
+
+class StorageManager:
+    """Enforce per-directory quotas and a free-space floor in a background thread."""
+
+    def __init__(self, quotas=STORAGE_QUOTAS, min_free_bytes=STORAGE_MIN_FREE_BYTES,
+                 scan_interval=STORAGE_SCAN_INTERVAL, delete_rate=STORAGE_DELETE_RATE,
+                 delete_bytes_per_s=STORAGE_DELETE_BYTES_PER_S, on_delete=None):
+        self.indexes = {
+            directory: DirectoryIndex(os.path.normpath(directory), **limits)
+            for directory, limits in quotas.items()
+        }
+        self.min_free_bytes = min_free_bytes
+        self.scan_interval = scan_interval
+        self.delete_rate = delete_rate
+        self.delete_bytes_per_s = delete_bytes_per_s
+        # Called with the path of each deleted file, e.g. to drop it from a catalog
+        self.on_delete = on_delete
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        # Churn over the last scan period, replaced at each refresh
+        self.rates = {directory: (0.0, 0.0, 0) for directory in self.indexes}
+        self.last_refresh = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="storage", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def free_bytes(self):
+        """Free bytes on the filesystem of the first managed directory."""
+        for directory in self.indexes:
+            probe = directory if os.path.isdir(directory) else "."
+            return shutil.disk_usage(probe).free
+        return shutil.disk_usage(".").free
+
+    def _run(self):
+        try:
+            # Lowest CPU priority for this thread only (Linux sets nice per thread)
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+        except (AttributeError, OSError):
+            pass
+        while not self.stop_event.is_set():
+            with self.lock:
+                for index in self.indexes.values():
+                    index.refresh()
+                self._update_rates()
+            self._enforce()
+            self.stop_event.wait(self.scan_interval)
+
+    def _next_victim(self):
+        """Pick the next file to delete, or None when every limit is met."""
+        now = time.time()
+        for index in self.indexes.values():
+            if index.over_limit(now):
+                return index, index.oldest()
+        if self.min_free_bytes and self.free_bytes() < self.min_free_bytes:
+            candidates = [(index.oldest(), index) for index in self.indexes.values()]
+            candidates = [(oldest, index) for oldest, index in candidates if oldest is not None]
+            if candidates:
+                oldest, index = min(candidates, key=lambda item: item[0][0])
+                return index, oldest
+            logging.warning("[STORAGE] Low on disk space and nothing left to delete")
+        return None
+
+    def _enforce(self):
+        deleted = 0
+        while not self.stop_event.is_set():
+            with self.lock:
+                victim = self._next_victim()
+                if victim is None:
+                    break
+                index, (_, path, _) = victim
+                size = index.delete(path)
+            if size is None:
+                continue
+            deleted += 1
+            if self.on_delete is not None:
+                try:
+                    self.on_delete(path)
+                except Exception as e:
+                    logging.error(f"[STORAGE] on_delete failed for {path}: {e}")
+            # Pace deletions: at most delete_rate files and delete_bytes_per_s per second
+            pause = max(1.0 / self.delete_rate if self.delete_rate else 0.0,
+                        size / self.delete_bytes_per_s if self.delete_bytes_per_s else 0.0)
+            self.stop_event.wait(pause)
+        if deleted:
+            logging.info(f"[STORAGE] Deleted {deleted} files, {self.free_bytes() / 2**30:.2f} GB free")
+
+    def _update_rates(self):
+        """Turn the churn counted since the previous refresh into rates over the measured period.
+
+        Called with the lock held, right after a refresh: files are only seen
+        as added when the index is refreshed, so the period between two
+        refreshes is the only one churn can be measured over. Deletions of a
+        retention pass are counted in the period that follows its refresh.
+        """
+        now = time.monotonic()
+        elapsed = now - self.last_refresh if self.last_refresh is not None else 0.0
+        self.last_refresh = now
+        for directory, index in self.indexes.items():
+            added, deleted, files = index.take_churn()
+            if elapsed:
+                self.rates[directory] = (added / elapsed, deleted / elapsed, files)
+
+    def stats(self):
+        """Return (totals, per-directory stats): current usage and churn over the last scan period."""
+        per_directory = {}
+        added = deleted = 0.0
+        with self.lock:
+            for directory, index in self.indexes.items():
+                dir_added, dir_deleted, dir_files = self.rates[directory]
+                added += dir_added
+                deleted += dir_deleted
+                per_directory[directory] = {
+                    "used_mb": index.total_bytes / 2**20,
+                    "files": len(index.files),
+                    "added_kbs": dir_added / 1024,
+                    "deleted_kbs": dir_deleted / 1024,
+                    "deleted_files": dir_files,
+                }
+            used = sum(index.total_bytes for index in self.indexes.values())
+        totals = {
+            "disk_free_gb": self.free_bytes() / 2**30,
+            "storage_used_gb": used / 2**30,
+            "storage_added_kbs": added / 1024,
+            "storage_deleted_kbs": deleted / 1024,
+        }
+        return totals, per_directory
@@ -0,0 +1,202 @@
+"""
+Push-based live metric stream (Server-Sent Events).
+
+One shared MetricHistory feeds every connected browser. Clients receive
+only the new samples and append them to their charts with
+Plotly.extendTraces, so nothing is recomputed or redrawn per viewer.
+plotly.js is served from the installed plotly package, so the page also
+works without internet access.
+"""
+import json
+import logging
+import math
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from plotly.offline import get_plotlyjs
+
+# Per-client backlog of deltas; slow clients drop samples instead of blocking ingest
+CLIENT_QUEUE_SIZE = 256
+HEARTBEAT_INTERVAL = 15
+
+PAGE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Live System Monitor</title>
+<script src="/plotly.min.js"></script>
+<style>body{font-family:sans-serif;margin:1em} .row{display:flex;gap:1em} .row>div{flex:1}</style>
+</head>
+<body>
+<h2>Live System Monitor</h2>
+<label>Node <select id="node"></select></label>
+<div class="row"><div id="system"></div><div id="io"></div></div>
+<script>
+const MAX_POINTS = %(max_points)d;
+const SYSTEM = [['cpu', 'CPU %%'], ['memory_percent', 'RAM %%'], ['numeric_gpu', 'GPU %%'], ['numeric_temp', 'Temp °C']];
+const IO = [['network_recv_kbs', 'Net Recv'], ['network_send_kbs', 'Net Send'],
+            ['disk_read_kbs', 'Disk Read'], ['disk_write_kbs', 'Disk Write']];
+const select = document.getElementById('node');
+const known = new Set();
+
+function traces(fields, rows) {
+  return fields.map(([key, name]) => ({
+    x: rows.map(r => new Date(r.time * 1000)), y: rows.map(r => r[key]), name: name, mode: 'lines'}));
+}
+
+function draw() {
+  fetch('/history?node=' + encodeURIComponent(select.value) + '&seconds=' + MAX_POINTS)
+    .then(r => r.json())
+    .then(rows => {
+      Plotly.newPlot('system', traces(SYSTEM, rows), {title: 'System Metrics', yaxis: {range: [0, 100]}});
+      Plotly.newPlot('io', traces(IO, rows), {title: 'I/O Metrics (KB/s)'});
+    });
+}
+
+function addNode(node) {
+  if (known.has(node)) return;
+  known.add(node);
+  select.add(new Option(node, node));
+  if (known.size === 1) draw();
+}
+
+function extend(div, fields, sample) {
+  const t = new Date(sample.time * 1000);
+  Plotly.extendTraces(div, {x: fields.map(() => [t]), y: fields.map(([key]) => [sample[key]])},
+                      fields.map((_, i) => i), MAX_POINTS);
+}
+
+select.onchange = draw;
+fetch('/nodes').then(r => r.json()).then(nodes => nodes.forEach(addNode));
+const source = new EventSource('/events');
+source.onmessage = e => {
+  const delta = JSON.parse(e.data);
+  addNode(delta.node_id);
+  if (delta.node_id === select.value) {
+    extend('system', SYSTEM, delta.sample);
+    extend('io', IO, delta.sample);
+  }
+};
+</script>
+</body>
+</html>
+"""
+
+
+def _clean(sample):
+    """Replace NaN with None so the sample serializes to valid JSON."""
+    return {k: (None if isinstance(v, float) and math.isnan(v) else v) for k, v in sample.items()}
+
+
+class MetricStream:
+    """Serve the live page and fan out new samples of a MetricHistory over SSE."""
+
+    def __init__(self, history, port, max_points=600):
+        self.history = history
+        self.port = port
+        self.max_points = max_points
+        self.clients = set()
+        self.lock = threading.Lock()
+        self.server = None
+        self.plotlyjs = None  # encoded on first request
+
+    def publish(self, node_id, sample):
+        data = json.dumps({'node_id': node_id, 'sample': _clean(sample)})
+        with self.lock:
+            clients = list(self.clients)
+        for client in clients:
+            try:
+                client.put_nowait(data)
+            except queue.Full:
+                pass
+
+    def _handler(self):
+        stream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, payload):
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path == '/':
+                    body = (PAGE % {'max_points': stream.max_points}).encode('utf-8')
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/html; charset=utf-8')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                elif url.path == '/plotly.min.js':
+                    if stream.plotlyjs is None:
+                        stream.plotlyjs = get_plotlyjs().encode('utf-8')
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/javascript; charset=utf-8')
+                    self.send_header('Content-Length', str(len(stream.plotlyjs)))
+                    self.send_header('Cache-Control', 'max-age=86400')
+                    self.end_headers()
+                    self.wfile.write(stream.plotlyjs)
+                elif url.path == '/nodes':
+                    self._send_json(stream.history.node_ids())
+                elif url.path == '/history':
+                    params = parse_qs(url.query)
+                    node_id = params.get('node', [''])[0]
+                    try:
+                        seconds = float(params.get('seconds', [stream.max_points])[0])
+                    except ValueError:
+                        self.send_error(400, 'seconds must be a number')
+                        return
+                    rows = stream.history.select(node_id, seconds, time.time())
+                    self._send_json([_clean(row) for row in rows])
+                elif url.path == '/events':
+                    self._stream_events()
+                else:
+                    self.send_error(404)
+
+            def _stream_events(self):
+                client = queue.Queue(maxsize=CLIENT_QUEUE_SIZE)
+                with stream.lock:
+                    stream.clients.add(client)
+                try:
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/event-stream')
+                    self.send_header('Cache-Control', 'no-cache')
+                    self.end_headers()
+                    while True:
+                        try:
+                            data = client.get(timeout=HEARTBEAT_INTERVAL)
+                            self.wfile.write(f"data: {data}\n\n".encode('utf-8'))
+                        except queue.Empty:
+                            self.wfile.write(b": keepalive\n\n")
+                        self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+                finally:
+                    with stream.lock:
+                        stream.clients.discard(client)
+
+        return Handler
+
+    def start(self):
+        """Bind the port and serve; raises OSError if the port cannot be bound."""
+        self.server = ThreadingHTTPServer(('', self.port), self._handler())
+        self.server.daemon_threads = True
+        self.history.subscribe(self.publish)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        logging.info(f"Live metric stream on http://*:{self.port}/")
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
@@ -8,7 +8,11 @@ from typing import Dict, Optional, Tuple
 import logging
 import sys
 import zmq
-from utils import ZMQNode
+from history import METRIC_FIELDS, status_to_sample
+from recording_index import RecordingIndex
+from storage import StorageManager
+from tsdb import TimeSeriesStore
+from utils import TOPIC_SYSTEM_STATUS, ZMQNode, make_topic, send_message
 
 # Add parent directory to path to import config
 sys.path.append('.')
@@ -176,10 +180,17 @@ class SystemMonitor(ZMQNode):
     def __init__(self):
         super().__init__('system_monitor')
         self.pub_port = SYSTEM_MONITOR_PORT  # For discovery
-        self.status_pub = self.context.socket(zmq.PUB)
+        self.advertise("system_status", SYSTEM_MONITOR_PORT)
+        self.status_topic = make_topic(TOPIC_SYSTEM_STATUS, self.node_id)
+        self.status_pub = self.socket(zmq.PUB, "latest")
         self.status_pub.bind(f"tcp://*:{SYSTEM_MONITOR_PORT}")
+        self.store = TimeSeriesStore().start()
+        # Quotas and retention for recordings/ and the image directories;
+        # deleted clips are dropped from the recording catalog
+        self.recordings = RecordingIndex()
+        self.storage = StorageManager(on_delete=self.recordings.remove_path)
 
-    def publish_status(self, speeds, cpu_usage, mem, temp, gpu):
+    def publish_status(self, speeds, cpu_usage, mem, temp, gpu, storage):
         """Publish system status via ZeroMQ."""
         timestamp = datetime.now().time().isoformat()
         
@@ -196,10 +207,19 @@ class SystemMonitor(ZMQNode):
             'network_send_kbs': speeds['send_speed'] / 1024,
             'network_recv_kbs': speeds['recv_speed'] / 1024,
             'temperature': temp,
-            'gpu': gpu
+            'gpu': gpu,
+            **storage,
         }
         
-        self.status_pub.send_json(status_data)
+        send_message(self.status_pub, self.status_topic, status_data)
+
+        # Persist the numeric snapshot for long-range charts
+        sample = status_to_sample(status_data, time.time())
+        self.store.write_points(
+            {field: sample[field] for field in METRIC_FIELDS if sample[field] == sample[field]},
+            self.node_id,
+            sample['time'],
+        )
         
         # Also log locally
         message = (
@@ -210,13 +230,15 @@ class SystemMonitor(ZMQNode):
             f"Disk R/W: {speeds['read_speed'] / 1024:.2f}/{speeds['write_speed'] / 1024:.2f} KB/s, "
             f"Network U/D: {speeds['send_speed'] / 1024:.2f}/{speeds['recv_speed'] / 1024:.2f} KB/s, "
             f"Temp: {temp}, "
-            f"GPU: {gpu}"
+            f"GPU: {gpu}, "
+            f"Disk free: {storage['disk_free_gb']:.2f} GB"
         )
         logging.info(message)
 
     def run(self):
-        # Start discovery thread
+        # Start discovery and storage retention threads
         self.start_discovery()
+        self.storage.start()
 
         logging.info(f"[STATUS_PUB:{self.node_id}] Listening on tcp://*:{SYSTEM_MONITOR_PORT}")
         logging.info(f"[PUB:{self.node_id}] Local IP: {self.get_local_ip()}")
@@ -234,13 +256,19 @@ class SystemMonitor(ZMQNode):
                 temp = get_temperature_status()
                 gpu_pct = speeds.get("gpu_usage_percent")
                 gpu = f"{gpu_pct:.1f}%" if isinstance(gpu_pct, (int, float)) else "N/A"
+                storage, directories = self.storage.stats()
+                for directory, stats in directories.items():
+                    self.store.write_points(stats, f"{self.node_id}/{directory}")
                 
-                self.publish_status(speeds, cpu, mem, temp, gpu)
+                self.publish_status(speeds, cpu, mem, temp, gpu, storage)
 
         except KeyboardInterrupt:
             logging.info("User stopped system monitoring with Ctrl+C.")
         finally:
+            self.storage.stop()
+            self.recordings.close()
             self.status_pub.close()
+            self.store.close()
             self.cleanup()
 
 
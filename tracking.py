@@ -0,0 +1,252 @@
+"""
+Object tracking between low-rate detections (SORT-style).
+
+While motion lasts, the motion node shares frames at TRACK_FPS. Running YOLO
+on each is too slow for a Pi, so a CameraTracker decides per frame whether
+a full detection is due. In between, each track's box is carried forward by
+a constant-velocity Kalman filter, which costs a few small matrix products
+and does not even need the frame decoded. When a detection does run, its
+boxes are matched to the predicted tracks by IoU (greedy, same class only),
+matched tracks are corrected, unmatched detections start new tracks and
+tracks unmatched for TRACK_MAX_MISSES detections are dropped. Track IDs are
+stable for as long as an object stays matched.
+
+The detection interval adapts between TRACK_DETECT_INTERVAL_MIN and
+TRACK_DETECT_INTERVAL_MAX: it halves when objects appear, disappear or
+drift from their predictions, and grows while every track is stable.
+"""
+import sys
+from datetime import time as dtime
+
+import numpy as np
+
+# Add parent directory to path to import config
+sys.path.append('.')
+
+from config import (
+    TRACK_DETECT_INTERVAL_MAX,
+    TRACK_DETECT_INTERVAL_MIN,
+    TRACK_FPS,
+    TRACK_IOU_THRESHOLD,
+    TRACK_MAX_MISSES,
+    TRACK_MIN_HITS,
+    TRACK_RESET_SECONDS,
+    TRACK_STABLE_IOU,
+)
+
+
+def time_of_day_seconds(ts):
+    """Seconds since midnight of a motion node's "HH:MM:SS.ffffff" stamp, None if unparseable."""
+    try:
+        t = dtime.fromisoformat(ts)
+    except (TypeError, ValueError):
+        return None
+    return t.hour * 3600 + t.minute * 60 + t.second + t.microsecond / 1e6
+
+
+def iou(a, b):
+    """Intersection over union of two [x1, y1, x2, y2] boxes."""
+    width = min(a[2], b[2]) - max(a[0], b[0])
+    height = min(a[3], b[3]) - max(a[1], b[1])
+    if width <= 0 or height <= 0:
+        return 0.0
+    inter = width * height
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def box_to_z(box):
+    """[x1, y1, x2, y2] -> measurement [cx, cy, area, aspect ratio]."""
+    w, h = box[2] - box[0], box[3] - box[1]
+    return np.array([box[0] + w / 2, box[1] + h / 2, w * h, w / h if h else 1.0])
+
+
+def x_to_box(x):
+    """Kalman state -> [x1, y1, x2, y2]."""
+    area, ratio = max(x[2], 1e-6), max(x[3], 1e-6)
+    w = np.sqrt(area * ratio)
+    h = area / w
+    return [x[0] - w / 2, x[1] - h / 2, x[0] + w / 2, x[1] + h / 2]
+
+
+class KalmanBoxTrack:
+    """One object: constant-velocity Kalman filter on box center and area (SORT)."""
+
+    # Measurement: cx, cy, area, aspect ratio; state adds their velocities (ratio is constant)
+    H = np.eye(4, 7)
+
+    def __init__(self, track_id, box, object_class, confidence):
+        self.id = track_id
+        self.object_class = object_class
+        self.confidence = confidence
+        self.x = np.zeros(7)
+        self.x[:4] = box_to_z(box)
+        self.P = np.eye(7) * 10.0
+        self.P[4:, 4:] *= 1000.0  # velocities are unknown at first
+        self.R = np.eye(4)
+        self.R[2:, 2:] *= 10.0
+        self.hits = 1
+        self.misses = 0
+        self.matched = True  # matched by the most recent detection
+
+    def predict(self, dt):
+        """Advance by dt frame intervals."""
+        F = np.eye(7)
+        F[0, 4] = F[1, 5] = F[2, 6] = dt
+        Q = np.eye(7)
+        Q[4:, 4:] *= 0.01
+        Q[6, 6] *= 0.01
+        if self.x[2] + self.x[6] * dt <= 0:
+            self.x[6] = 0.0
+        self.x = F @ self.x
+        self.P = F @ self.P @ F.T + Q * dt
+
+    def correct(self, box, confidence):
+        y = box_to_z(box) - self.H @ self.x
+        S = self.H @ self.P @ self.H.T + self.R
+        K = self.P @ self.H.T @ np.linalg.inv(S)
+        self.x = self.x + K @ y
+        self.P = (np.eye(7) - K @ self.H) @ self.P
+        self.confidence = confidence
+        self.hits += 1
+        self.misses = 0
+        self.matched = True
+
+    @property
+    def box(self):
+        return x_to_box(self.x)
+
+    def to_message(self):
+        return {
+            "id": self.id,
+            "class": self.object_class,
+            "box": [int(round(v)) for v in self.box],
+            "confidence": self.confidence,
+            "hits": self.hits,
+            "matched": self.matched,
+        }
+
+
+class Tracker:
+    """SORT-style multi-object tracker for one camera."""
+
+    def __init__(self, iou_threshold=TRACK_IOU_THRESHOLD, max_misses=TRACK_MAX_MISSES,
+                 min_hits=TRACK_MIN_HITS):
+        self.iou_threshold = iou_threshold
+        self.max_misses = max_misses
+        self.min_hits = min_hits
+        self.tracks = []
+        self.next_id = 1
+
+    def predict(self, dt):
+        for track in self.tracks:
+            track.predict(dt)
+
+    def update(self, detections):
+        """Match detections ({"class", "confidence", "box"}) to tracks; returns (matched IoUs, new, missed)."""
+        predicted = [track.box for track in self.tracks]
+        pairs = [
+            (iou(detection["box"], box), d, t)
+            for d, detection in enumerate(detections)
+            for t, box in enumerate(predicted)
+            if detection["class"] == self.tracks[t].object_class
+        ]
+        pairs.sort(key=lambda pair: pair[0], reverse=True)
+        used_detections, used_tracks, matched_ious = set(), set(), []
+        for overlap, d, t in pairs:
+            if overlap < self.iou_threshold:
+                break
+            if d in used_detections or t in used_tracks:
+                continue
+            used_detections.add(d)
+            used_tracks.add(t)
+            matched_ious.append(overlap)
+            self.tracks[t].correct(detections[d]["box"], detections[d]["confidence"])
+
+        missed = 0
+        kept = []
+        for t, track in enumerate(self.tracks):
+            if t not in used_tracks:
+                missed += 1
+                track.misses += 1
+                track.matched = False
+                if track.misses > self.max_misses:
+                    continue
+            kept.append(track)
+        self.tracks = kept
+
+        new = 0
+        for d, detection in enumerate(detections):
+            if d not in used_detections:
+                self.tracks.append(KalmanBoxTrack(self.next_id, detection["box"], detection["class"],
+                                                  detection["confidence"]))
+                self.next_id += 1
+                new += 1
+        return matched_ious, new, missed
+
+    def confirmed(self):
+        """Tracks seen by at least min_hits detections."""
+        return [track.to_message() for track in self.tracks if track.hits >= self.min_hits]
+
+
+class CameraTracker:
+    """Tracker plus the adaptive detection schedule for one camera."""
+
+    def __init__(self, fps=TRACK_FPS, interval_min=TRACK_DETECT_INTERVAL_MIN,
+                 interval_max=TRACK_DETECT_INTERVAL_MAX, stable_iou=TRACK_STABLE_IOU,
+                 reset_seconds=TRACK_RESET_SECONDS):
+        self.fps = fps
+        self.interval_min = interval_min
+        self.interval_max = interval_max
+        self.stable_iou = stable_iou
+        self.reset_seconds = reset_seconds
+        self.tracker = Tracker()
+        self.interval = interval_min
+        self.last_ts = None
+        self.last_detection = None
+        self.frames = 0
+        self.detections = 0
+
+    def advance(self, ts):
+        """Predict tracks forward to frame time ts (seconds); returns True if a detection is due."""
+        self.frames += 1
+        if ts is None:
+            return True
+        if self.last_ts is not None:
+            dt = ts - self.last_ts
+            if dt < -43200:
+                dt += 86400  # time-of-day stamps wrapped at midnight
+            if dt > self.reset_seconds or dt < 0:
+                # Motion ended and started again: old tracks are meaningless
+                self.tracker.tracks = []
+                self.interval = self.interval_min
+                self.last_detection = None
+            elif dt > 0:
+                # Filter tuned per frame interval, as in SORT
+                self.tracker.predict(dt * self.fps if self.fps else 1.0)
+        self.last_ts = ts
+        return self.last_detection is None or ts - self.last_detection >= self.interval \
+            or ts < self.last_detection
+
+    def observe(self, ts, detections):
+        """Feed a full detection at frame time ts and adapt the detection interval."""
+        self.detections += 1
+        matched_ious, new, missed = self.tracker.update(
+            [d for d in detections if d.get("box") is not None])
+        stable = not new and not missed and all(overlap >= self.stable_iou for overlap in matched_ious)
+        if stable:
+            self.interval = min(self.interval_max, self.interval * 1.5)
+        else:
+            self.interval = max(self.interval_min, self.interval / 2)
+        if ts is not None:
+            self.last_detection = ts
+        return self.tracker.confirmed()
+
+    def tracks(self):
+        return self.tracker.confirmed()
+
+    def take_stats(self):
+        """Return and reset (frames seen, detections run)."""
+        stats = (self.frames, self.detections)
+        self.frames = self.detections = 0
+        return stats
@@ -0,0 +1,275 @@
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+# Add parent directory to path to import config
+sys.path.append('.')
+
+from config import (
+    TSDB_DIR,
+    TSDB_RETENTION_DAYS,
+    TSDB_RAW_DAYS,
+    TSDB_COMPACT_STEP,
+    TSDB_FLUSH_INTERVAL,
+    TSDB_BATCH_SIZE,
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS points (
+    ts REAL NOT NULL,
+    node_id TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    value REAL
+);
+CREATE INDEX IF NOT EXISTS points_metric_ts ON points (metric, node_id, ts);
+CREATE TABLE IF NOT EXISTS events (
+    ts REAL NOT NULL,
+    node_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    data TEXT
+);
+CREATE INDEX IF NOT EXISTS events_kind_ts ON events (kind, ts);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Maintenance (compaction + retention) runs at most this often (seconds)
+MAINTENANCE_INTERVAL = 3600
+
+
+def segment_name(ts):
+    """Return the day segment file name (UTC) a timestamp belongs to."""
+    return datetime.fromtimestamp(ts, tz=timezone.utc).strftime("%Y%m%d") + ".db"
+
+
+def segment_day(name):
+    return datetime.strptime(name[:-3], "%Y%m%d").replace(tzinfo=timezone.utc)
+
+
+class TimeSeriesStore:
+    """
+    Append-only local store for metrics and events.
+
+    Data is partitioned into one SQLite file per UTC day (WAL mode).
+    Writes are buffered in memory and inserted in batches by a background
+    thread. Segments older than TSDB_RAW_DAYS are compacted into
+    TSDB_COMPACT_STEP averages and segments older than TSDB_RETENTION_DAYS
+    are deleted.
+    """
+
+    def __init__(self, path=TSDB_DIR, retention_days=TSDB_RETENTION_DAYS,
+                 raw_days=TSDB_RAW_DAYS, compact_step=TSDB_COMPACT_STEP,
+                 flush_interval=TSDB_FLUSH_INTERVAL, batch_size=TSDB_BATCH_SIZE):
+        self.path = path
+        self.retention_days = retention_days
+        self.raw_days = raw_days
+        self.compact_step = compact_step
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        os.makedirs(self.path, exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.points = []
+        self.events = []
+        self.wakeup = threading.Event()
+        self.stop_event = threading.Event()
+        self.last_maintenance = 0.0
+        self.thread = None
+
+    # --- Writing ---
+
+    def write_point(self, metric, value, node_id, ts=None):
+        self.write_points({metric: value}, node_id, ts)
+
+    def write_points(self, values, node_id, ts=None):
+        """Buffer a snapshot of numeric values taken at the same time."""
+        ts = time.time() if ts is None else ts
+        rows = [
+            (ts, node_id, metric, float(value))
+            for metric, value in values.items()
+            if isinstance(value, (int, float))
+        ]
+        with self.lock:
+            self.points.extend(rows)
+            pending = len(self.points)
+        if pending >= self.batch_size:
+            self.wakeup.set()
+
+    def write_event(self, kind, node_id, data, ts=None):
+        ts = time.time() if ts is None else ts
+        with self.lock:
+            self.events.append((ts, node_id, kind, json.dumps(data)))
+            pending = len(self.events)
+        if pending >= self.batch_size:
+            self.wakeup.set()
+
+    def _connect(self, name):
+        conn = sqlite3.connect(os.path.join(self.path, name))
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        return conn
+
+    def flush(self):
+        """Insert all buffered rows, one transaction per segment."""
+        with self.lock:
+            points, self.points = self.points, []
+            events, self.events = self.events, []
+        if not points and not events:
+            return
+
+        batches = {}
+        for row in points:
+            batches.setdefault(segment_name(row[0]), ([], []))[0].append(row)
+        for row in events:
+            batches.setdefault(segment_name(row[0]), ([], []))[1].append(row)
+
+        for name, (seg_points, seg_events) in batches.items():
+            conn = self._connect(name)
+            try:
+                with conn:
+                    conn.executemany("INSERT INTO points VALUES (?, ?, ?, ?)", seg_points)
+                    conn.executemany("INSERT INTO events VALUES (?, ?, ?, ?)", seg_events)
+            except sqlite3.Error as e:
+                logging.error(f"Failed to write metrics segment {name}: {e}")
+            finally:
+                conn.close()
+
+    # --- Maintenance ---
+
+    def segments(self):
+        return sorted(f for f in os.listdir(self.path) if f.endswith(".db"))
+
+    def compact(self, now=None):
+        """Replace raw points in old segments with per-step averages."""
+        now = time.time() if now is None else now
+        cutoff = datetime.fromtimestamp(now, tz=timezone.utc) - timedelta(days=self.raw_days)
+        step = self.compact_step
+        for name in self.segments():
+            if segment_day(name) + timedelta(days=1) > cutoff:
+                continue
+            conn = self._connect(name)
+            try:
+                done = conn.execute("SELECT value FROM meta WHERE key = 'compacted'").fetchone()
+                if done:
+                    continue
+                with conn:
+                    conn.execute("CREATE TEMP TABLE compacted AS "
+                                 "SELECT CAST(ts / ? AS INTEGER) * ? AS ts, node_id, metric, AVG(value) AS value "
+                                 "FROM points GROUP BY 1, node_id, metric", (step, step))
+                    conn.execute("DELETE FROM points")
+                    conn.execute("INSERT INTO points SELECT ts, node_id, metric, value FROM compacted")
+                    conn.execute("DROP TABLE compacted")
+                    conn.execute("INSERT OR REPLACE INTO meta VALUES ('compacted', ?)", (str(step),))
+                conn.execute("VACUUM")
+                logging.info(f"Compacted metrics segment {name} to {step}s resolution")
+            except sqlite3.Error as e:
+                logging.error(f"Failed to compact metrics segment {name}: {e}")
+            finally:
+                conn.close()
+
+    def apply_retention(self, now=None):
+        """Delete segments older than the retention period."""
+        now = time.time() if now is None else now
+        cutoff = datetime.fromtimestamp(now, tz=timezone.utc) - timedelta(days=self.retention_days)
+        for name in self.segments():
+            if segment_day(name) + timedelta(days=1) > cutoff:
+                continue
+            for suffix in ("", "-wal", "-shm"):
+                try:
+                    os.remove(os.path.join(self.path, name + suffix))
+                except FileNotFoundError:
+                    pass
+            logging.info(f"Removed expired metrics segment {name}")
+
+    def _writer_loop(self):
+        while not self.stop_event.is_set():
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
+            if time.time() - self.last_maintenance >= MAINTENANCE_INTERVAL:
+                self.last_maintenance = time.time()
+                self.apply_retention()
+                self.compact()
+        self.flush()
+
+    def start(self):
+        self.thread = threading.Thread(target=self._writer_loop, daemon=True)
+        self.thread.start()
+        return self
+
+    def close(self):
+        self.stop_event.set()
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join()
+        else:
+            self.flush()
+
+    # --- Range queries ---
+
+    def _segments_for(self, start, end):
+        first = segment_name(start)
+        last = segment_name(end)
+        return [name for name in self.segments() if first <= name <= last]
+
+    def _read(self, name, sql, params):
+        conn = sqlite3.connect(f"file:{os.path.join(self.path, name)}?mode=ro", uri=True)
+        try:
+            return conn.execute(sql, params).fetchall()
+        except sqlite3.Error as e:
+            logging.error(f"Failed to read metrics segment {name}: {e}")
+            return []
+        finally:
+            conn.close()
+
+    def query_points(self, node_id, metrics, start, end, step=None):
+        """
+        Return rows {'time': ts, metric: value, ...} for node_id in [start, end].
+
+        With step, values are averaged into buckets of `step` seconds.
+        """
+        placeholders = ", ".join("?" for _ in metrics)
+        if step:
+            sql = (f"SELECT CAST(ts / {float(step)} AS INTEGER) * {float(step)} AS t, metric, AVG(value) "
+                   f"FROM points WHERE node_id = ? AND metric IN ({placeholders}) AND ts BETWEEN ? AND ? "
+                   f"GROUP BY t, metric")
+        else:
+            sql = (f"SELECT ts, metric, value FROM points "
+                   f"WHERE node_id = ? AND metric IN ({placeholders}) AND ts BETWEEN ? AND ?")
+        params = (node_id, *metrics, start, end)
+
+        rows = {}
+        for name in self._segments_for(start, end):
+            for ts, metric, value in self._read(name, sql, params):
+                rows.setdefault(ts, {'time': ts})[metric] = value
+        return [rows[ts] for ts in sorted(rows)]
+
+    def query_events(self, kind, start, end, node_id=None, limit=None):
+        sql = "SELECT ts, node_id, data FROM events WHERE kind = ? AND ts BETWEEN ? AND ?"
+        params = [kind, start, end]
+        if node_id is not None:
+            sql += " AND node_id = ?"
+            params.append(node_id)
+        sql += " ORDER BY ts"
+
+        events = []
+        for name in self._segments_for(start, end):
+            for ts, event_node, data in self._read(name, sql, params):
+                events.append({'time': ts, 'node_id': event_node, 'data': json.loads(data)})
+                if limit and len(events) >= limit:
+                    return events
+        return events
+
+    def node_ids(self, start, end):
+        nodes = set()
+        for name in self._segments_for(start, end):
+            nodes.update(row[0] for row in self._read(name, "SELECT DISTINCT node_id FROM points", ()))
+        return sorted(nodes)
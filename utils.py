@@ -1,4 +1,11 @@
+import asyncio
+import hashlib
+import math
+import random
+import select
+import selectors
 import socket
+import struct
 import threading
 import time
 import json
@@ -7,12 +14,32 @@ import zmq
 import sys
 from datetime import datetime
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
 # Add parent directory to path to import config
 sys.path.append('.')
 
 from config import (
     DISCOVERY_BROADCAST,
     DISCOVERY_PORT,
+    DISCOVERY_INTERVAL,
+    DISCOVERY_JITTER,
+    DISCOVERY_TTL,
+    DISCOVERY_BURST,
+    DISCOVERY_BURST_INTERVAL,
+    MESSAGE_CODEC,
+    NETWORK_INTERFACE,
+    NETWORK_REFRESH_INTERVAL,
+    ZMQ_IO_THREADS,
+    ZMQ_IMAGE_HWM,
+    ZMQ_EVENT_HWM,
+    ZMQ_EVENT_LINGER_MS,
+    ZMQ_TCP_KEEPALIVE_IDLE,
+    ZMQ_TCP_KEEPALIVE_INTVL,
+    ZMQ_TCP_KEEPALIVE_CNT,
 )
 
 # Configure logging
@@ -27,22 +54,281 @@ console.setLevel(logging.INFO)
 formatter = logging.Formatter('%(asctime)s - %(message)s')
 logging.getLogger('').addHandler(console)
 
-class ZMQNode:
-    def __init__(self, node_suffix):
-        self.node_id = f"{socket.gethostname()}-{node_suffix}"
-        self.context = zmq.Context()
-        self.peers_info = {}
+# Linux netlink constants for address change notifications
+NETLINK_ROUTE = 0
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+SIOCGIFADDR = 0x8915
+
+
+def interface_ip(interface):
+    """Return the IPv4 address of a named interface, or None."""
+    try:
+        import fcntl
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            packed = struct.pack('256s', interface[:15].encode('utf-8'))
+            return socket.inet_ntoa(fcntl.ioctl(s.fileno(), SIOCGIFADDR, packed)[20:24])
+    except (ImportError, OSError):
+        return None
+
+
+def default_route_ip():
+    """Return the address used for the default route (no packets are sent)."""
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.connect(("8.8.8.8", 80))
+            return s.getsockname()[0]
+    except OSError:
+        return "127.0.0.1"
+
+
+class NetworkIdentity:
+    """
+    Process-wide cache of the local address advertised to peers.
+
+    The address is resolved once and refreshed by a background thread when
+    netlink reports a link/address change, or every NETWORK_REFRESH_INTERVAL
+    seconds where netlink is not available.
+    """
+
+    def __init__(self, interface=NETWORK_INTERFACE, refresh_interval=NETWORK_REFRESH_INTERVAL):
+        self.interface = interface
+        self.refresh_interval = refresh_interval
+        self.ip = None
+        self.listeners = []
+        self.refresh()
+        threading.Thread(target=self._watch_loop, daemon=True).start()
+
+    def resolve(self):
+        if self.interface:
+            ip = interface_ip(self.interface)
+            if ip:
+                return ip
+            logging.warning(f"Interface {self.interface} has no IPv4 address, using default route")
+        return default_route_ip()
+
+    def refresh(self):
+        ip = self.resolve()
+        if ip != self.ip:
+            if self.ip is not None:
+                logging.info(f"Local IP changed: {self.ip} -> {ip}")
+            self.ip = ip
+            for callback in self.listeners:
+                callback(ip)
+
+    def on_change(self, callback):
+        """Register callback(ip) called when the local address changes."""
+        self.listeners.append(callback)
+
+    def _open_netlink(self):
+        try:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+            sock.bind((0, RTMGRP_LINK | RTMGRP_IPV4_IFADDR))
+            return sock
+        except (AttributeError, OSError):
+            return None
+
+    def _watch_loop(self):
+        netlink = self._open_netlink()
+        while True:
+            try:
+                if netlink is not None:
+                    ready, _, _ = select.select([netlink], [], [], self.refresh_interval)
+                    if ready:
+                        netlink.recv(65536)
+                else:
+                    time.sleep(self.refresh_interval)
+                self.refresh()
+            except Exception as e:
+                logging.warning(f"Network identity refresh failed: {e}")
+                time.sleep(self.refresh_interval)
+
+
+_network_identity = None
+_network_identity_lock = threading.Lock()
+
+
+def get_network_identity():
+    """Return the NetworkIdentity shared by every node in this process."""
+    global _network_identity
+    with _network_identity_lock:
+        if _network_identity is None:
+            _network_identity = NetworkIdentity()
+        return _network_identity
+
+
+class DiscoveryService:
+    """
+    UDP broadcast peer discovery with TTL-based membership.
+
+    Every node broadcasts an announce at a jittered DISCOVERY_INTERVAL (with a
+    fast burst at startup and whenever a new peer shows up) and a "bye" on
+    shutdown. Received announces refresh a peer's last-seen time; peers not
+    heard from within DISCOVERY_TTL are dropped. on_join(peer_id, info) and
+    on_leave(peer_id, info) are called from the discovery thread.
+
+    Announces list every service the node offers, e.g.
+    {"motion.flag": {"endpoint": "tcp://10.0.0.5:5556", "capacity": 1}}.
+    """
+
+    def __init__(self, node_id, port, network, services=None, peers=None, on_join=None, on_leave=None,
+                 interval=DISCOVERY_INTERVAL, ttl=DISCOVERY_TTL):
+        self.node_id = node_id
+        self.port = port
+        self.network = network
+        self.services = services if services is not None else {}
+        self.peers = peers if peers is not None else {}
+        self.last_seen = {}
+        self.on_join = on_join
+        self.on_leave = on_leave
+        self.interval = interval
+        self.ttl = ttl
+        self.burst_remaining = DISCOVERY_BURST
         self.stop_event = threading.Event()
+        self.sock = None
+        self.thread = None
+        self._message_ip = None
+        self._announce = None
 
-    def get_local_ip(self):
+    def _message(self, msg_type):
+        ip = self.network.ip
+        services = {}
+        for service_type, hints in self.services.items():
+            record = {k: v for k, v in hints.items() if k != "port"}
+            record["endpoint"] = f"tcp://{ip}:{hints['port']}"
+            services[service_type] = record
+        return json.dumps({
+            "type": msg_type,
+            "node_id": self.node_id,
+            "ip": ip,
+            "port": self.port,
+            "services": services,
+        }).encode("utf-8")
+
+    def _send_announce(self):
+        # Encoded once and rebuilt only when the local address changes
+        if self._message_ip != self.network.ip:
+            self._message_ip = self.network.ip
+            self._announce = self._message("announce")
+        self.sock.sendto(self._announce, (DISCOVERY_BROADCAST, DISCOVERY_PORT))
+
+    def _next_announce_delay(self):
+        if self.burst_remaining > 0:
+            self.burst_remaining -= 1
+            return DISCOVERY_BURST_INTERVAL
+        return self.interval * random.uniform(1 - DISCOVERY_JITTER, 1 + DISCOVERY_JITTER)
+
+    def _handle(self, data, addr, now):
+        try:
+            message = json.loads(data.decode("utf-8"))
+        except (UnicodeDecodeError, ValueError):
+            return
+        peer_id = message.get("node_id")
+        msg_type = message.get("type")
+        if not peer_id or peer_id == self.node_id:
+            return
+
+        if msg_type == "bye":
+            self._remove(peer_id)
+        elif msg_type in {"discover", "announce"}:
+            info = {
+                "ip": message.get("ip") or addr[0],
+                "port": message.get("port", 0),
+                "services": message.get("services") or {},
+            }
+            self.last_seen[peer_id] = now
+            previous = self.peers.get(peer_id)
+            if previous == info:
+                return
+            if previous is not None:
+                self._remove(peer_id)
+                self.last_seen[peer_id] = now
+            self.peers[peer_id] = info
+            # Let the newcomer learn about us without waiting a full interval
+            self.burst_remaining = max(self.burst_remaining, 1)
+            if self.on_join:
+                self.on_join(peer_id, info)
+
+    def _remove(self, peer_id):
+        self.last_seen.pop(peer_id, None)
+        info = self.peers.pop(peer_id, None)
+        if info is not None and self.on_leave:
+            self.on_leave(peer_id, info)
+
+    def _expire(self, now):
+        for peer_id, seen in list(self.last_seen.items()):
+            if now - seen > self.ttl:
+                self._remove(peer_id)
+
+    def _step(self, next_announce):
+        """Announce if due and expire peers; return (next_announce, wait timeout)."""
+        now = time.monotonic()
+        if now >= next_announce:
+            try:
+                self._send_announce()
+            except OSError as e:
+                logging.warning(f"[Discovery:{self.node_id}] Announce failed: {e}")
+            next_announce = now + self._next_announce_delay()
+        self._expire(now)
+        expiry = min(self.last_seen.values(), default=now) + self.ttl
+        return next_announce, max(0.0, min(next_announce, expiry, now + 1.0) - now)
+
+    def _drain(self, next_announce):
+        """Handle every pending datagram; return the possibly advanced next announce time."""
+        while True:
+            try:
+                data, addr = self.sock.recvfrom(4096)
+            except (BlockingIOError, InterruptedError):
+                break
+            self._handle(data, addr, time.monotonic())
+        # A new peer may have requested a fast reply
+        if self.burst_remaining > 0:
+            next_announce = min(next_announce, time.monotonic() + DISCOVERY_BURST_INTERVAL)
+        return next_announce
+
+    def _close(self):
         try:
-            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
-                s.connect(("8.8.8.8", 80))
-                return s.getsockname()[0]
+            self.sock.sendto(self._message("bye"), (DISCOVERY_BROADCAST, DISCOVERY_PORT))
         except OSError:
-            return "127.0.0.1"
+            pass
+        self.sock.close()
+
+    def _loop(self):
+        selector = selectors.DefaultSelector()
+        selector.register(self.sock, selectors.EVENT_READ)
+        next_announce = time.monotonic()
+
+        while not self.stop_event.is_set():
+            next_announce, timeout = self._step(next_announce)
+            if selector.select(timeout):
+                next_announce = self._drain(next_announce)
+
+        selector.close()
+        self._close()
+
+    async def run_async(self):
+        """Run discovery as an asyncio task on the running loop instead of a thread."""
+        if self.sock is None:
+            return
+        loop = asyncio.get_running_loop()
+        readable = asyncio.Event()
+        loop.add_reader(self.sock, readable.set)
+        next_announce = time.monotonic()
+        try:
+            while not self.stop_event.is_set():
+                next_announce, timeout = self._step(next_announce)
+                try:
+                    await asyncio.wait_for(readable.wait(), timeout)
+                except asyncio.TimeoutError:
+                    continue
+                readable.clear()
+                next_announce = self._drain(next_announce)
+        finally:
+            loop.remove_reader(self.sock)
+            self._close()
 
-    def discovery_loop(self):
+    def open(self):
+        """Bind the discovery socket; return False if discovery is unavailable."""
         sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
@@ -51,56 +337,341 @@ class ZMQNode:
         except OSError as e:
             logging.warning(f"Discovery port {DISCOVERY_PORT} already in use: {e}. Skipping discovery.")
             sock.close()
+            return False
+        sock.setblocking(False)
+        self.sock = sock
+        return True
+
+    def start(self):
+        if self.open():
+            self.thread = threading.Thread(target=self._loop, daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout=2)
+
+
+# Socket options per stream class
+SOCKET_PROFILES = {
+    # Images: tiny queues so a slow consumer drops frames instead of lagging behind
+    "bulk": {"hwm": ZMQ_IMAGE_HWM, "linger": 0, "conflate": False},
+    # Telemetry: only the newest sample matters
+    "latest": {"hwm": 1, "linger": 0, "conflate": True},
+    # Events (motion flags, detections): deep queues, flushed on close
+    "reliable": {"hwm": ZMQ_EVENT_HWM, "linger": ZMQ_EVENT_LINGER_MS, "conflate": False},
+}
+
+# Socket types that queue outgoing messages per peer. CONFLATE keeps one
+# message per socket, not per peer, so receiving sockets only conflate when
+# the caller knows they have a single source
+SENDING_SOCKET_TYPES = {zmq.PUB, zmq.XPUB, zmq.PUSH}
+
+
+def make_context(io_threads=ZMQ_IO_THREADS):
+    return zmq.Context(io_threads=io_threads)
+
+
+def make_socket(context, socket_type, profile, single_source=False):
+    """Create a socket tuned for a stream class from SOCKET_PROFILES."""
+    options = SOCKET_PROFILES[profile]
+    sock = context.socket(socket_type)
+    sock.setsockopt(zmq.SNDHWM, options["hwm"])
+    sock.setsockopt(zmq.RCVHWM, options["hwm"])
+    sock.setsockopt(zmq.LINGER, options["linger"])
+    if options["conflate"] and (socket_type in SENDING_SOCKET_TYPES or single_source):
+        sock.setsockopt(zmq.CONFLATE, 1)
+    # Only queue messages to peers whose connection is complete
+    sock.setsockopt(zmq.IMMEDIATE, 1)
+    # Detect dead TCP peers instead of keeping half-open connections
+    sock.setsockopt(zmq.TCP_KEEPALIVE, 1)
+    sock.setsockopt(zmq.TCP_KEEPALIVE_IDLE, ZMQ_TCP_KEEPALIVE_IDLE)
+    sock.setsockopt(zmq.TCP_KEEPALIVE_INTVL, ZMQ_TCP_KEEPALIVE_INTVL)
+    sock.setsockopt(zmq.TCP_KEEPALIVE_CNT, ZMQ_TCP_KEEPALIVE_CNT)
+    return sock
+
+
+# Every message is a single frame "<topic>\0<payload>" so SUB sockets can
+# filter on the topic prefix at the publisher. A single frame (rather than a
+# multipart topic envelope) keeps CONFLATE usable on telemetry sockets.
+TOPIC_SEPARATOR = b"\0"
+
+# Topic kinds; the full topic is "<kind>.<node_id>"
+TOPIC_MOTION_FLAG = "motion.flag"
+TOPIC_IMAGE = "image"
+TOPIC_DETECTION = "detection"
+TOPIC_SYSTEM_STATUS = "system_status"
+TOPIC_TRACK_FRAME = "track"  # frames shared while motion lasts, for tracking
+TOPIC_TRACKS = "tracks"
+
+
+# Known message types are packed as msgpack arrays in this field order, so
+# keys are not repeated in every message. Tags must never change meaning: a
+# new layout gets a new tag and old tags stay decodable, so nodes running
+# different versions still understand each other. The encoder picks the tag
+# whose fields match the message's keys exactly.
+MESSAGE_SCHEMAS = {
+    b"F": ("motion_flag", ("node_id", "flag", "ts")),
+    b"I": ("image", ("node_id", "size", "image_data", "ts")),
+    b"D": ("detection_results", ("node_id", "sender", "detections", "ts")),
+    # With camera_id (multi-camera motion nodes)
+    b"f": ("motion_flag", ("node_id", "camera_id", "flag", "ts")),
+    b"i": ("image", ("node_id", "camera_id", "size", "image_data", "ts")),
+    b"d": ("detection_results", ("node_id", "sender", "camera_id", "detections", "ts")),
+    # Sequenced motion flags (replay.SequencedPublisher)
+    b"q": ("motion_flag", ("node_id", "camera_id", "flag", "ts", "seq", "epoch")),
+    b"T": ("tracks", ("node_id", "sender", "camera_id", "tracks", "detected", "ts")),
+    b"S": ("system_status", (
+        "node_id", "timestamp", "cpu",
+        "memory_used_gb", "memory_total_gb", "memory_percent",
+        "disk_read_kbs", "disk_write_kbs", "network_send_kbs", "network_recv_kbs",
+        "temperature", "gpu",
+    )),
+    # With storage metrics (system_monitor.StorageManager)
+    b"s": ("system_status", (
+        "node_id", "timestamp", "cpu",
+        "memory_used_gb", "memory_total_gb", "memory_percent",
+        "disk_read_kbs", "disk_write_kbs", "network_send_kbs", "network_recv_kbs",
+        "temperature", "gpu",
+        "disk_free_gb", "storage_used_gb", "storage_added_kbs", "storage_deleted_kbs",
+    )),
+}
+MSGPACK_MAP_TAG = b"m"
+
+
+class MessageCodec:
+    """
+    Encode message dicts to payload bytes.
+
+    The first byte tags the encoding: a schema tag from MESSAGE_SCHEMAS, "m"
+    for a generic msgpack map, or "{" for plain JSON. Decoding accepts every
+    tag regardless of the configured encoder, so nodes with different
+    settings interoperate.
+    """
+
+    def __init__(self, name=MESSAGE_CODEC):
+        if name == "msgpack" and msgpack is None:
+            logging.warning("msgpack is not installed, falling back to JSON messages")
+            name = "json"
+        self.name = name
+        self.schemas = {
+            (msg_type, frozenset(("type", *fields))): (tag, fields)
+            for tag, (msg_type, fields) in MESSAGE_SCHEMAS.items()
+        }
+
+    def encode(self, message):
+        if self.name == "json":
+            return json.dumps(message).encode("utf-8")
+        schema = self.schemas.get((message.get("type"), frozenset(message)))
+        if schema is not None:
+            tag, fields = schema
+            return tag + msgpack.packb([message[field] for field in fields])
+        return MSGPACK_MAP_TAG + msgpack.packb(message)
+
+    def decode(self, data):
+        tag = data[:1]
+        if tag == b"{":
+            return json.loads(data)
+        if msgpack is None:
+            raise ValueError("Received a msgpack message but msgpack is not installed")
+        if tag == MSGPACK_MAP_TAG:
+            return msgpack.unpackb(data[1:])
+        msg_type, fields = MESSAGE_SCHEMAS[tag]
+        message = dict(zip(fields, msgpack.unpackb(data[1:])))
+        message["type"] = msg_type
+        return message
+
+
+codec = MessageCodec()
+
+
+def make_topic(kind, node_id, camera_id=None):
+    if camera_id is not None:
+        return f"{kind}.{node_id}/{camera_id}"
+    return f"{kind}.{node_id}"
+
+
+def subscribe(sock, kind, node_id=None, camera_id=None):
+    """Subscribe to one topic kind, optionally from a single node (and camera) only."""
+    prefix = f"{kind}.".encode("utf-8")
+    if node_id is None:
+        sock.setsockopt(zmq.SUBSCRIBE, prefix)
+        return
+    prefix += node_id.encode("utf-8")
+    if camera_id is not None:
+        sock.setsockopt(zmq.SUBSCRIBE, prefix + f"/{camera_id}".encode("utf-8") + TOPIC_SEPARATOR)
+    else:
+        # The node's own topic and all of its per-camera topics
+        sock.setsockopt(zmq.SUBSCRIBE, prefix + TOPIC_SEPARATOR)
+        sock.setsockopt(zmq.SUBSCRIBE, prefix + b"/")
+
+
+def encode_frame(topic, message):
+    return topic.encode("utf-8") + TOPIC_SEPARATOR + codec.encode(message)
+
+
+def decode_frame(data):
+    """Split a received frame into (topic, message)."""
+    topic, _, payload = data.partition(TOPIC_SEPARATOR)
+    return topic.decode("utf-8"), codec.decode(payload)
+
+
+def send_message(sock, topic, message):
+    sock.send(encode_frame(topic, message))
+
+
+def recv_message(sock):
+    """Receive one message, returning (topic, message)."""
+    return decode_frame(sock.recv())
+
+
+def _rendezvous_score(consumer_id, provider_id, capacity):
+    """Weighted highest-random-weight score of a consumer for a provider."""
+    digest = hashlib.sha1(f"{consumer_id}|{provider_id}".encode("utf-8")).digest()
+    h = (int.from_bytes(digest[:8], "big") + 1) / float(2 ** 64 + 1)
+    return -capacity / math.log(h)
+
+
+def _service_endpoint(record, prefer_ipc=True):
+    """Prefer a provider's ipc:// endpoint when it runs on this host, else its TCP endpoint."""
+    if prefer_ipc and record.get("ipc") and record.get("host") == socket.gethostname():
+        return record["ipc"]
+    return record["endpoint"]
+
+
+class ServiceSubscription:
+    """
+    Keep a SUB socket connected to every provider of one service type.
+
+    With share_with set, consumers that advertise that service type split the
+    providers between them by weighted rendezvous hashing on their capacity
+    hint, so each provider is consumed by exactly one of them. Membership
+    changes only mark the subscription dirty; apply() must be called from the
+    thread that owns the socket.
+    """
+
+    def __init__(self, node, sock, service_type, share_with=None, prefer_ipc=True):
+        self.node = node
+        self.sock = sock
+        self.service_type = service_type
+        self.prefer_ipc = prefer_ipc
+        self.share_with = share_with
+        self.connected = {}
+        # Wall time each provider was connected, for replaying what the
+        # subscription missed while it propagated
+        self.connected_at = {}
+        self.dirty = threading.Event()
+        self.dirty.set()
+
+    def wanted(self):
+        peers = dict(list(self.node.peers_info.items()))
+        providers = {
+            peer_id: _service_endpoint(info["services"][self.service_type], self.prefer_ipc)
+            for peer_id, info in peers.items()
+            if self.service_type in info.get("services", {})
+        }
+        if self.share_with is None:
+            return providers
+
+        consumers = {
+            peer_id: info["services"][self.share_with].get("capacity", 1)
+            for peer_id, info in peers.items()
+            if self.share_with in info.get("services", {})
+        }
+        consumers[self.node.node_id] = self.node.services.get(self.share_with, {}).get("capacity", 1)
+        return {
+            provider_id: endpoint
+            for provider_id, endpoint in providers.items()
+            if max(consumers, key=lambda c: _rendezvous_score(c, provider_id, consumers[c])) == self.node.node_id
+        }
+
+    def apply(self):
+        """Connect to new providers and disconnect from departed or reassigned ones."""
+        if not self.dirty.is_set():
             return
-        sock.settimeout(1.0)
+        self.dirty.clear()
+        wanted = self.wanted()
+        for peer_id, endpoint in list(self.connected.items()):
+            if wanted.get(peer_id) != endpoint:
+                self.sock.disconnect(endpoint)
+                del self.connected[peer_id]
+                self.connected_at.pop(peer_id, None)
+                logging.info(f"[{self.service_type}] Disconnected from {peer_id} at {endpoint}")
+        for peer_id, endpoint in wanted.items():
+            if peer_id not in self.connected:
+                self.sock.connect(endpoint)
+                self.connected[peer_id] = endpoint
+                self.connected_at[peer_id] = time.time()
+                logging.info(f"[{self.service_type}] Connected to {peer_id} at {endpoint}")
 
-        while not self.stop_event.is_set():
-            try:
-                sock.sendto(
-                    json.dumps(
-                        {
-                            "type": "discover",
-                            "node_id": self.node_id,
-                            "ip": self.get_local_ip(),
-                            "port": getattr(self, 'pub_port', 0),  # Subclass should set this
-                        }
-                    ).encode("utf-8"),
-                    (DISCOVERY_BROADCAST, DISCOVERY_PORT),
-                )
-
-                data, addr = sock.recvfrom(4096)
-                message = json.loads(data.decode("utf-8"))
-
-                if message.get("node_id") != self.node_id and message.get("type") in {"discover", "announce"}:
-                    peer_id = message.get("node_id")
-                    if peer_id:
-                        self.peers_info[peer_id] = {
-                            "ip": message.get("ip") or addr[0],
-                            "port": message.get("port", 0),
-                        }
-
-                        if message.get("type") == "discover":
-                            sock.sendto(
-                                json.dumps({
-                                    "type": "announce",
-                                    "node_id": self.node_id,
-                                    "ip": self.get_local_ip(),
-                                    "port": getattr(self, 'pub_port', 0),
-                                }).encode("utf-8"), (addr[0], DISCOVERY_PORT)
-                            )
-            except Exception:
-                pass
-
-            if self.peers_info:
-                print(f"[Discovery:{self.node_id}] Known peers: {list(self.peers_info.keys())}")
-            time.sleep(15 if self.peers_info else 2)
-
-        sock.close()
+
+class ZMQNode:
+    def __init__(self, node_suffix):
+        self.node_id = f"{socket.gethostname()}-{node_suffix}"
+        self.context = make_context()
+        self.network = get_network_identity()
+        self.peers_info = {}
+        self.services = {}
+        self.subscriptions = []
+        self.discovery = None
+        self.stop_event = threading.Event()
+
+    def get_local_ip(self):
+        """Cached local address; never touches the network."""
+        return self.network.ip
+
+    def socket(self, socket_type, profile, single_source=False):
+        """Create a socket on this node's context using a named stream profile."""
+        return make_socket(self.context, socket_type, profile, single_source)
+
+    def advertise(self, service_type, port, **hints):
+        """Offer a service in discovery announces, e.g. advertise("detection", 5558, capacity=2)."""
+        self.services[service_type] = {"port": port, **hints}
+
+    def subscribe_service(self, sock, service_type, share_with=None, prefer_ipc=True):
+        """Connect sock to providers of service_type as they come and go."""
+        subscription = ServiceSubscription(self, sock, service_type, share_with, prefer_ipc)
+        self.subscriptions.append(subscription)
+        return subscription
+
+    def resolve(self, service_type):
+        """Return {peer_id: service record} for every known provider of service_type."""
+        return {
+            peer_id: info["services"][service_type]
+            for peer_id, info in list(self.peers_info.items())
+            if service_type in info.get("services", {})
+        }
+
+    def on_peer_join(self, peer_id, info):
+        """Called from the discovery thread when a peer appears. Override as needed."""
+        logging.info(f"[Discovery:{self.node_id}] Peer joined: {peer_id} offering {list(info.get('services', {}))}")
+        for subscription in self.subscriptions:
+            subscription.dirty.set()
+
+    def on_peer_leave(self, peer_id, info):
+        """Called from the discovery thread when a peer leaves or expires."""
+        logging.info(f"[Discovery:{self.node_id}] Peer left: {peer_id}")
+        for subscription in self.subscriptions:
+            subscription.dirty.set()
+
+    def make_discovery(self):
+        return DiscoveryService(
+            self.node_id,
+            getattr(self, 'pub_port', 0),  # Subclass should set this
+            self.network,
+            services=self.services,
+            peers=self.peers_info,
+            on_join=self.on_peer_join,
+            on_leave=self.on_peer_leave,
+        )
 
     def start_discovery(self):
-        discovery_thread = threading.Thread(target=self.discovery_loop, daemon=True)
-        discovery_thread.start()
+        self.discovery = self.make_discovery().start()
 
     def cleanup(self):
         self.stop_event.set()
+        if self.discovery is not None:
+            self.discovery.stop()
         self.context.term()
\ No newline at end of file